@@ -0,0 +1,10 @@
+"""
+Замеры производительности сканеров. Запускаются из корня репозитория:
+
+    python3 -m bench.mls_guids
+    python3 -m bench.card_encoding
+    python3 -m bench.card_shots "host=... dbname=..."
+    python3 -m bench.sold_candidates "host=... dbname=..."
+
+Замерам с БД нужна отдельная (не боевая) база со схемой scan_domclick_v2/db.sql.
+"""
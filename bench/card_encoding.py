@@ -0,0 +1,116 @@
+"""
+Кодирование карточек страницы: как было до encode_card (json.dumps на каждое
+использование) и как сейчас (карточка кодируется один раз, байты идут в хеш,
+в параметр add_card_shots_v2 и в тело сообщения DIP).
+
+Замеряется путь одной страницы в Python: разбор ответа API, параметры запроса к БД,
+хеш карточки, размер для DipBatcher и тело сообщения DIP. Экономия в браузере
+(JSON.parse и передача объекта через CDP) сюда не входит.
+
+    python3 -m bench.card_encoding --runs 300
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import time
+
+from scan_base import serialization
+from scan_base.card_hashes import card_hash
+from scan_base.send_to_dip import build_dip_body, build_dip_message
+from scan_base.serialization import decode_all, encode_card, loads
+from scan_domclick_v2.const import CARD_HASH_IGNORE_KEYS, DIP_MODULE_ID
+
+FILE_NAME = 'domclick-sale-flat-msk'
+
+
+def make_card(i: int) -> dict:
+    """Карточка, похожая по размеру и структуре на объявление Домклика"""
+    rnd = random.Random(i)
+    return {
+        'id': 2_000_000_000 + i,
+        'path': f'/card/sale__flat__{2_000_000_000 + i}',
+        'price': rnd.randint(3_000_000, 90_000_000),
+        'dealType': 'sale',
+        'offerType': 'flat',
+        'address': {
+            'displayName': f'Москва, улица Профсоюзная, {rnd.randint(1, 150)}к{rnd.randint(1, 5)}',
+            'locality': {'id': 1, 'name': 'Москва'},
+            'position': {'lat': 55.6 + rnd.random() / 10, 'lon': 37.5 + rnd.random() / 10},
+        },
+        'objectInfo': {
+            'area': round(rnd.uniform(20, 150), 1),
+            'rooms': rnd.randint(1, 5),
+            'floor': rnd.randint(1, 25),
+            'kitchenArea': round(rnd.uniform(5, 25), 1),
+        },
+        'house': {'floors': 25, 'buildYear': rnd.randint(1950, 2025), 'wallType': 'монолитно-кирпичный'},
+        'photos': [{'url': f'https://img.domclick.ru/{i}/{n}.jpg', 'width': 1280, 'height': 960} for n in range(12)],
+        'description': 'Продается светлая квартира с хорошим ремонтом, рядом метро и парк. ' * 8,
+        'seller': {'type': 'agent', 'name': 'Агентство недвижимости', 'isVerified': True},
+        'badges': ['Проверено Домклик', 'Онлайн-сделка'],
+        'publishedDate': '2026-10-01T12:00:00+03:00',
+        'updatedDate': '2026-10-17T09:30:00+03:00',
+    }
+
+
+def page_before(text: str) -> int:
+    """Путь страницы до encode_card: json.dumps на каждое использование карточки"""
+    items = json.loads(text)['result']['items']
+    card_jsons = [json.dumps(card) for card in items]
+    hashes = []
+    for card in items:
+        if CARD_HASH_IGNORE_KEYS:
+            card = {k: v for k, v in card.items() if k not in CARD_HASH_IGNORE_KEYS}
+        payload = json.dumps(card, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        hashes.append(hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest())
+    batch_bytes = sum(len(json.dumps(card).encode('utf-8')) for card in items)
+    body = json.dumps(build_dip_message(items, DIP_MODULE_ID, FILE_NAME)).encode('utf-8')
+    return len(card_jsons) + len(hashes) + batch_bytes + len(body)
+
+
+def page_after(text: str) -> int:
+    """Текущий путь: карточка кодируется один раз"""
+    items = loads(text)['result']['items']
+    encoded = [encode_card(card) for card in items]
+    hashes = [card_hash(card, CARD_HASH_IGNORE_KEYS, encoded=e) for card, e in zip(items, encoded)]
+    card_jsons = decode_all(encoded)
+    batch_bytes = sum(len(e) for e in encoded)
+    body = build_dip_body(encoded, DIP_MODULE_ID, FILE_NAME)
+    return len(card_jsons) + len(hashes) + batch_bytes + len(body)
+
+
+def measure(func, text: str, runs: int) -> float:
+    """Среднее время на страницу, мс"""
+    func(text)
+    started = time.perf_counter()
+    for _ in range(runs):
+        func(text)
+    return (time.perf_counter() - started) / runs * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=300, help='сколько раз обработать страницу')
+    parser.add_argument('--cards', type=int, default=20, help='карточек на странице')
+    args = parser.parse_args()
+
+    text = json.dumps({'result': {'items': [make_card(i) for i in range(args.cards)]}}, ensure_ascii=False)
+    print(f"📊 Страница из {args.cards} карточек ({len(text.encode('utf-8')) // 1024} КБ), {args.runs} повторов")
+
+    before = measure(page_before, text, args.runs)
+    print(f"   до encode_card: {before:.2f} мс")
+
+    orjson = serialization.orjson
+    if orjson is not None:
+        print(f"   сейчас (orjson): {measure(page_after, text, args.runs):.2f} мс")
+    serialization.orjson = None
+    try:
+        print(f"   сейчас (json): {measure(page_after, text, args.runs):.2f} мс")
+    finally:
+        serialization.orjson = orjson
+
+
+if __name__ == '__main__':
+    main()
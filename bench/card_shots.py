@@ -0,0 +1,119 @@
+"""
+Сохранение карточек в БД: по одной (add_card_shot_v2, commit на каждую карточку)
+против пачки (add_card_shots_v2, один запрос и один commit на CARD_SHOT_BATCH_SIZE карточек).
+Страница Домклика - PAGE_SIZE карточек (limit в build_scan_url), --batch-size сравнивает
+пачки разного размера (по умолчанию CARD_SHOT_BATCH_SIZE).
+
+Нужна отдельная (не боевая) БД со схемой scan_domclick_v2/db.sql. Замер заводит свою
+сессию и карточки с external_id из диапазона BENCH_EXTERNAL_ID и в конце удаляет их.
+Каждый способ замеряется дважды: новые карточки (insert) и те же карточки
+в следующей сессии (update, как при обычном повторном сканировании).
+
+    python3 -m bench.card_shots "host=localhost port=5432 dbname=scan_bench user=... password=..." --pages 50
+
+Результаты (PostgreSQL 16 на той же машине, подключение через unix-сокет, 500 страниц,
+два запуска на каждый размер пачки, мс на страницу; новые / повторно):
+
+    по одной:            8.8-11.4 / 10.5-15.0
+    пачки по 5:          6.9-7.6  / 7.7-8.2
+    пачки по 10:         3.7-4.8  / 4.5
+    пачки по 20:         4.0-5.0  / 3.8-4.1
+
+Пачка в целую страницу (CARD_SHOT_BATCH_SIZE = PAGE_SIZE = 20) в 2.5-3 раза быстрее записи
+по одной. Локально пачки по 10 и по 20 не различимы, но пачка в страницу - это один запрос
+и один commit на страницу, а по сети к БД каждый лишний запрос стоит еще и задержку сети.
+Больше страницы пачка не бывает: process_items пишет одну страницу.
+"""
+
+import argparse
+import time
+
+from bench.card_encoding import make_card
+from scan_base.db import connect_to_db
+from scan_domclick_v2.const import CARD_SHOT_BATCH_SIZE
+from scan_domclick_v2.main import add_card_shot, add_card_shots
+
+# Такие external_id у Домклика не встречаются
+BENCH_EXTERNAL_ID = 9_000_000_000_000
+# Объявлений на странице Домклика (limit в build_scan_url)
+PAGE_SIZE = 20
+
+
+def create_session(conn) -> int:
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO scan_sessionlar_v2 (started_at, region, facet, min_price, page_num)
+            VALUES (now(), (SELECT min(id) FROM regionlar_v2), (SELECT min(id) FROM facetlar_v2), 0, 1)
+            RETURNING id
+        """)
+        session = cursor.fetchone()[0]
+    conn.commit()
+    return session
+
+
+def cleanup(conn, sessions) -> None:
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM card_shotlar_v2 WHERE external_id >= %s", (BENCH_EXTERNAL_ID,))
+        cursor.execute("DELETE FROM scan_sessionlar_v2 WHERE id = ANY(%s)", (list(sessions),))
+    conn.commit()
+
+
+def make_pages(first_id: int, pages: int):
+    """Страницы по PAGE_SIZE карточек: списки (external_id, external_url, card)"""
+    result = []
+    for page in range(pages):
+        cards = []
+        for n in range(PAGE_SIZE):
+            external_id = first_id + page * PAGE_SIZE + n
+            card = make_card(external_id - first_id)
+            card['id'] = external_id
+            cards.append((external_id, f"https://domclick.ru/card/sale__flat__{external_id}", card))
+        result.append(cards)
+    return result
+
+
+def save_single(conn, db_config: str, session: int, pages, batch_size: int):
+    for cards in pages:
+        for external_id, external_url, card in cards:
+            card_id, conn = add_card_shot(conn, session, external_id, external_url, card, db_config=db_config)
+    return conn
+
+
+def save_batched(conn, db_config: str, session: int, pages, batch_size: int):
+    for cards in pages:
+        for start in range(0, len(cards), batch_size):
+            card_ids, conn = add_card_shots(conn, session, cards[start:start + batch_size], db_config=db_config)
+    return conn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db_config', help='строка подключения к отдельной БД для замеров')
+    parser.add_argument('--pages', type=int, default=50, help='сколько страниц сохранить каждым способом')
+    parser.add_argument('--batch-size', type=int, default=CARD_SHOT_BATCH_SIZE, help='карточек в одной пачке add_card_shots')
+    args = parser.parse_args()
+
+    conn = connect_to_db(args.db_config)
+    sessions = []
+    cards_count = args.pages * PAGE_SIZE
+    print(f"📊 {args.pages} страниц по {PAGE_SIZE} карточек, пачки по {args.batch_size}")
+    try:
+        for name, save, first_id in (
+            ('по одной', save_single, BENCH_EXTERNAL_ID),
+            (f'пачками по {args.batch_size}', save_batched, BENCH_EXTERNAL_ID + cards_count),
+        ):
+            pages = make_pages(first_id, args.pages)
+            for stage in ('новые', 'повторно'):
+                session = create_session(conn)
+                sessions.append(session)
+                started = time.perf_counter()
+                conn = save(conn, args.db_config, session, pages, args.batch_size)
+                elapsed = time.perf_counter() - started
+                print(f"   {name}, {stage}: {elapsed:.2f} c ({elapsed / args.pages * 1000:.1f} мс на страницу)")
+    finally:
+        cleanup(conn, sessions)
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Поиск guid в MLS: запрос на каждый external_id (get_mls_guid) против
+пачек по MLS_GUID_BATCH_SIZE одним terms-запросом (get_mls_guids_bulk).
+
+Elasticsearch заменен локальным HTTP-сервером, который отвечает с задержкой
+--latency миллисекунд (сеть и работа Elasticsearch). Оба варианта работают
+через общую keep-alive сессию в MLS_CONCURRENCY потоков, как mark_sold_concurrently.
+Сервер и клиент делят один процесс (и GIL), поэтому время одного запроса завышено;
+число запросов к Elasticsearch от этого не зависит.
+
+    python3 -m bench.mls_guids --ids 5000 --latency 5
+"""
+
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from scan_base import send_sold_to_mls
+from scan_base.send_sold_to_mls import (
+    MLS_CONCURRENCY,
+    MLS_GUID_BATCH_SIZE,
+    create_mls_http_session,
+    get_mls_guid,
+    get_mls_guids_bulk,
+)
+
+PROJECT = 24
+
+
+def guid_for(external_id) -> str:
+    return f'guid-{external_id}'
+
+
+class FakeElastic(ThreadingHTTPServer):
+    """Индекс MLS, в котором у каждого external_id один guid"""
+    daemon_threads = True
+
+    def __init__(self, latency: float):
+        self.requests = 0
+        # scroll_id -> {'ids': найденные external_id, 'offset': сколько уже отдано, 'size': размер страницы}
+        self.scrolls = {}
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Заголовки и тело уходят разными пакетами: без этого ответ ждет delayed ACK клиента
+            disable_nagle_algorithm = True
+
+            def _answer(self, hits, scroll_id=None):
+                with server._lock:
+                    server.requests += 1
+                time.sleep(latency)
+                answer = {'hits': {'hits': hits}}
+                if scroll_id is not None:
+                    answer['_scroll_id'] = scroll_id
+                body = json.dumps(answer).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                # q=external_id:<id> AND project_id:... AND deal_status_id:1
+                q = parse_qs(urlparse(self.path).query)['q'][0]
+                external_id = q.split()[0].split(':')[1]
+                self._answer([{'_source': {'guid': guid_for(external_id), 'external_id': external_id}}])
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if urlparse(self.path).path == '/_search/scroll':
+                    scroll_id = request['scroll_id']
+                else:
+                    ids = request['query']['bool']['filter'][0]['terms']['external_id']
+                    with server._lock:
+                        scroll_id = str(len(server.scrolls))
+                        server.scrolls[scroll_id] = {'ids': ids, 'offset': 0, 'size': request['size']}
+                with server._lock:
+                    scroll = server.scrolls[scroll_id]
+                    page = scroll['ids'][scroll['offset']:scroll['offset'] + scroll['size']]
+                    scroll['offset'] += scroll['size']
+                self._answer([{'_source': {'guid': guid_for(i), 'external_id': i}} for i in page], scroll_id)
+
+            def do_DELETE(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with server._lock:
+                    for scroll_id in request['scroll_id']:
+                        server.scrolls.pop(scroll_id, None)
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        super().__init__(('127.0.0.1', 0), Handler)
+
+
+def run(name: str, func, tasks, server: FakeElastic) -> dict:
+    server.requests = 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=MLS_CONCURRENCY) as executor:
+        results = list(executor.map(func, tasks))
+    elapsed = time.monotonic() - started
+    print(f"   {name}: {elapsed:.2f} c, запросов к Elasticsearch {server.requests}")
+    return {'elapsed': elapsed, 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ids', type=int, default=5000, help='сколько external_id искать')
+    parser.add_argument('--latency', type=float, default=5.0, help='задержка ответа Elasticsearch, мс')
+    args = parser.parse_args()
+
+    server = FakeElastic(args.latency / 1000)
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/mls/'
+    send_sold_to_mls.MLS_MSK_ELASTIC_URL = send_sold_to_mls.MLS_RGN_ELASTIC_URL = url
+
+    external_ids = list(range(10_000_000, 10_000_000 + args.ids))
+    batches = [external_ids[i:i + MLS_GUID_BATCH_SIZE] for i in range(0, len(external_ids), MLS_GUID_BATCH_SIZE)]
+    session = create_mls_http_session()
+
+    print(f"📊 guid для {args.ids} external_id, задержка Elasticsearch {args.latency:.0f} мс, потоков {MLS_CONCURRENCY}")
+    single = run('по одному', lambda i: get_mls_guid(i, 'msk', PROJECT, session=session), external_ids, server)
+    bulk = run(f'пачками по {MLS_GUID_BATCH_SIZE}', lambda b: get_mls_guids_bulk(b, 'msk', PROJECT, session=session), batches, server)
+
+    found_single = {i: guids for i, guids in zip(external_ids, single['results'])}
+    found_bulk = {}
+    for result in bulk['results']:
+        found_bulk.update(result)
+    assert found_single == found_bulk, "результаты не совпадают"
+    print(f"   ускорение: x{single['elapsed'] / bulk['elapsed']:.0f}")
+
+    session.close()
+    server.shutdown()
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Поиск кандидатов в проданные: вся выдача одним запросом (get_external_ids_to_mark_sold)
+против чтения порциями по external_id с commit после каждой порции (iter_external_ids_to_mark_sold).
+
+Нужна отдельная (не боевая) БД со схемой scan_domclick_v2/db.sql. Замер заводит свой
+регион с --sessions завершенными сессиями двух разделов: в замеряемом разделе --cards
+объявлений, в соседнем --other-cards (их запрос должен пропускать). Объявление последний
+раз видели в случайной из сессий. В конце все данные замера удаляются.
+
+    python3 -m bench.sold_candidates "host=localhost port=5432 dbname=scan_bench user=... password=..." --cards 200000
+"""
+
+import argparse
+import statistics
+import time
+
+from scan_base.db import connect_to_db
+from scan_base.send_sold_to_mls import (
+    SOLD_CANDIDATES_CHUNK_SIZE,
+    _external_ids_to_mark_sold_sql,
+    get_min_session_id,
+    get_scanner_tables,
+    iter_external_ids_to_mark_sold,
+)
+from scan_domclick_v2.const import PROJECT_ID, SKIP_SESSIONS_COUNT
+
+# Такие external_id у Домклика не встречаются
+BENCH_EXTERNAL_ID = 9_000_000_000_000
+BENCH_REGION_CODE = 'bench'
+
+
+def populate(conn, sessions_count: int, cards: int, other_cards: int) -> dict:
+    """Регион замера, сессии двух разделов и карточки. Возвращает параметры запроса"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO regionlar_v2 (value, aids, code, "name", ord)
+            VALUES ('bench', 0, %s, 'Замер', (SELECT coalesce(max(ord), 0) + 1 FROM regionlar_v2))
+            RETURNING id
+        """, (BENCH_REGION_CODE,))
+        region = cursor.fetchone()[0]
+        cursor.execute("SELECT min(id), max(id) FROM facetlar_v2")
+        facet, other_facet = cursor.fetchone()
+
+        sessions = {}
+        for facet_id in (facet, other_facet):
+            cursor.execute("""
+                INSERT INTO scan_sessionlar_v2 (started_at, finished_at, region, facet, min_price, page_num)
+                SELECT now(), now(), %s, %s, 0, 1 FROM generate_series(1, %s)
+                RETURNING id
+            """, (region, facet_id, sessions_count))
+            sessions[facet_id] = sorted(row[0] for row in cursor.fetchall())
+
+        first_id = BENCH_EXTERNAL_ID
+        for facet_id, count in ((facet, cards), (other_facet, other_cards)):
+            cursor.execute("""
+                INSERT INTO card_shotlar_v2 (scan_session, external_id, external_url, card)
+                SELECT (%s::int8[])[1 + (hashtext(g::text) & 2147483647) %% %s], %s + g, 'https://domclick.ru/card/' || g, '{}'::jsonb
+                FROM generate_series(0, %s - 1) g
+            """, (sessions[facet_id], sessions_count, first_id, count))
+            first_id += count
+        cursor.execute("ANALYZE card_shotlar_v2")
+        cursor.execute("ANALYZE scan_sessionlar_v2")
+    conn.commit()
+
+    facet_sessions = sessions[facet]
+    # Как в send_sold_to_mls: проданы объявления, которые не видели в последних SKIP_SESSIONS_COUNT сессиях
+    return {
+        'region': region,
+        'facet': facet,
+        'min_session_id': get_min_session_id(facet_sessions[::-1], SKIP_SESSIONS_COUNT),
+        'current_session': facet_sessions[-1] + 1,
+    }
+
+
+def cleanup(conn) -> None:
+    conn.rollback()
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM card_shotlar_v2 WHERE external_id >= %s", (BENCH_EXTERNAL_ID,))
+        cursor.execute("""
+            DELETE FROM scan_sessionlar_v2
+            WHERE region IN (SELECT id FROM regionlar_v2 WHERE code = %s)
+        """, (BENCH_REGION_CODE,))
+        cursor.execute("DELETE FROM regionlar_v2 WHERE code = %s", (BENCH_REGION_CODE,))
+    conn.commit()
+
+
+def measure_query(conn, params: dict, runs: int):
+    """Медиана времени запроса всей выдачи (мс) и найденные external_id"""
+    sql = _external_ids_to_mark_sold_sql(get_scanner_tables(PROJECT_ID))
+    args = (params['region'], params['facet'], params['min_session_id'], params['current_session'])
+    timings = []
+    rows = []
+    with conn.cursor() as cursor:
+        for _ in range(runs):
+            started = time.perf_counter()
+            cursor.execute(sql, args)
+            rows = cursor.fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+    conn.commit()
+    return statistics.median(timings), {row[0] for row in rows}
+
+
+def measure_chunks(conn, db_config: str, params: dict, runs: int, chunk_size: int):
+    """Медиана времени чтения всей выдачи порциями (мс) и найденные external_id"""
+    timings = []
+    ids = set()
+    for _ in range(runs):
+        ids = set()
+        started = time.perf_counter()
+        for chunk, conn in iter_external_ids_to_mark_sold(
+            conn, params['min_session_id'], params['current_session'], params['region'], params['facet'],
+            db_config, PROJECT_ID, chunk_size=chunk_size,
+        ):
+            ids.update(chunk)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db_config', help='строка подключения к отдельной БД для замеров')
+    parser.add_argument('--sessions', type=int, default=30, help='завершенных сессий в каждом разделе')
+    parser.add_argument('--cards', type=int, default=200_000, help='объявлений в замеряемом разделе')
+    parser.add_argument('--other-cards', type=int, default=1_000_000, help='объявлений в соседнем разделе')
+    parser.add_argument('--runs', type=int, default=5, help='повторов каждого запроса')
+    parser.add_argument('--chunk-size', type=int, default=SOLD_CANDIDATES_CHUNK_SIZE, help='external_id в порции')
+    args = parser.parse_args()
+
+    conn = connect_to_db(args.db_config)
+    try:
+        params = populate(conn, args.sessions, args.cards, args.other_cards)
+        print(f"📊 {args.cards} объявлений в разделе, {args.other_cards} в соседнем, {args.sessions} сессий")
+        query_ms, query_ids = measure_query(conn, params, args.runs)
+        chunks_ms, chunk_ids = measure_chunks(conn, args.db_config, params, args.runs, args.chunk_size)
+        assert query_ids == chunk_ids, "результаты не совпадают"
+        print(f"   кандидатов в проданные: {len(query_ids)}")
+        print(f"   одним запросом: {query_ms:.1f} мс")
+        print(f"   порциями по {args.chunk_size}: {chunks_ms:.1f} мс")
+    finally:
+        cleanup(conn)
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Хеши содержимого карточек для пропуска неизменившихся объявлений.
+
+Хеш последней сохраненной версии карточки хранится локально в SQLite по external_id.
+Если хеш карточки совпал, карточку не нужно заново писать в БД и отправлять в DIP -
+достаточно отметить, что ее видели в текущей сессии.
+"""
+
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from scan_base.serialization import encode_card
+
+
+def card_hash(card: dict, ignore_keys: Iterable[str] = (), encoded: Optional[bytes] = None) -> str:
+    """
+    Стабильный хеш карточки: не зависит от порядка ключей.
+    ignore_keys - ключи верхнего уровня, которые меняются без изменения объявления.
+    encoded - карточка, уже закодированная encode_card (используется, если ignore_keys пуст)
+    """
+    if ignore_keys:
+        encoded = encode_card({k: v for k, v in card.items() if k not in ignore_keys})
+    elif encoded is None:
+        encoded = encode_card(card)
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+class CardHashStore:
+    """
+    Локальное хранилище external_id -> хеш карточки (SQLite).
+
+    put_many() не фиксирует изменения сразу: commit() нужно вызывать после того, как
+    карточки гарантированно ушли в DIP (например, после flush_dip_batches()).
+    Если сканер упадет раньше, хеши не сохранятся, и карточки будут отправлены еще раз.
+    Потокобезопасно.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS card_hashes ("
+            "external_id INTEGER PRIMARY KEY, "
+            "card_hash TEXT NOT NULL, "
+            "scan_session INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get_many(self, external_ids: List[int]) -> Dict[int, str]:
+        """Возвращает известные хеши для external_ids"""
+        if not external_ids:
+            return {}
+        placeholders = ','.join('?' * len(external_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT external_id, card_hash FROM card_hashes WHERE external_id IN ({placeholders})",
+                [int(external_id) for external_id in external_ids]
+            ).fetchall()
+        return dict(rows)
+
+    def put_many(self, scan_session: int, hashes: List[Tuple[int, str]]) -> None:
+        """Запоминает хеши сохраненных карточек (до commit() изменения не зафиксированы)"""
+        if not hashes:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO card_hashes (external_id, card_hash, scan_session) VALUES (?, ?, ?) "
+                "ON CONFLICT(external_id) DO UPDATE SET card_hash = excluded.card_hash, scan_session = excluded.scan_session",
+                [(int(external_id), h, scan_session) for external_id, h in hashes]
+            )
+
+    def commit(self) -> None:
+        with self._lock:
+            self._conn.commit()
+
+    def close(self) -> None:
+        """Закрывает хранилище. Незафиксированные хеши отбрасываются"""
+        with self._lock:
+            self._conn.close()
@@ -59,6 +59,12 @@ class Config:
                 'password': os.getenv('RABBITMQ_PASSWORD', 'guest'),
                 'vhost': os.getenv('RABBITMQ_VHOST', '/'),
                 'exchange': os.getenv('RABBITMQ_EXCHANGE', 'scan_exchange'),
+                # 1 - ждать подтверждения брокера (publisher confirms) на каждое сообщение, 0 - не ждать
+                'confirm_delivery': os.getenv('RABBITMQ_CONFIRM_DELIVERY', '1') != '0',
+                # пороги отправки пачки карточек одним сообщением в DIP
+                'batch_max_cards': int(os.getenv('RABBITMQ_BATCH_MAX_CARDS', '20')),
+                'batch_max_bytes': int(os.getenv('RABBITMQ_BATCH_MAX_BYTES', '1000000')),
+                'batch_max_age': float(os.getenv('RABBITMQ_BATCH_MAX_AGE', '30')),
             }
         return cls._rabbitmq
 
@@ -1,71 +1,517 @@
 """
-Модуль для работы с базой данных 
+Модуль для работы с базой данных
 """
 
+import threading
 import time
+import weakref
+from contextlib import contextmanager
+from typing import Any, Dict, List, Tuple
+
 import psycopg2
+import psycopg2.extensions
+
+from scan_base.retry import BackoffPolicy, CircuitBreaker, RetryBudget
+
+
+# Общая политика повторов для БД: попытки бесконечные, задержка растет от 1 до 30 секунд
+DB_RETRY = BackoffPolicy(
+    'PostgreSQL',
+    base_delay=1.0,
+    max_delay=30.0,
+    budget=RetryBudget(),
+    breaker=CircuitBreaker('PostgreSQL', failure_threshold=5, reset_timeout=15.0),
+)
+
+DB_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
 
 
 def connect_to_db(db_config: str):
     """
     Подключается к БД с retry-логикой.
-    При ошибке подключения повторяет попытки с интервалом 2 секунды.
+    При ошибке подключения повторяет попытки с растущей задержкой (DB_RETRY).
     """
-    while True:
-        try:
-            conn = psycopg2.connect(db_config)
-            print("✅ Подключение к БД установлено")
-            return conn
-        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
-            print(f"⚠️ Ошибка подключения к БД: {e}. Повторная попытка через 2 секунды...")
-            time.sleep(2)
-            continue
+    def on_retry(attempt, delay, error, result):
+        print(f"⚠️ Ошибка подключения к БД: {error}. Повторная попытка через {delay:.1f} секунд...")
+
+    conn = DB_RETRY.call(lambda: psycopg2.connect(db_config), retry_on=DB_ERRORS, on_retry=on_retry)
+    print("✅ Подключение к БД установлено")
+    return conn
 
 
 def execute_db_query(conn, db_config: str, query_func):
     """
     Выполняет запрос к БД с retry-логикой и переподключением.
-    При любой ошибке переподключается и повторяет запрос.
-    
+    При ошибке соединения переподключается и повторяет запрос (DB_RETRY).
+
     Args:
         conn: Текущее подключение к БД (может быть закрыто)
         db_config: Строка конфигурации БД для переподключения
         query_func: Функция, которая принимает соединение и выполняет запрос
-    
+
+    Внутри unit_of_work с тем же соединением запрос выполняется в транзакции группы.
+
     Returns:
         Кортеж (результат выполнения query_func, новое соединение)
     """
-    current_conn = conn
-    
-    while True:
+    uow = getattr(_unit_of_work, 'current', None)
+    if uow is not None and conn is uow.conn:
+        return (uow.execute(query_func), uow.conn)
+
+    state = {'conn': conn, 'reconnecting': False}
+
+    def attempt():
+        current_conn = state['conn']
+
+        if current_conn is None or current_conn.closed:
+            current_conn = state['conn'] = psycopg2.connect(db_config)
+            if state['reconnecting']:
+                print("   ✅ Переподключение к БД успешно")
+                state['reconnecting'] = False
+
+        # Выполняем запрос
+        return query_func(current_conn)
+
+    def on_retry(attempt_num, delay, error, result):
+        print(f"⚠️ Ошибка при запросе к БД: {error}. Переподключаемся через {delay:.1f} секунд...")
+
+        # Закрываем старое соединение
+        old_conn = state['conn']
+        if old_conn is not None:
+            # На новом подключении подготовленные запросы будут подготовлены заново
+            statements.forget(old_conn)
+        try:
+            if old_conn is not None and not old_conn.closed:
+                old_conn.close()
+        except Exception:
+            pass
+        state['conn'] = None
+        state['reconnecting'] = True
+
+    result = DB_RETRY.call(attempt, retry_on=DB_ERRORS, on_retry=on_retry)
+    return (result, state['conn'])
+
+
+class _NoCommitConnection:
+    """
+    Подключение для запросных функций внутри unit_of_work: их commit() ничего не делает,
+    транзакцию фиксирует сам UnitOfWork. Все остальное передается настоящему подключению.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def commit(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class TransactionLostError(Exception):
+    """
+    Соединение оборвалось посреди группы unit_of_work или на ее commit(). Транзакция откачена
+    (или, если оборвался commit(), неизвестно, зафиксирована ли она), результаты запросов группы
+    недействительны. Вызывающий код выполняет всю группу заново на новом соединении
+    и использует только результаты нового выполнения
+    """
+
+    def __init__(self, message: str, cause: BaseException):
+        super().__init__(message)
+        self.cause = cause
+
+
+class UnitOfWork:
+    """
+    Несколько вызовов execute_db_query одной транзакцией.
+
+    Запросные функции выполняются сразу (их результаты нужны вызывающему коду),
+    но их commit() не фиксирует транзакцию - все фиксируется одним commit() в конце.
+    Группа сама не повторяется: если соединение оборвалось посреди группы или на commit(),
+    соединение закрывается и бросается TransactionLostError. Вызывающий код повторяет
+    группу целиком и заново выполняет все, что зависело от ее результатов.
+    """
+
+    def __init__(self, conn, db_config: str):
+        self.conn = conn
+        self.db_config = db_config
+        self.queries = 0
+
+    def _drop_conn(self) -> None:
+        old_conn, self.conn = self.conn, None
+        if old_conn is None:
+            return
+        statements.forget(old_conn)
+        try:
+            if not old_conn.closed:
+                old_conn.close()
+        except Exception:
+            pass
+
+    def execute(self, query_func):
+        """Выполняет query_func в транзакции группы и возвращает ее результат"""
+        try:
+            if self.conn is None or self.conn.closed:
+                # Соединение для новой группы (ее запросы еще не выполнялись)
+                if self.queries:
+                    raise psycopg2.InterfaceError("connection already closed")
+                self.conn = psycopg2.connect(self.db_config)
+            self.queries += 1
+            return query_func(_NoCommitConnection(self.conn))
+        except DB_ERRORS as e:
+            self._drop_conn()
+            raise TransactionLostError(f"Соединение с БД потеряно посреди транзакции: {e}", e) from e
+
+    def commit(self) -> None:
+        if not self.queries:
+            return
+        try:
+            if self.conn is None or self.conn.closed:
+                raise psycopg2.InterfaceError("connection already closed")
+            self.conn.commit()
+        except DB_ERRORS as e:
+            # Если соединение оборвалось после того, как сервер зафиксировал транзакцию,
+            # узнать это нельзя: повторять группу вслепую здесь нельзя, решает вызывающий код
+            self._drop_conn()
+            raise TransactionLostError(f"Соединение с БД потеряно при фиксации транзакции: {e}", e) from e
+        finally:
+            self.queries = 0
+
+    def rollback(self) -> None:
+        self.queries = 0
+        try:
+            if self.conn is not None and not self.conn.closed:
+                self.conn.rollback()
+        except DB_ERRORS:
+            self._drop_conn()
+
+
+# Текущая группа запросов в потоке (см. unit_of_work)
+_unit_of_work = threading.local()
+
+
+@contextmanager
+def unit_of_work(conn, db_config: str):
+    """
+    Группирует вызовы execute_db_query с этим соединением в одну транзакцию:
+
+        with unit_of_work(conn, db_config) as uow:
+            card_ids, conn = add_card_shots(conn, ...)
+            touched, conn = touch_card_shots(conn, ...)
+        conn = uow.conn
+
+    Транзакция фиксируется при выходе из блока и откатывается при исключении.
+    Вложенный unit_of_work присоединяется к внешнему. Соединение после блока
+    берется из uow.conn. При обрыве соединения блок бросает TransactionLostError
+    (uow.conn тогда None): весь блок нужно выполнить заново, например через
+    DB_RETRY.call(..., retry_on=(TransactionLostError,)).
+    """
+    outer = getattr(_unit_of_work, 'current', None)
+    if outer is not None:
+        yield outer
+        return
+
+    uow = UnitOfWork(conn, db_config)
+    _unit_of_work.current = uow
+    try:
+        yield uow
+    except BaseException:
+        _unit_of_work.current = None
+        uow.rollback()
+        raise
+    _unit_of_work.current = None
+    uow.commit()
+
+
+class StatementRegistry:
+    """
+    Реестр подготовленных запросов (PREPARE/EXECUTE) для частых вызовов функций БД.
+
+    Запрос регистрируется один раз при импорте модуля сканера, а подготавливается
+    на сервере при первом выполнении на каждом подключении. Новое подключение
+    (после переподключения в execute_db_query или из пула) подготавливает запросы
+    заново при первом же вызове, ничего делать для этого не нужно.
+    Так разбор и планирование запроса не повторяются для каждой карточки.
+
+    Если enabled выключен (например, за pgbouncer в режиме transaction, где
+    подготовленные запросы не переживают транзакцию), запросы выполняются как обычно.
+    Потокобезопасен.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        # name -> (текст PREPARE, текст EXECUTE с плейсхолдерами psycopg2, обычный запрос)
+        self._statements: Dict[str, Tuple[str, str, str]] = {}
+        # Какие запросы уже подготовлены на каждом подключении (запись исчезает вместе с подключением)
+        self._prepared: 'weakref.WeakKeyDictionary[Any, set]' = weakref.WeakKeyDictionary()
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, query: str, param_types: Tuple[str, ...]) -> str:
+        """
+        Регистрирует запрос вида "SELECT * FROM func(%s, %s::int8[])".
+
+        Args:
+            name: Имя подготовленного запроса (одно на все подключения)
+            query: Запрос с плейсхолдерами %s, по одному на параметр
+            param_types: Типы параметров в PostgreSQL, в порядке плейсхолдеров
+
+        Returns:
+            name, для передачи в execute()
+        """
+        parts = query.split('%s')
+        if len(parts) - 1 != len(param_types):
+            raise ValueError(f"Запрос {name}: {len(parts) - 1} плейсхолдеров, а типов параметров {len(param_types)}")
+
+        body = parts[0] + ''.join(f"${i}{part}" for i, part in enumerate(parts[1:], start=1))
+        types = f"({', '.join(param_types)})" if param_types else ''
+        # EXECUTE получает по плейсхолдеру на параметр, с явным приведением к типу из PREPARE:
+        # массивы psycopg2 передает как ARRAY['...'] (text[]), а text[] в jsonb[] сам не приводится
+        arguments = ', '.join(f"%s::{param_type}" for param_type in param_types)
+        execute = f"EXECUTE {name}({arguments})" if param_types else f"EXECUTE {name}"
+
+        with self._lock:
+            self._statements[name] = (f"PREPARE {name}{types} AS {body}", execute, query)
+            self._stats.setdefault(name, {'calls': 0, 'prepares': 0, 'time': 0.0, 'time_max': 0.0})
+        return name
+
+    def forget(self, conn) -> None:
+        """Забывает подготовленные на подключении запросы (подключение закрыто или сброшено)"""
+        with self._lock:
+            self._prepared.pop(conn, None)
+
+    def execute(self, cursor, name: str, params: tuple = ()) -> None:
+        """Выполняет зарегистрированный запрос на cursor, при необходимости подготавливая его"""
+        prepare, execute, query = self._statements[name]
+        conn = cursor.connection
+        started = time.monotonic()
+        prepared_now = False
+
+        if not self.enabled:
+            cursor.execute(query, params)
+        else:
+            with self._lock:
+                prepared = self._prepared.setdefault(conn, set())
+                need_prepare = name not in prepared
+            if need_prepare:
+                # PREPARE не откатывается вместе с транзакцией, поэтому отмечаем сразу
+                cursor.execute(prepare)
+                with self._lock:
+                    prepared.add(name)
+                prepared_now = True
+            cursor.execute(execute, params)
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            stats = self._stats[name]
+            stats['calls'] += 1
+            stats['prepares'] += prepared_now
+            stats['time'] += elapsed
+            stats['time_max'] = max(stats['time_max'], elapsed)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Число вызовов, подготовок и время выполнения по каждому запросу"""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items() if stats['calls']}
+
+    def report(self) -> None:
+        for name, stats in self.stats().items():
+            print(
+                f"   {name}: вызовов {stats['calls']}, подготовок {stats['prepares']}, "
+                f"среднее время {stats['time'] / stats['calls'] * 1000:.1f} мс, максимум {stats['time_max'] * 1000:.1f} мс"
+            )
+
+
+# Общий реестр подготовленных запросов всех сканеров
+statements = StatementRegistry()
+
+
+def prepare_statement(name: str, query: str, param_types: Tuple[str, ...]) -> str:
+    """Регистрирует запрос в общем реестре (см. StatementRegistry.register)"""
+    return statements.register(name, query, param_types)
+
+
+def execute_prepared(cursor, name: str, params: tuple = ()) -> None:
+    """Выполняет зарегистрированный запрос, результат читается из cursor как обычно"""
+    statements.execute(cursor, name, params)
+
+
+class ConnectionPool:
+    """
+    Пул подключений к одной БД для сканеров с несколькими потоками.
+
+    acquire() выдает подключение в монопольное пользование (потоку или задаче),
+    release(conn) возвращает его в пул. Перед выдачей подключение проверяется:
+    закрытое или сломанное заменяется новым, а простоявшее дольше ping_after секунд
+    проверяется запросом SELECT 1. Если подключений уже max_size, acquire() ждет.
+
+    Подключение можно использовать с execute_db_query как обычно: если оно
+    было пересоздано, в release() передается новое, старое пул закроет сам.
+    execute(query_func) делает все это сам и возвращает только результат.
+    """
+
+    def __init__(self, db_config: str, max_size: int = 10, ping_after: float = 30.0):
+        self.db_config = db_config
+        self.max_size = max_size
+        self.ping_after = ping_after
+        # Свободные подключения: (conn, время возврата в пул)
+        self._idle: List[Tuple[Any, float]] = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'connects': 0,
+            'reconnects': 0,
+            'health_check_failures': 0,
+            'queries': 0,
+            'query_time': 0.0,
+            'query_time_max': 0.0,
+        }
+
+    def _is_healthy(self, conn, idle_for: float) -> bool:
+        """Дешевая проверка подключения перед выдачей"""
+        if conn.closed:
+            return False
+        status = conn.get_transaction_status()
+        if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        try:
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                # Незавершенную транзакцию предыдущего владельца откатываем
+                conn.rollback()
+            if idle_for >= self.ping_after:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+        except DB_ERRORS:
+            return False
+        return True
+
+    def _discard(self, conn) -> None:
+        try:
+            if conn is not None and not conn.closed:
+                conn.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """Выдает проверенное подключение (ждет, если все max_size заняты)"""
+        with self._cond:
+            while not self._idle and self._in_use >= self.max_size:
+                self._cond.wait()
+            self._in_use += 1
+            candidate = self._idle.pop() if self._idle else None
+
         try:
-            # Проверяем, что соединение активно
-            if current_conn.closed:
-                raise psycopg2.InterfaceError("Connection is closed")
-            
-            # Выполняем запрос
-            result = query_func(current_conn)
-            return (result, current_conn)
-            
-        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
-            print(f"⚠️ Ошибка при запросе к БД: {e}. Переподключаемся...")
-            
-            # Закрываем старое соединение
-            old_conn = current_conn
-            try:
-                if not old_conn.closed:
-                    old_conn.close()
-            except Exception:
-                pass
-            
-            time.sleep(2)
-            
-            try:
-                current_conn = connect_to_db(db_config)
-                # current_conn = psycopg2.connect(db_config)
-                print(f"   ✅ Переподключение к БД успешно")
-                continue # Выполняем запрос еще раз с новым соединением
-            except Exception as reconnect_error:
-                print(f"   ❌ Ошибка переподключения: {reconnect_error}")
-                time.sleep(2)
-                continue
+            if candidate is not None:
+                conn, released_at = candidate
+                if self._is_healthy(conn, time.monotonic() - released_at):
+                    return conn
+                self._discard(conn)
+                with self._cond:
+                    self._stats['health_check_failures'] += 1
+            conn = connect_to_db(self.db_config)
+            with self._cond:
+                self._stats['connects'] += 1
+            return conn
+        except BaseException:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn) -> None:
+        """Возвращает подключение в пул (закрытое или None просто освобождает место)"""
+        with self._cond:
+            self._in_use -= 1
+            if conn is not None and not conn.closed:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """with pool.connection() as conn: ..."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def execute(self, query_func):
+        """
+        Выполняет query_func(conn) на подключении из пула с retry-логикой execute_db_query.
+
+        Returns:
+            Результат query_func (без соединения - его пул забирает обратно сам)
+        """
+        conn = self.acquire()
+        started = time.monotonic()
+        try:
+            result, new_conn = execute_db_query(conn, self.db_config, query_func)
+        except BaseException:
+            # Незавершенную транзакцию откатит проверка при следующей выдаче
+            self.release(conn)
+            raise
+
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self._stats['queries'] += 1
+            self._stats['query_time'] += elapsed
+            self._stats['query_time_max'] = max(self._stats['query_time_max'], elapsed)
+            if new_conn is not conn:
+                self._stats['reconnects'] += 1
+        if new_conn is not conn:
+            self._discard(conn)
+        self.release(new_conn)
+        return result
+
+    def stats(self) -> dict:
+        """Счетчики пула: подключения, переподключения, проверки, число и время запросов"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._in_use
+        stats['query_time_avg'] = stats['query_time'] / stats['queries'] if stats['queries'] else 0.0
+        return stats
+
+    def report(self) -> None:
+        stats = self.stats()
+        print(
+            f"   БД: подключений {stats['connects']}, переподключений {stats['reconnects']}, "
+            f"не прошли проверку {stats['health_check_failures']}, запросов {stats['queries']}, "
+            f"среднее время {stats['query_time_avg'] * 1000:.1f} мс, максимум {stats['query_time_max'] * 1000:.1f} мс"
+        )
+
+    def close(self) -> None:
+        """Закрывает свободные подключения. Выданные закроются при release()"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+# Общие пулы по строке подключения: все части сканера делят один пул
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_db_pool(db_config: str, max_size: int = 10) -> ConnectionPool:
+    """Возвращает общий пул для db_config, создавая его при первом обращении"""
+    with _pools_lock:
+        pool = _pools.get(db_config)
+        if pool is None:
+            pool = _pools[db_config] = ConnectionPool(db_config, max_size=max_size)
+        return pool
+
+
+def close_db_pools() -> None:
+    """
+    Печатает статистику пулов и подготовленных запросов и закрывает все общие пулы.
+    Сканеры вызывают ее в блоке finally
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.report()
+        pool.close()
+    statements.report()
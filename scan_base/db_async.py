@@ -0,0 +1,196 @@
+"""
+Асинхронная работа с базой данных (asyncpg) для сканеров на asyncio.
+
+Необязательный backend: нужен пакет asyncpg (pip install asyncpg), синхронный
+scan_base.db продолжает работать как раньше. Семантика повторов та же, что у
+execute_db_query: потеря соединения -> переподключение и повтор (ASYNC_DB_RETRY).
+Ошибки в самом запросе пробрасываются сразу. У асинхронного backend'а свой circuit breaker:
+его ошибки не размыкают DB_RETRY синхронного кода, и наоборот.
+
+asyncpg сам подготавливает и кеширует запросы на каждом подключении,
+поэтому реестр подготовленных запросов здесь не нужен.
+
+Пока ни один сканер его не использует: scan_domclick_v2 работает на потоках и синхронном
+scan_base.db. Конвейера запросов в протоколе PostgreSQL здесь нет: AsyncDb.gather
+перекрывает задержки независимых запросов, выполняя их одновременно на разных подключениях пула.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from scan_base.retry import BackoffPolicy, CircuitBreaker, RetryBudget
+
+AsyncQuery = Callable[[Any], Awaitable[Any]]
+
+# Те же настройки, что у DB_RETRY, но свои бюджет и circuit breaker
+ASYNC_DB_RETRY = BackoffPolicy(
+    'PostgreSQL (asyncpg)',
+    base_delay=1.0,
+    max_delay=30.0,
+    budget=RetryBudget(),
+    breaker=CircuitBreaker('PostgreSQL (asyncpg)', failure_threshold=5, reset_timeout=15.0),
+)
+
+# Потеря соединения, после которой имеет смысл переподключиться и повторить запрос.
+# InterfaceError сюда не входит: это ошибка использования подключения (например,
+# запрос внутри чужой транзакции), повтор ее не исправит
+ASYNC_DB_ERRORS: Tuple[type, ...] = (OSError, asyncio.TimeoutError)
+if asyncpg is not None:
+    ASYNC_DB_ERRORS += (
+        # В том числе ConnectionDoesNotExistError - соединение оборвалось во время запроса
+        asyncpg.exceptions.PostgresConnectionError,
+        asyncpg.exceptions.CannotConnectNowError,
+    )
+
+
+def dsn_to_connect_kwargs(db_config: str) -> Dict[str, Any]:
+    """
+    Строка вида "host=... port=... dbname=..." (Config.get_db_config) -> аргументы asyncpg.connect.
+    asyncpg понимает DSN только в виде URI, поэтому разбираем ее сами.
+    """
+    names = {'dbname': 'database', 'connect_timeout': 'timeout'}
+    kwargs: Dict[str, Any] = {}
+    for part in db_config.split():
+        key, _, value = part.partition('=')
+        key = names.get(key, key)
+        if key in ('port', 'timeout'):
+            value = float(value) if key == 'timeout' else int(value)
+        kwargs[key] = value
+    return kwargs
+
+
+def _require_asyncpg() -> None:
+    if asyncpg is None:
+        raise ImportError("Для асинхронной работы с БД нужен пакет asyncpg (pip install asyncpg)")
+
+
+async def connect_to_db_async(db_config: str):
+    """Подключается к БД с retry-логикой (ASYNC_DB_RETRY), как connect_to_db"""
+    _require_asyncpg()
+
+    def on_retry(attempt, delay, error, result):
+        print(f"⚠️ Ошибка подключения к БД: {error}. Повторная попытка через {delay:.1f} секунд...")
+
+    conn = await ASYNC_DB_RETRY.call_async(
+        lambda: asyncpg.connect(**dsn_to_connect_kwargs(db_config)),
+        retry_on=ASYNC_DB_ERRORS,
+        on_retry=on_retry,
+    )
+    print("✅ Подключение к БД установлено (asyncpg)")
+    return conn
+
+
+async def execute_db_query_async(conn, db_config: str, query_func: AsyncQuery) -> Tuple[Any, Any]:
+    """
+    Асинхронный аналог execute_db_query.
+
+    Args:
+        conn: Текущее подключение asyncpg (может быть None или закрыто)
+        db_config: Строка конфигурации БД для переподключения
+        query_func: Корутина, которая принимает соединение и выполняет запрос
+
+    Returns:
+        Кортеж (результат выполнения query_func, новое соединение)
+    """
+    _require_asyncpg()
+    state = {'conn': conn, 'reconnecting': False}
+
+    async def attempt():
+        current_conn = state['conn']
+
+        if current_conn is None or current_conn.is_closed():
+            current_conn = state['conn'] = await asyncpg.connect(**dsn_to_connect_kwargs(db_config))
+            if state['reconnecting']:
+                print("   ✅ Переподключение к БД успешно")
+                state['reconnecting'] = False
+
+        return await query_func(current_conn)
+
+    def on_retry(attempt_num, delay, error, result):
+        print(f"⚠️ Ошибка при запросе к БД: {error}. Переподключаемся через {delay:.1f} секунд...")
+
+        # Сломанное соединение закрываем без ожидания ответа сервера
+        old_conn = state['conn']
+        if old_conn is not None and not old_conn.is_closed():
+            old_conn.terminate()
+        state['conn'] = None
+        state['reconnecting'] = True
+
+    result = await ASYNC_DB_RETRY.call_async(attempt, retry_on=ASYNC_DB_ERRORS, on_retry=on_retry)
+    return (result, state['conn'])
+
+
+class AsyncDb:
+    """
+    Пул подключений asyncpg с retry-логикой.
+
+    execute(query_func) выполняет запрос на свободном подключении пула с повторами
+    при ошибках соединения (сломанное подключение пул asyncpg заменяет сам).
+    gather(*query_funcs) выполняет независимые запросы одновременно на разных
+    подключениях (asyncio.gather): задержки на сеть и на сервер у них перекрываются.
+
+        db = AsyncDb(db_config)
+        await db.start()
+        session, shards = await db.gather(get_session_query, get_shards_query)
+        await db.close()
+    """
+
+    def __init__(self, db_config: str, min_size: int = 1, max_size: int = 10):
+        self.db_config = db_config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+        self.queries = 0
+        self.retries = 0
+
+    async def start(self) -> 'AsyncDb':
+        """Создает пул (с retry-логикой, как connect_to_db)"""
+        _require_asyncpg()
+
+        def on_retry(attempt, delay, error, result):
+            print(f"⚠️ Ошибка подключения к БД: {error}. Повторная попытка через {delay:.1f} секунд...")
+
+        self.pool = await ASYNC_DB_RETRY.call_async(
+            lambda: asyncpg.create_pool(
+                min_size=self.min_size,
+                max_size=self.max_size,
+                **dsn_to_connect_kwargs(self.db_config),
+            ),
+            retry_on=ASYNC_DB_ERRORS,
+            on_retry=on_retry,
+        )
+        print(f"✅ Пул подключений к БД создан (asyncpg, до {self.max_size} подключений)")
+        return self
+
+    async def execute(self, query_func: AsyncQuery) -> Any:
+        """Выполняет query_func(conn) на подключении из пула с повторами при ошибках соединения"""
+        if self.pool is None:
+            await self.start()
+
+        async def attempt():
+            async with self.pool.acquire() as conn:
+                return await query_func(conn)
+
+        def on_retry(attempt_num, delay, error, result):
+            self.retries += 1
+            print(f"⚠️ Ошибка при запросе к БД: {error}. Повторная попытка через {delay:.1f} секунд...")
+
+        result = await ASYNC_DB_RETRY.call_async(attempt, retry_on=ASYNC_DB_ERRORS, on_retry=on_retry)
+        self.queries += 1
+        return result
+
+    async def gather(self, *query_funcs: AsyncQuery) -> List[Any]:
+        """Выполняет независимые запросы одновременно, результаты - в порядке query_funcs"""
+        return list(await asyncio.gather(*(self.execute(query_func) for query_func in query_funcs)))
+
+    async def close(self) -> None:
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+        print(f"✓ Пул подключений к БД закрыт (запросов {self.queries}, повторов {self.retries})")
+
@@ -0,0 +1,194 @@
+"""
+Ограничение частоты запросов: token bucket и адаптивный темп (AIMD)
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+
+class TokenBucket:
+    """
+    Token bucket: в среднем не больше rate запросов в секунду,
+    с возможностью всплеска до capacity запросов подряд.
+    Потокобезопасен, можно делить один bucket между несколькими потоками.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Забирает токены, если они есть. Не ждет"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """Ждет, пока не появятся токены, и забирает их"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# Один JSON-файл состояния могут писать несколько AdaptivePacer (например, по одному на браузер)
+_state_file_lock = threading.Lock()
+
+
+class AdaptivePacer:
+    """
+    Темп запросов, который подстраивается под ответы сайта (AIMD):
+    после успешного ответа частота растет на increase запросов в секунду,
+    после 403/429/5xx умножается на decrease. Так темп держится у границы,
+    которую терпит сайт, а не на заранее выбранной осторожной константе.
+    Пока ответы заметно медленнее обычного, частота не растет.
+
+    Состояние (частота, средняя задержка ответа, счетчики ответов) хранится по ключу
+    (обычно хост) в JSON-файле state_path и подхватывается при следующем запуске.
+    Интерфейс acquire() как у TokenBucket. Потокобезопасен.
+    """
+
+    THROTTLE_STATUSES = (403, 429)
+
+    def __init__(
+        self,
+        key: str,
+        min_rate: float,
+        max_rate: float,
+        start_rate: float,
+        increase: float = 0.02,
+        decrease: float = 0.5,
+        jitter: float = 0.2,
+        state_path: Optional[str] = None,
+        save_every: int = 20,
+    ):
+        self.key = key
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.jitter = jitter
+        self.state_path = state_path
+        self.save_every = save_every
+
+        self.rate = start_rate
+        # Экспоненциальное скользящее среднее задержки ответа и его минимум (обычная задержка)
+        self.latency: Optional[float] = None
+        self.base_latency: Optional[float] = None
+        self.statuses: Dict[str, int] = {}
+
+        self._next_at = time.monotonic()
+        self._decreased_at = 0.0
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        state = self._read_state().get(self.key)
+        if not state:
+            return
+        # После перезапуска начинаем чуть осторожнее, чем закончили
+        self.rate = min(self.max_rate, max(self.min_rate, state.get('rate', self.rate) * 0.8))
+        self.latency = state.get('latency')
+        self.base_latency = state.get('base_latency')
+        self.statuses = state.get('statuses', {})
+        print(f"   ✓ Темп запросов {self.key}: {self.rate:.2f} запросов/с (из {self.state_path})")
+
+    def _read_state(self) -> dict:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"   ⚠️ Не удалось прочитать {self.state_path}: {e}")
+            return {}
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """Ждет своей очереди: запросы идут не чаще rate в секунду (со случайным разбросом)"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_at)
+            self._next_at = start + tokens / self.rate * random.uniform(1 - self.jitter, 1 + self.jitter)
+        if start > now:
+            time.sleep(start - now)
+
+    def record(self, status: Any, latency: Optional[float] = None) -> None:
+        """
+        Учитывает ответ сайта.
+
+        Args:
+            status: HTTP-статус ответа (или None/'N/A', если запрос не выполнился)
+            latency: Сколько секунд выполнялся запрос
+        """
+        with self._lock:
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+
+            if latency is not None and status == 200:
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+                self.base_latency = self.latency if self.base_latency is None else min(self.base_latency, self.latency)
+
+            if status == 200:
+                slow = self.latency is not None and self.base_latency and self.latency > 2 * self.base_latency
+                if not slow:
+                    self.rate = min(self.max_rate, self.rate + self.increase)
+            elif status in self.THROTTLE_STATUSES or (isinstance(status, int) and status >= 500):
+                now = time.monotonic()
+                # Несколько ошибок подряд из одной пачки запросов снижают темп один раз
+                if now - self._decreased_at >= 1 / self.rate:
+                    self.rate = max(self.min_rate, self.rate * self.decrease)
+                    self._decreased_at = now
+                    print(f"   🐢 {self.key}: HTTP {status}, темп снижен до {self.rate:.2f} запросов/с")
+                # Следующий запрос не раньше, чем через интервал уже новой частоты
+                self._next_at = max(self._next_at, now + 1 / self.rate)
+
+            self._unsaved += 1
+            need_save = self._unsaved >= self.save_every
+
+        if need_save:
+            self.save()
+
+    def save(self) -> None:
+        """Сохраняет состояние в state_path (остальные ключи файла не трогает)"""
+        if not self.state_path:
+            return
+        with self._lock:
+            snapshot = {
+                'rate': round(self.rate, 4),
+                'latency': self.latency,
+                'base_latency': self.base_latency,
+                'statuses': dict(self.statuses),
+                'updated_at': datetime.now().isoformat(timespec='seconds'),
+            }
+            self._unsaved = 0
+
+        with _state_file_lock:
+            state = self._read_state()
+            state[self.key] = snapshot
+            tmp_path = f"{self.state_path}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.state_path)
+            except OSError as e:
+                print(f"   ⚠️ Не удалось сохранить {self.state_path}: {e}")
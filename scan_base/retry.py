@@ -0,0 +1,274 @@
+"""
+Повторные попытки с экспоненциальной задержкой, бюджетом повторов и circuit breaker'ом.
+Общий компонент для всех внешних запросов сканеров: БД, RabbitMQ, MLS.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple, Type
+
+
+class RetryError(Exception):
+    """Попытки исчерпаны. Хранит последнюю ошибку и последний результат"""
+
+    def __init__(self, message: str, last_error: Optional[BaseException] = None, last_result: Any = None):
+        super().__init__(message)
+        self.last_error = last_error
+        self.last_result = last_result
+
+
+class CircuitOpenError(RetryError):
+    """Circuit breaker разомкнут - запрос не выполнялся"""
+
+
+class RetryBudget:
+    """
+    Бюджет повторов: каждый успешный вызов пополняет бюджет на ratio токенов,
+    каждый повтор тратит один токен. Не дает повторам умножать нагрузку на сервис,
+    когда ошибок много.
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """
+    После failure_threshold ошибок подряд размыкается на reset_timeout секунд:
+    запросы не выполняются. Потом пропускает один пробный запрос (half-open):
+    успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def seconds_until_retry(self) -> float:
+        with self._lock:
+            if self.state != self.OPEN:
+                return 1.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"   ✓ {self.name}: сервис снова доступен")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """
+        Пробный запрос завершился ошибкой, которая ничего не говорит о сервисе
+        (ошибка в запросе, прерывание): состояние не меняем, следующий запрос снова будет пробным
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"   ⛔ {self.name}: {self._failures} ошибок подряд, пауза {self.reset_timeout:.0f} c")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class BackoffPolicy:
+    """
+    Политика повторов: экспоненциальная задержка с jitter'ом, ограничение числа
+    попыток (max_attempts=None - бесконечно), общий бюджет повторов и circuit breaker.
+
+    fail_fast=True - при разомкнутом breaker'е сразу бросать CircuitOpenError.
+    fail_fast=False - ждать, пока breaker пропустит пробный запрос (для бесконечных повторов).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        multiplier: float = 2.0,
+        max_attempts: Optional[int] = None,
+        budget: Optional[RetryBudget] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        fail_fast: bool = False,
+    ):
+        self.name = name
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.max_attempts = max_attempts
+        self.budget = budget
+        self.breaker = breaker
+        self.fail_fast = fail_fast
+
+    def compute_delay(self, attempt: int) -> float:
+        """Задержка перед повтором номер attempt: половина фиксированная, половина случайная"""
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def call(
+        self,
+        func: Callable[[], Any],
+        retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+        retry_if_result: Optional[Callable[[Any], bool]] = None,
+        on_retry: Optional[Callable[[int, float, Optional[BaseException], Any], None]] = None,
+    ) -> Any:
+        """
+        Вызывает func() с повторами.
+
+        Args:
+            func: Функция без аргументов
+            retry_on: Исключения, при которых повторяем (остальные пробрасываются сразу)
+            retry_if_result: Если вернула True для результата - результат считается ошибкой
+            on_retry: Вызывается перед каждым повтором: (номер попытки, задержка, ошибка, результат)
+
+        Returns:
+            Результат func()
+
+        Raises:
+            RetryError: попытки исчерпаны
+            CircuitOpenError: breaker разомкнут и fail_fast=True
+        """
+        attempt = 0
+        last_error: Optional[BaseException] = None
+        last_result: Any = None
+
+        while True:
+            wait = self._wait_for_breaker(last_error, last_result)
+            if wait:
+                time.sleep(wait)
+                continue
+
+            attempt += 1
+            try:
+                result = func()
+            except retry_on as e:
+                last_error, last_result = e, None
+            except BaseException:
+                # Ошибка не из retry_on (или прерывание) пробрасывается, но пробный запрос breaker'а освобождаем
+                self._release_probe()
+                raise
+            else:
+                if retry_if_result is None or not retry_if_result(result):
+                    self._record_success()
+                    return result
+                last_error, last_result = None, result
+
+            delay = self._next_delay(attempt, last_error, last_result)
+            if on_retry:
+                on_retry(attempt, delay, last_error, last_result)
+            time.sleep(delay)
+
+    async def call_async(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+        retry_if_result: Optional[Callable[[Any], bool]] = None,
+        on_retry: Optional[Callable[[int, float, Optional[BaseException], Any], None]] = None,
+    ) -> Any:
+        """То же, что call(), для корутин: func() возвращает awaitable, паузы через asyncio.sleep"""
+        attempt = 0
+        last_error: Optional[BaseException] = None
+        last_result: Any = None
+
+        while True:
+            wait = self._wait_for_breaker(last_error, last_result)
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+
+            attempt += 1
+            try:
+                result = await func()
+            except retry_on as e:
+                last_error, last_result = e, None
+            except BaseException:
+                # Ошибка не из retry_on (или прерывание) пробрасывается, но пробный запрос breaker'а освобождаем
+                self._release_probe()
+                raise
+            else:
+                if retry_if_result is None or not retry_if_result(result):
+                    self._record_success()
+                    return result
+                last_error, last_result = None, result
+
+            delay = self._next_delay(attempt, last_error, last_result)
+            if on_retry:
+                on_retry(attempt, delay, last_error, last_result)
+            await asyncio.sleep(delay)
+
+    def _wait_for_breaker(self, last_error: Optional[BaseException], last_result: Any) -> float:
+        """Сколько ждать, пока breaker не пропустит попытку (0 - можно выполнять сейчас)"""
+        if self.breaker and not self.breaker.allow_request():
+            if self.fail_fast:
+                raise CircuitOpenError(f"{self.name}: circuit breaker разомкнут", last_error, last_result)
+            return max(self.breaker.seconds_until_retry(), 0.1)
+        return 0.0
+
+    def _release_probe(self) -> None:
+        if self.breaker:
+            self.breaker.release_probe()
+
+    def _record_success(self) -> None:
+        if self.breaker:
+            self.breaker.record_success()
+        if self.budget:
+            self.budget.record_success()
+
+    def _next_delay(self, attempt: int, last_error: Optional[BaseException], last_result: Any) -> float:
+        """Учитывает неудачную попытку и возвращает задержку перед следующей (или бросает RetryError)"""
+        if self.breaker:
+            self.breaker.record_failure()
+
+        if self.max_attempts is not None and attempt >= self.max_attempts:
+            raise RetryError(f"{self.name}: попытки исчерпаны ({attempt})", last_error, last_result)
+
+        delay = self.compute_delay(attempt)
+        if self.budget and not self.budget.try_spend():
+            if self.max_attempts is not None:
+                raise RetryError(f"{self.name}: бюджет повторов исчерпан", last_error, last_result)
+            # Для бесконечных повторов бюджет не прерывает попытки, а замедляет их
+            delay = self.max_delay
+        return delay
@@ -3,14 +3,20 @@
 Функция для отправки объявлений в статус "продано" в MLS
 """
 
-import json
 import time
-from typing import List, Optional, Tuple, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple, Any, Iterable, Iterator, Dict
+from urllib.parse import urljoin
 import requests
+from requests.adapters import HTTPAdapter
+from psycopg2 import sql as pg_sql
 from psycopg2.extras import RealDictCursor
 # from scan_avito_v5.const import *
 from scan_base.db import execute_db_query
 from scan_base.config import Config
+from scan_base.rate_limit import TokenBucket
+from scan_base.retry import BackoffPolicy, CircuitBreaker, RetryBudget, RetryError, CircuitOpenError
 
 # Конфигурация MLS
 MLS_MSK_ELASTIC_URL="test"
@@ -18,6 +24,58 @@ MLS_RGN_ELASTIC_URL = 'test'
 MLS_SOLD_URL = 'test'
 MLS_ACCESS_TOKEN = 'test'
 
+# Сколько объявлений актуализируем параллельно
+MLS_CONCURRENCY = 8
+# Не больше MLS_RATE_PER_SEC запросов в секунду к MLS (GET guid + PUT статуса) на все потоки
+MLS_RATE_PER_SEC = 20.0
+# Как часто печатать прогресс (каждые N объявлений)
+MLS_PROGRESS_EVERY = 500
+# Сколько external_id ищем в MLS Elasticsearch одним terms-запросом
+MLS_GUID_BATCH_SIZE = 500
+# Размер страницы выдачи Elasticsearch при поиске guid пачкой
+MLS_SEARCH_PAGE_SIZE = 1000
+# Сколько Elasticsearch хранит контекст scroll между страницами
+MLS_SCROLL_KEEP_ALIVE = '1m'
+# Сколько guid отправляем в MLS одним PUT "продано"
+MLS_SOLD_CHUNK_SIZE = 200
+# Сколько раз повторяем PUT для одного guid, если MLS отвечает 5xx
+MLS_SOLD_SINGLE_RETRIES = 3
+
+# Общие для всех потоков бюджет повторов и circuit breaker запросов к MLS
+MLS_BREAKER = CircuitBreaker('MLS', failure_threshold=10, reset_timeout=60.0)
+MLS_BUDGET = RetryBudget()
+# Повторы GET/PUT к MLS при 5xx и сетевых ошибках: не больше 6 попыток, задержка от 1 до 30 секунд
+MLS_RETRY = BackoffPolicy('MLS', base_delay=1.0, max_delay=30.0, max_attempts=6, budget=MLS_BUDGET, breaker=MLS_BREAKER, fail_fast=True)
+# Один PUT без повторов: повторы для пачек делает SoldStatusSink делением пачки пополам.
+# Без breaker'а: 5xx из-за одного плохого guid не должен размыкать MLS_BREAKER для всех потоков,
+# в breaker SoldStatusSink сам записывает только сетевые ошибки
+MLS_SINGLE_SHOT = BackoffPolicy('MLS', max_attempts=1)
+
+
+# Таблицы сканеров. Одно место вместо веток "if scanner_name == ..." в каждом запросе.
+SCANNER_TABLES = {
+    'avito': {
+        'sessions': 'scan_sessionlar_v5',
+        'regions': 'regionlar_v5',
+        'cards': 'card_shotlar_v5',
+    },
+    'domclick': {
+        'sessions': 'scan_sessionlar_v2',
+        'regions': 'regionlar_v2',
+        'cards': 'card_shotlar_v2',
+    },
+}
+
+# Количество сессий подряд, в которых объект должен отсутствовать, чтобы отправиться в проданные.
+# Сканеры передают свое значение в send_sold_to_mls
+SKIP_SESSIONS_COUNT = 4
+
+# Сколько прошлых завершенных сессий раздела загружаем в контекст сессии
+LIMIT_PREVIOUS_SESSIONS = 5
+
+# По сколько external_id читаем кандидатов в проданные одним запросом
+SOLD_CANDIDATES_CHUNK_SIZE = 5000
+
 
 def get_scanner_name_by_project(project: int) -> str:
     project_to_scanner = {
@@ -28,127 +86,152 @@ def get_scanner_name_by_project(project: int) -> str:
     return project_to_scanner.get(project, '')
 
 
-def get_previous_sessions_avito(conn, scan_session: int, db_config: str, project: int) -> Tuple[int, Optional[str], Any]:
+def get_scanner_tables(project: int) -> Optional[Dict[str, Optional[str]]]:
+    """Таблицы сканера по ID проекта или None, если сканер неизвестен"""
+    return SCANNER_TABLES.get(get_scanner_name_by_project(project))
+
+
+# Контексты сессий: (project, scan_session, limit_previous_sessions) -> контекст. Контекст не меняется, пока сессия жива,
+# после закрытия сессии (send_sold_to_mls) он удаляется из кеша
+_session_context_cache: Dict[Tuple[int, int, int], dict] = {}
+
+
+def get_session_context(conn, scan_session: int, db_config: str, project: int, limit_previous_sessions: int = LIMIT_PREVIOUS_SESSIONS) -> Tuple[Optional[dict], Any]:
+    """
+    Одним запросом получаем region и facet текущей сессии, код региона
+    и id последних limit_previous_sessions завершенных сессий этого же раздела.
+    Результат кешируется до закрытия сессии (forget_session_context).
+    
+    Returns:
+        Кортеж (словарь с ключами region, facet, region_code, previous_sessions или None, обновленное соединение)
+    """
+    cache_key = (project, scan_session, limit_previous_sessions)
+    if cache_key in _session_context_cache:
+        return _session_context_cache[cache_key], conn
+    
+    tables = get_scanner_tables(project)
+    if not tables:
+        return None, conn
+    
+    query = pg_sql.SQL("""
+        SELECT 
+            ss.region,
+            ss.facet,
+            r.code AS region_code,
+            ARRAY(
+                SELECT p.id 
+                FROM {sessions} p
+                WHERE p.region = ss.region 
+                    AND p.facet = ss.facet 
+                    AND p.id < ss.id 
+                    AND p.finished_at IS NOT NULL
+                ORDER BY p.id DESC 
+                LIMIT %s
+            ) AS previous_sessions
+        FROM {sessions} ss
+        LEFT JOIN {regions} r ON r.id = ss.region
+        WHERE ss.id = %s
+    """).format(
+        sessions=pg_sql.Identifier(tables['sessions']),
+        regions=pg_sql.Identifier(tables['regions']),
+    )
+    
+    def get_session_context_query(current_conn):
+        with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(query, (limit_previous_sessions, scan_session))
+            return cursor.fetchone()
+    
+    row, conn = execute_db_query(conn, db_config, get_session_context_query)
+    if not row:
+        return None, conn
+    
+    context = dict(row)
+    context['previous_sessions'] = list(context['previous_sessions'] or [])
+    _session_context_cache[cache_key] = context
+    return context, conn
+
+
+def forget_session_context(project: int, scan_session: int) -> None:
+    """Удаляет из кеша контексты закрытой сессии"""
+    for cache_key in [key for key in list(_session_context_cache) if key[:2] == (project, scan_session)]:
+        _session_context_cache.pop(cache_key, None)
+
+
+def get_previous_sessions_avito(conn, scan_session: int, db_config: str, project: int, skip_sessions_count: int = SKIP_SESSIONS_COUNT) -> Tuple[int, Optional[str], Any]:
     """
     Получаем минимальный id сессии, старше которой объекты должны быть помечены как проданные.
     
-    Логика: объект помечается как проданный, если его scan_session < (текущая_сессия - SKIP_SESSIONS_COUNT)
-    То есть, если объект не обновлялся в последних SKIP_SESSIONS_COUNT сессиях.
+    Логика: объект помечается как проданный, если его scan_session < (текущая_сессия - skip_sessions_count)
+    То есть, если объект не обновлялся в последних skip_sessions_count сессиях.
     
     Args:
         conn: Подключение к БД
         scan_session: ID текущей сессии
         db_config: Строка конфигурации БД для переподключения
+        skip_sessions_count: Сколько сессий подряд объект должен отсутствовать
     
     Returns:
         Кортеж (минимальный id сессии для проверки, код региона, обновленное соединение)
     """
-
-    # Количество прошлых сессий, среди которых будем искать проданные объявления
-    limit_previous_sessions = 5
-
-    scanner_name = get_scanner_name_by_project(project)
-
-    # Получаем region и facet текущей сессии
-    def get_current_session_query(current_conn):
-        if scanner_name == 'avito':
-            with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    "SELECT region, facet FROM scan_sessionlar_v5 WHERE id = %s",
-                    (scan_session,)
-                )
-                return cursor.fetchone()
-        elif scanner_name == 'domclick':
-            with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    "SELECT region, facet FROM scan_sessionlar_v2 WHERE id = %s",
-                    (scan_session,)
-                )
-                return cursor.fetchone()
-    
-    current_session, conn = execute_db_query(conn, db_config, get_current_session_query)
+    context, conn = get_session_context(
+        conn, scan_session, db_config, project,
+        limit_previous_sessions=max(LIMIT_PREVIOUS_SESSIONS, skip_sessions_count)
+    )
     
-    if not current_session:
+    if not context:
         print(f"   ⚠️  Не удалось получить region и facet для сессии {scan_session}")
         return 0, None, conn
     
-    region_id = current_session['region']
-    facet_id = current_session['facet']
-    
-    # Получаем код региона
-    def get_region_code_query(current_conn):
-        if scanner_name == 'avito':
-            with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    "SELECT code FROM regionlar_v5 WHERE id = %s",
-                    (region_id,)
-                )
-                return cursor.fetchone()
-        elif scanner_name == 'domclick':
-            with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    "SELECT code FROM regionlar_v2 WHERE id = %s",
-                    (region_id,)
-                )
-                return cursor.fetchone()
-    
-    region_row, conn = execute_db_query(conn, db_config, get_region_code_query)
-    region_code = region_row['code'] if region_row else None
-    
-    # Ищем прошлые сессии
-    def get_previous_sessions_query(current_conn):
-        if scanner_name == 'avito':
-            with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    """
-                    SELECT id 
-                    FROM scan_sessionlar_v5 
-                    WHERE region = %s 
-                        AND facet = %s 
-                        AND id < %s 
-                        AND finished_at IS NOT NULL
-                    ORDER BY id DESC 
-                    LIMIT %s
-                    """,
-                    (region_id, facet_id, scan_session, limit_previous_sessions)
-                )
-                return cursor.fetchall()
-        elif scanner_name == 'domclick':
-            with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    """
-                    SELECT id 
-                    FROM scan_sessionlar_v2 
-                    WHERE region = %s 
-                        AND facet = %s 
-                        AND id < %s 
-                        AND finished_at IS NOT NULL
-                    ORDER BY id DESC 
-                    LIMIT %s
-                    """,
-                    (region_id, facet_id, scan_session, limit_previous_sessions)
-                )
-                return cursor.fetchall()
-    
-    previous_sessions, conn = execute_db_query(conn, db_config, get_previous_sessions_query)
-    session_ids = [row['id'] for row in previous_sessions]
+    return get_min_session_id(context['previous_sessions'], skip_sessions_count), context['region_code'], conn
+
+
+def get_min_session_id(session_ids: List[int], skip_sessions_count: int) -> int:
+    """
+    Минимальный id сессии: объекты с scan_session меньше этого значения
+    не обновлялись в последних skip_sessions_count сессиях ЭТОГО раздела.
     
-    # SKIP_SESSIONS_COUNT означает: сколько сессий ПОДРЯД объект должен отсутствовать в ЭТОМ разделе
-    # Если SKIP_SESSIONS_COUNT = 2, то объект отправляется в проданные,
+    session_ids - id прошлых завершенных сессий раздела, от новых к старым
+    """
+    # skip_sessions_count означает: сколько сессий ПОДРЯД объект должен отсутствовать в ЭТОМ разделе
+    # Если skip_sessions_count = 2, то объект отправляется в проданные,
     # если его scan_session < (id сессии, которая на 2 позиции назад от текущей в ЭТОМ разделе)
-    # То есть, если объект не обновлялся в последних 2 сессиях ЭТОГО раздела
-    
-    # Вычисляем минимальный id сессии: объекты с scan_session меньше этого значения
-    # не обновлялись в последних SKIP_SESSIONS_COUNT сессиях ЭТОГО раздела
-    if len(session_ids) >= SKIP_SESSIONS_COUNT:
-        # Берем id сессии, которая на SKIP_SESSIONS_COUNT позиций назад от текущей
-        min_session_id = session_ids[SKIP_SESSIONS_COUNT - 1] if session_ids else 0
-    else:
-        # Если сессий меньше, чем SKIP_SESSIONS_COUNT, то все объекты считаются "старыми"
-        min_session_id = session_ids[-1] if session_ids else 0
-    
-    return min_session_id, region_code, conn
+    if len(session_ids) >= skip_sessions_count:
+        # Берем id сессии, которая на skip_sessions_count позиций назад от текущей
+        return session_ids[skip_sessions_count - 1] if session_ids else 0
+    # Если сессий меньше, чем skip_sessions_count, то все объекты считаются "старыми"
+    return session_ids[-1] if session_ids else 0
+
+
 
+def _external_ids_to_mark_sold_sql(tables: Optional[Dict[str, Optional[str]]], keyset: bool = False) -> Optional[pg_sql.Composed]:
+    """
+    SQL для поиска external_id, которые нужно пометить как проданные.
+    Параметры запроса: (region_id, facet_id, min_session_id, current_session[, after_external_id]).
+    keyset=True - выдача упорядочена по external_id и начинается после after_external_id,
+    чтобы после обрыва соединения продолжить чтение с того же места.
+    """
+    if not tables:
+        return None
+    
+    # Сначала старые сессии раздела, потом их карточки по индексу на scan_session
+    # (card_shotlar_v2_scan_session_idx, см. scan_domclick_v2/db.sql)
+    query = pg_sql.SQL("""
+        SELECT DISTINCT cs.external_id 
+        FROM {sessions} ss
+        INNER JOIN {cards} cs ON cs.scan_session = ss.id
+        WHERE ss.region = %s
+            AND ss.facet = %s
+            AND ss.id < %s
+            AND ss.id < %s
+    """).format(
+        cards=pg_sql.Identifier(tables['cards']),
+        sessions=pg_sql.Identifier(tables['sessions']),
+    )
+    key_column = pg_sql.SQL('cs.external_id')
+    
+    if keyset:
+        query += pg_sql.SQL(" AND {key} > %s ORDER BY {key}").format(key=key_column)
+    return query
 
 
 def get_external_ids_to_mark_sold(conn, min_session_id: int, current_session: int, region_id: int, facet_id: int, db_config: str, project: int):
@@ -157,90 +240,221 @@ def get_external_ids_to_mark_sold(conn, min_session_id: int, current_session: in
     """
     scanner_name = get_scanner_name_by_project(project)
     db_config = Config.get_db_config(scanner_name)
+    sql = _external_ids_to_mark_sold_sql(get_scanner_tables(project))
 
-    if min_session_id <= 0:
+    if min_session_id <= 0 or not sql:
         return [], conn
     
     def get_external_ids_query(current_conn):
-        if scanner_name == 'avito':
-            with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    """
-                    SELECT DISTINCT cs.external_id 
-                    FROM card_shotlar_v5 cs
-                    INNER JOIN scan_sessionlar_v5 ss ON cs.scan_session = ss.id
-                    WHERE cs.scan_session < %s
-                        AND cs.scan_session < %s
-                        AND ss.region = %s
-                        AND ss.facet = %s
-                    """,
-                    (min_session_id, current_session, region_id, facet_id)
-                )
-                return cursor.fetchall()
-        elif scanner_name == 'domclick':
-            with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    """
-                    SELECT DISTINCT cs.external_id 
-                    FROM card_shotlar_v2 cs
-                    INNER JOIN scan_sessionlar_v2 ss ON cs.scan_session = ss.id
-                    WHERE cs.scan_session < %s
-                        AND cs.scan_session < %s
-                        AND ss.region = %s
-                        AND ss.facet = %s
-                    """,
-                    (min_session_id, current_session, region_id, facet_id)
-                )
-                return cursor.fetchall()
+        with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(sql, (region_id, facet_id, min_session_id, current_session))
+            return cursor.fetchall()
     
     rows, conn = execute_db_query(conn, db_config, get_external_ids_query)
     return [row['external_id'] for row in rows], conn
 
 
+def iter_external_ids_to_mark_sold(
+    conn,
+    min_session_id: int,
+    current_session: int,
+    region_id: int,
+    facet_id: int,
+    db_config: str,
+    project: int,
+    chunk_size: int = SOLD_CANDIDATES_CHUNK_SIZE
+) -> Iterator[Tuple[List[int], Any]]:
+    """
+    То же, что get_external_ids_to_mark_sold, но читает выдачу порциями по chunk_size
+    (keyset-пагинация по external_id), поэтому память не зависит от размера выдачи.
+    
+    Каждая порция - отдельный короткий запрос, после которого транзакция сразу фиксируется:
+    пока MLS обрабатывает порцию (это может длиться часы), соединение не висит
+    в "idle in transaction" и не держит горизонт vacuum. При обрыве соединения
+    execute_db_query переподключается, и чтение продолжается с последнего прочитанного external_id.
+    
+    Yields:
+        Кортеж (список external_id, текущее соединение)
+    """
+    sql = _external_ids_to_mark_sold_sql(get_scanner_tables(project), keyset=True)
 
-def get_mls_guid(external_id: int, region_code: Optional[str], project: int) -> List[str]:
+    if min_session_id <= 0 or not sql:
+        return
+    
+    sql += pg_sql.SQL(" LIMIT %s")
+    # external_id у площадок положительные
+    last_external_id = 0
+    
+    while True:
+        def get_chunk_query(current_conn):
+            with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(sql, (region_id, facet_id, min_session_id, current_session, last_external_id, chunk_size))
+                rows = cursor.fetchall()
+            current_conn.commit()
+            return rows
+        
+        rows, conn = execute_db_query(conn, db_config, get_chunk_query)
+        if not rows:
+            return
+        chunk = [row['external_id'] for row in rows]
+        last_external_id = chunk[-1]
+        yield chunk, conn
+        if len(rows) < chunk_size:
+            return
+
+
+
+def get_mls_elastic_url(region_code: Optional[str]) -> str:
+    """Для Мск и МО свой индекс MLS, для остальных регионов - общий"""
+    if region_code in ('msk', 'mo'):
+        return MLS_MSK_ELASTIC_URL
+    return MLS_RGN_ELASTIC_URL
+
+
+def _is_server_error(response) -> bool:
+    return response.status_code >= 500
+
+
+def _print_mls_retry(what: str):
+    """on_retry для MLS_RETRY: печатает, что именно повторяем"""
+    def on_retry(attempt, delay, error, response):
+        reason = f"status == {response.status_code}" if response is not None else f"ошибка: {error}"
+        print(f'   ⏳ {reason}, попробуем еще раз {what} через {delay:.1f} c (попытка {attempt + 1})')
+    return on_retry
+
+
+def get_mls_guid(external_id: int, region_code: Optional[str], project: int, session: Optional[requests.Session] = None) -> List[str]:
     """
         Получаем список guid из MLS Elasticsearch для указанного external_id
+        session - общая HTTP-сессия (keep-alive), если не передана, запрос идет без нее
     """
     mls_guid_list = []
+    http = session or requests
 
-    if region_code in ('msk', 'mo'):
-        elastic_url = MLS_MSK_ELASTIC_URL
-    else:
-        elastic_url = MLS_RGN_ELASTIC_URL
+    elastic_url = get_mls_elastic_url(region_code)
 
     search_url = f"{elastic_url}_search?q=external_id:{external_id}%20AND%20project_id:{project}%20AND%20deal_status_id:1"
 
     try:
-        response = requests.get(search_url, timeout=30)
+        response = MLS_RETRY.call(
+            lambda: http.get(search_url, timeout=30),
+            retry_on=(requests.RequestException,),
+            retry_if_result=_is_server_error,
+            on_retry=_print_mls_retry(f'получить guid для external_id: {external_id}'),
+        )
         if response.status_code == 200:
             response_json = response.json()             
             if response_json.get('hits') and response_json['hits'].get('hits'):
                 for hit in response_json['hits']['hits']:
                     if hit.get('_source') and hit['_source'].get('guid'):
                         mls_guid_list.append(hit['_source']['guid'])
-        elif response.status_code >= 500:
-            print(f'   ⏳ status == {response.status_code}, попробуем еще раз получить guid для external_id: {external_id}')
-            time.sleep(2)
-            return get_mls_guid(external_id, region_code, project)  # Рекурсивный повтор
         else:
-            print(f'   ❌ Не удалось получить guid из МЛС в get_mls_guid')
+            print('   ❌ Не удалось получить guid из МЛС в get_mls_guid')
             print(f'   response status: {response.status_code}')
             print(f'   response text: {response.text[:200]}')
             return mls_guid_list
+    except RetryError as e:
+        print(f'   ❌ Не удалось получить guid из МЛС в get_mls_guid: {e}')
+        return mls_guid_list
     except Exception as e:
         print(f'   ❌ Ошибка при получении guid из МЛС в get_mls_guid: {e}')
         return mls_guid_list
     return mls_guid_list
     
 
+def get_mls_guids_bulk(external_ids: List[int], region_code: Optional[str], project: int, session: Optional[requests.Session] = None) -> Dict[int, List[str]]:
+    """
+        Получаем guid из MLS Elasticsearch сразу для пачки external_id одним terms-запросом.
+        Выдача читается через scroll страницами по MLS_SEARCH_PAGE_SIZE: в отличие от from/size,
+        scroll не упирается в index.max_result_window (10 000 документов по умолчанию).
+    
+    Returns:
+        Словарь external_id -> список guid (external_id без guid в словарь не попадают)
+    """
+    guids_by_external_id: Dict[int, List[str]] = {}
+    if not external_ids:
+        return guids_by_external_id
+    
+    http = session or requests
+    elastic_url = get_mls_elastic_url(region_code)
+    search_url = f"{elastic_url}_search?scroll={MLS_SCROLL_KEEP_ALIVE}"
+    # Продолжение scroll - запрос к корню кластера, а не к индексу
+    scroll_url = urljoin(elastic_url, '/_search/scroll')
+    
+    # В Elasticsearch external_id может храниться и строкой, и числом - сопоставляем по строке
+    requested = {str(external_id): external_id for external_id in external_ids}
+    url = search_url
+    body = {
+        "query": {
+            "bool": {
+                "filter": [
+                    {"terms": {"external_id": list(external_ids)}},
+                    {"term": {"project_id": project}},
+                    {"term": {"deal_status_id": 1}},
+                ]
+            }
+        },
+        "_source": ["guid", "external_id"],
+        "sort": ["_doc"],
+        "size": MLS_SEARCH_PAGE_SIZE,
+    }
+    scroll_id = None
+    
+    try:
+        while True:
+            try:
+                response = MLS_RETRY.call(
+                    lambda: http.post(url, json=body, timeout=30),
+                    retry_on=(requests.RequestException,),
+                    retry_if_result=_is_server_error,
+                    on_retry=_print_mls_retry(f'получить guid для {len(external_ids)} external_id'),
+                )
+                if response.status_code != 200:
+                    print('   ❌ Не удалось получить guid из МЛС в get_mls_guids_bulk')
+                    print(f'   response status: {response.status_code}')
+                    print(f'   response text: {response.text[:200]}')
+                    return guids_by_external_id
+                response_json = response.json()
+                hits = response_json.get('hits', {}).get('hits', [])
+                scroll_id = response_json.get('_scroll_id') or scroll_id
+            except RetryError as e:
+                print(f'   ❌ Не удалось получить guid из МЛС в get_mls_guids_bulk: {e}')
+                return guids_by_external_id
+            except Exception as e:
+                print(f'   ❌ Ошибка при получении guid из МЛС в get_mls_guids_bulk: {e}')
+                return guids_by_external_id
+            
+            for hit in hits:
+                source = hit.get('_source') or {}
+                external_id = requested.get(str(source.get('external_id')))
+                if external_id is not None and source.get('guid'):
+                    guids_by_external_id.setdefault(external_id, []).append(source['guid'])
+            
+            if len(hits) < MLS_SEARCH_PAGE_SIZE or not scroll_id:
+                return guids_by_external_id
+            url = scroll_url
+            body = {"scroll": MLS_SCROLL_KEEP_ALIVE, "scroll_id": scroll_id}
+    finally:
+        if scroll_id:
+            _clear_scroll(http, scroll_url, scroll_id)
+
+
+def _clear_scroll(http, scroll_url: str, scroll_id: str) -> None:
+    """Освобождает контекст scroll, не дожидаясь, пока он истечет сам"""
+    try:
+        http.delete(scroll_url, json={"scroll_id": [scroll_id]}, timeout=30)
+    except requests.RequestException as e:
+        print(f'   ⚠️  Не удалось закрыть scroll в МЛС: {e}')
+
 
-def put_status_sold(mls_guid_list: List[str]) -> bool:
+def put_status_sold(mls_guid_list: List[str], session: Optional[requests.Session] = None) -> bool:
     if not mls_guid_list:
         return True
     
-    try:
-        response = requests.put(
+    http = session or requests
+    
+    def request():
+        return http.put(
             MLS_SOLD_URL,
             headers={
                 "Content-Type": "application/json",
@@ -249,32 +463,261 @@ def put_status_sold(mls_guid_list: List[str]) -> bool:
             json=mls_guid_list,
             timeout=30
         )
+    
+    try:
+        response = MLS_RETRY.call(
+            request,
+            retry_on=(requests.RequestException,),
+            retry_if_result=_is_server_error,
+            on_retry=_print_mls_retry('выставить "продано"'),
+        )
         
         if response.status_code == 200:
             print(f'   ✅ Выставили "продано" объявлениям: {mls_guid_list}')
             return True
-        elif response.status_code >= 500:
-            print(f'   ⏳ status == {response.status_code}, попробуем еще раз получить данные')
-            time.sleep(2)
-            return put_status_sold(mls_guid_list)  # Рекурсивный повтор
         else:
-            print(f'   ❌ Не удалось получить данные из МЛС')
+            print('   ❌ Не удалось получить данные из МЛС')
             print(f'   response status: {response.status_code}')
             print(f'   response text: {response.text[:200]}')
             return False
+    except RetryError as e:
+        print(f'   ❌ Не удалось выставить статус "продано": {e}')
+        return False
     except Exception as e:
         print(f'   ❌ Ошибка при установке статуса "продано": {e}')
         return False
 
 
 
-def send_sold_to_mls(conn, scan_session: int, project: int) -> None:
+class SoldStatusSink:
+    """
+    Копит guid от разных external_id и ставит им "продано" пачками по chunk_size.
+    
+    Если MLS отвечает 5xx (или запрос падает), пачка делится пополам и половины
+    отправляются отдельно, чтобы один плохой guid не держал всю пачку.
+    Одиночный guid повторяется MLS_SOLD_SINGLE_RETRIES раз, потом считается неудачным.
+    Потокобезопасен: add() можно вызывать из нескольких потоков.
+    """
+    
+    def __init__(self, session: Optional[requests.Session] = None, chunk_size: int = MLS_SOLD_CHUNK_SIZE, bucket: Optional[TokenBucket] = None):
+        self.http = session or requests
+        self.chunk_size = chunk_size
+        self.bucket = bucket
+        self._pending: List[str] = []
+        self._lock = threading.Lock()
+        
+        self.chunks_sent = 0
+        self.chunks_failed = 0
+        self.guids_sold = 0
+        self.guids_failed = 0
+        self.latencies: List[float] = []
+    
+    def add(self, mls_guid_list: List[str]) -> None:
+        """Добавляет guid и отправляет все набравшиеся полные пачки"""
+        with self._lock:
+            self._pending.extend(mls_guid_list)
+            chunks = []
+            while len(self._pending) >= self.chunk_size:
+                chunks.append(self._pending[:self.chunk_size])
+                self._pending = self._pending[self.chunk_size:]
+        
+        for chunk in chunks:
+            self._send(chunk)
+    
+    def flush(self) -> None:
+        """Отправляет неполную последнюю пачку"""
+        with self._lock:
+            chunk, self._pending = self._pending, []
+        if chunk:
+            self._send(chunk)
+    
+    def _put_chunk(self, chunk: List[str]) -> Optional[int]:
+        """
+        Один PUT без повторов. Возвращает HTTP статус или None при ошибке запроса.
+        Если MLS_BREAKER разомкнут, бросает CircuitOpenError - запрос не выполняется.
+        В MLS_BREAKER попадают только сетевые ошибки: 5xx на пачку с плохим guid
+        ничего не говорит о доступности MLS
+        """
+        if self.bucket:
+            self.bucket.acquire()
+        if not MLS_BREAKER.allow_request():
+            raise CircuitOpenError("MLS: circuit breaker разомкнут")
+        
+        def request():
+            return self.http.put(
+                MLS_SOLD_URL,
+                headers={
+                    "Content-Type": "application/json",
+                    "Access-Token": MLS_ACCESS_TOKEN
+                },
+                json=chunk,
+                timeout=30
+            )
+        
+        started_at = time.monotonic()
+        try:
+            response = MLS_SINGLE_SHOT.call(request, retry_on=(requests.RequestException,), retry_if_result=_is_server_error)
+            status = response.status_code
+            MLS_BREAKER.record_success()
+            if status != 200:
+                print(f'   ❌ Не удалось выставить "продано" для {len(chunk)} guid')
+                print(f'   response status: {status}')
+                print(f'   response text: {response.text[:200]}')
+        except RetryError as e:
+            if e.last_result is not None:
+                # MLS ответил 5xx: сервис жив, но пачку не принял - делим ее, breaker не трогаем
+                MLS_BREAKER.release_probe()
+                status = e.last_result.status_code
+            else:
+                MLS_BREAKER.record_failure()
+                print(f'   ❌ Ошибка при установке статуса "продано" для {len(chunk)} guid: {e.last_error}')
+                status = None
+        except BaseException:
+            MLS_BREAKER.release_probe()
+            raise
+        latency = time.monotonic() - started_at
+        
+        with self._lock:
+            self.chunks_sent += 1
+            self.latencies.append(latency)
+            if status != 200:
+                self.chunks_failed += 1
+        
+        print(f'   {"✅" if status == 200 else "⚠️ "} PUT "продано" для {len(chunk)} guid: status {status}, {latency:.2f} c')
+        return status
+    
+    def _send(self, chunk: List[str], attempt: int = 1) -> None:
+        try:
+            status = self._put_chunk(chunk)
+        except CircuitOpenError:
+            # MLS недоступен целиком - делить пачку бессмысленно
+            print(f'   ❌ MLS недоступен, не удалось выставить "продано" для {len(chunk)} guid')
+            with self._lock:
+                self.guids_failed += len(chunk)
+            return
+        
+        if status == 200:
+            with self._lock:
+                self.guids_sold += len(chunk)
+        elif status is None or status >= 500:
+            if len(chunk) > 1:
+                middle = len(chunk) // 2
+                self._send(chunk[:middle])
+                self._send(chunk[middle:])
+            elif attempt < MLS_SOLD_SINGLE_RETRIES:
+                time.sleep(MLS_RETRY.compute_delay(attempt))
+                self._send(chunk, attempt + 1)
+            else:
+                print(f'   ❌ Не удалось выставить "продано" для guid {chunk[0]}')
+                with self._lock:
+                    self.guids_failed += 1
+        else:
+            with self._lock:
+                self.guids_failed += len(chunk)
+    
+    def report(self) -> None:
+        """Печатает статистику по отправленным пачкам"""
+        if not self.latencies:
+            return
+        avg_latency = sum(self.latencies) / len(self.latencies)
+        print(
+            f"   📋 PUT 'продано': пачек {self.chunks_sent} (с ошибкой {self.chunks_failed}), "
+            f"время ответа среднее {avg_latency:.2f} c, максимальное {max(self.latencies):.2f} c, "
+            f"не удалось для {self.guids_failed} guid"
+        )
+
+
+def create_mls_http_session(pool_size: int = MLS_CONCURRENCY) -> requests.Session:
+    """
+    HTTP-сессия с пулом keep-alive соединений на pool_size потоков
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _iter_batches(external_ids: Iterable[int], batch_size: int) -> Iterator[List[int]]:
+    """Лениво режет поток external_id на пачки по batch_size"""
+    batch = []
+    for external_id in external_ids:
+        batch.append(external_id)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def mark_sold_concurrently(
+    external_ids: Iterable[int],
+    region_code: Optional[str],
+    project: int,
+    concurrency: int = MLS_CONCURRENCY,
+    rate_per_sec: float = MLS_RATE_PER_SEC
+) -> Tuple[int, int, int]:
+    """
+    Для каждого external_id получает guid из MLS и ставит им статус "продано".
+    guid ищутся пачками по MLS_GUID_BATCH_SIZE external_id одним запросом,
+    "продано" выставляется пачками по MLS_SOLD_CHUNK_SIZE guid через SoldStatusSink.
+    Пачки обрабатываются в concurrency потоках через общую HTTP-сессию,
+    общая частота запросов ограничена token bucket'ом rate_per_sec.
+    
+    external_ids читается лениво: в работе одновременно не больше 2 * concurrency пачек,
+    поэтому можно передавать поток из iter_external_ids_to_mark_sold.
+    
+    Returns:
+        Кортеж (сколько объявлений проверено, сколько обработано, скольким guid выставлено "продано")
+    """
+    bucket = TokenBucket(rate_per_sec, capacity=concurrency)
+    
+    with create_mls_http_session(concurrency) as http:
+        sink = SoldStatusSink(session=http, bucket=bucket)
+        
+        def process_batch(batch: List[int]) -> Tuple[int, int]:
+            """Возвращает (сколько проверено, сколько с guid)"""
+            bucket.acquire()
+            guids_by_external_id = get_mls_guids_bulk(batch, region_code, project, session=http)
+            
+            for mls_guid_list in guids_by_external_id.values():
+                sink.add(mls_guid_list)
+            return len(batch), len(guids_by_external_id)
+        
+        totals = {'done': 0, 'processed': 0}
+        
+        def collect(future):
+            done, processed = future.result()
+            previous_done = totals['done']
+            totals['done'] += done
+            totals['processed'] += processed
+            
+            if totals['done'] // MLS_PROGRESS_EVERY > previous_done // MLS_PROGRESS_EVERY:
+                print(f"   ⏳ Проверено объявлений: {totals['done']}, обработано: {totals['processed']}, 'продано' для {sink.guids_sold} guid")
+        
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            in_flight = []
+            for batch in _iter_batches(external_ids, MLS_GUID_BATCH_SIZE):
+                in_flight.append(executor.submit(process_batch, batch))
+                # Не читаем поток дальше, пока в работе слишком много пачек
+                while len(in_flight) >= 2 * concurrency:
+                    collect(in_flight.pop(0))
+            for future in in_flight:
+                collect(future)
+        
+        sink.flush()
+        sink.report()
+    
+    return totals['done'], totals['processed'], sink.guids_sold
+
+
+def send_sold_to_mls(conn, scan_session: int, project: int, skip_sessions_count: int = SKIP_SESSIONS_COUNT) -> None:
     """
     Основная функция для отправки объявлений в статус "продано"
     
     Выполняет следующие шаги:
-    1. Получает id прошлых сессий сканирования этого же раздела
-    2. Получает все external_id из card_shotlar_v5 для этих сессий
+    1. Одним запросом получает контекст сессии: region, facet, код региона и id прошлых сессий этого же раздела
+    2. Читает external_id, которые не обновлялись в последних skip_sessions_count сессиях
     3. Для каждого external_id получает guid из MLS Elasticsearch
     4. Устанавливает статус "продано" для всех найденных guid
     
@@ -282,75 +725,57 @@ def send_sold_to_mls(conn, scan_session: int, project: int) -> None:
         conn: Подключение к БД
         scan_session: ID текущей сессии
         project: ID проекта (например, AVITO_PROJECT_ID или CIAN_PROJECT_ID)
+        skip_sessions_count: Сколько сессий подряд объект должен отсутствовать, чтобы отправиться в проданные
     """
-    print("\n   🔄 Начинаем актуализацию - ставим статус 'продано'...")
-    
-    # Определяем источник данных по project ID и получаем конфиг БД
-    scanner_name = get_scanner_name_by_project(project)
-    db_config = Config.get_db_config(scanner_name)
-    
-    # Шаг 1: Получаем минимальный id сессии и код региона
-    min_session_id, region_code, conn = get_previous_sessions_avito(conn, scan_session, db_config, project)
-    
-    if not region_code:
-        print("   ⚠️  Не удалось определить код региона")
-        return
-    
-    if min_session_id <= 0:
-        print(f"   ℹ️  Недостаточно прошлых сессий для проверки (нужно больше {SKIP_SESSIONS_COUNT})")
-        return
-    
-    # Получаем region_id и facet_id для фильтрации
-    if scanner_name == 'avito':
-        def get_current_session_data_query(current_conn):
-            with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    "SELECT region, facet FROM scan_sessionlar_v5 WHERE id = %s",
-                    (scan_session,)
-                )
-                return cursor.fetchone()
-    elif scanner_name == 'domclick':
-        def get_current_session_data_query(current_conn):
-            with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    "SELECT region, facet FROM scan_sessionlar_v2 WHERE id = %s",
-                    (scan_session,)
-                )
-                return cursor.fetchone()
-    
-    current_session_data, conn = execute_db_query(conn, db_config, get_current_session_data_query)
-    if not current_session_data:
-        print("   ⚠️  Не удалось получить данные текущей сессии")
-        return
-    region_id = current_session_data['region']
-    facet_id = current_session_data['facet']
-    
-    print(f"   📋 Минимальный id сессии для проверки: {min_session_id}")
-    print(f"   📋 Объекты с scan_session < {min_session_id} будут помечены как проданные")
-    
-    # Шаг 2: Получаем external_id объектов, которые не обновлялись в последних SKIP_SESSIONS_COUNT сессиях
-    external_ids, conn = get_external_ids_to_mark_sold(conn, min_session_id, scan_session, region_id, facet_id, db_config, project)
-    
-    if not external_ids:
-        print("   ℹ️  Объявления для пометки как проданные не найдены")
-        return
-    
-    print(f"   📋 Найдено объявлений для пометки как проданные: {len(external_ids)}")
+    try:
+        print("\n   🔄 Начинаем актуализацию - ставим статус 'продано'...")
     
-    # Шаг 3 и 4: Для каждого external_id получаем guid и устанавливаем статус
-    total_processed = 0
-    total_sold = 0
+        # Определяем источник данных по project ID и получаем конфиг БД
+        scanner_name = get_scanner_name_by_project(project)
+        db_config = Config.get_db_config(scanner_name)
     
-    for external_id in external_ids:
-        # Получаем guid из MLS с учетом региона и project
-        mls_guid_list = get_mls_guid(external_id, region_code, project)
-        
-        if mls_guid_list:
-            # Устанавливаем статус "продано"
-            if put_status_sold(mls_guid_list):
-                total_sold += len(mls_guid_list)
-            total_processed += 1
-
-            time.sleep(0.5)
+        # Шаг 1: Получаем контекст сессии (кешируется) и минимальный id сессии
+        context, conn = get_session_context(
+            conn, scan_session, db_config, project,
+            limit_previous_sessions=max(LIMIT_PREVIOUS_SESSIONS, skip_sessions_count)
+        )
     
-    print(f"   ✅ Обработано объявлений: {total_processed}, установлено статус 'продано' для {total_sold} guid")
+        if not context:
+            print("   ⚠️  Не удалось получить данные текущей сессии")
+            return
+    
+        region_code = context['region_code']
+        region_id = context['region']
+        facet_id = context['facet']
+        min_session_id = get_min_session_id(context['previous_sessions'], skip_sessions_count)
+    
+        if not region_code:
+            print("   ⚠️  Не удалось определить код региона")
+            return
+    
+        if min_session_id <= 0:
+            print(f"   ℹ️  Недостаточно прошлых сессий для проверки (нужно больше {skip_sessions_count})")
+            return
+    
+        print(f"   📋 Минимальный id сессии для проверки: {min_session_id}")
+        print(f"   📋 Объекты с scan_session < {min_session_id} будут помечены как проданные")
+    
+        # Шаг 2: Читаем external_id объектов, которые не обновлялись в последних skip_sessions_count сессиях,
+        # порциями по SOLD_CANDIDATES_CHUNK_SIZE и сразу отдаем их в MLS
+        def external_ids_stream():
+            nonlocal conn
+            for chunk, conn in iter_external_ids_to_mark_sold(conn, min_session_id, scan_session, region_id, facet_id, db_config, project):
+                yield from chunk
+    
+        # Шаг 3 и 4: Для каждого external_id получаем guid и устанавливаем статус
+        total_found, total_processed, total_sold = mark_sold_concurrently(external_ids_stream(), region_code, project)
+    
+        if not total_found:
+            print("   ℹ️  Объявления для пометки как проданные не найдены")
+            return
+    
+        print(f"   📋 Найдено объявлений для пометки как проданные: {total_found}")
+        print(f"   ✅ Обработано объявлений: {total_processed}, установлено статус 'продано' для {total_sold} guid")
+    finally:
+        # Сессия закрыта - ее контекст больше не понадобится
+        forget_session_context(project, scan_session)
@@ -2,110 +2,381 @@
 Модуль для отправки карточек в DIP через RabbitMQ
 """
 
-import json
+import threading
 import time
+import uuid
+from typing import Optional, List, Dict, Tuple
 import pika
 from scan_base.config import Config
+from scan_base.retry import BackoffPolicy, CircuitBreaker, RetryBudget
+from scan_base.serialization import dumps, encode_card, join_array
+
+
+DIP_QUEUE = 'process-source-wcrawler'
+
+# Общая политика повторов для RabbitMQ: попытки бесконечные, задержка растет от 1 до 30 секунд
+DIP_RETRY = BackoffPolicy(
+    'RabbitMQ',
+    base_delay=1.0,
+    max_delay=30.0,
+    budget=RetryBudget(),
+    breaker=CircuitBreaker('RabbitMQ', failure_threshold=5, reset_timeout=15.0),
+)
+
+
+class DipPublisher:
+    """
+    Долгоживущее подключение к RabbitMQ для отправки сообщений в DIP.
+
+    Соединение и канал открываются при первой отправке и переиспользуются между вызовами.
+    При ошибке соединение закрывается и лениво поднимается заново при следующей попытке.
+
+    Если confirm_delivery включен (по умолчанию), канал работает в режиме publisher confirms:
+    publish() возвращает управление только после того, как брокер подтвердил сообщение
+    (basic.ack). Если соединение оборвалось до подтверждения или брокер ответил basic.nack,
+    сообщение отправляется заново после переподключения, поэтому оно не теряется.
+    Без подтверждений сообщение, отправленное перед обрывом соединения, может пропасть.
+
+    У каждого сообщения свой message_id: при повторной отправке (после переподключения)
+    он не меняется, и по нему DIP может отбросить дубль.
+    """
+
+    def __init__(self, confirm_delivery: bool = True):
+        self.confirm_delivery = confirm_delivery
+        self._connection = None
+        self._channel = None
+
+    def _connect(self):
+        """Открывает соединение и канал, если их еще нет"""
+        if self._connection and self._connection.is_open and self._channel and self._channel.is_open:
+            return
+
+        self._close_quietly()
+
+        rmq_config = Config.get_rabbitmq_config()
+        credentials = pika.PlainCredentials(rmq_config['username'], rmq_config['password'])
+        parameters = pika.ConnectionParameters(
+            host=rmq_config['host'],
+            port=rmq_config['port'],
+            virtual_host=rmq_config['vhost'],
+            credentials=credentials,
+            # Увеличиваем таймауты для более надежного соединения
+            socket_timeout=30,
+            connection_attempts=3,
+            retry_delay=2
+        )
+
+        # Подключаемся к RabbitMQ
+        self._connection = pika.BlockingConnection(parameters)
+        self._channel = self._connection.channel()
+        if self.confirm_delivery:
+            self._channel.confirm_delivery()
+
+    def _close_quietly(self):
+        """Безопасно закрывает канал и соединение"""
+        try:
+            if self._channel and not self._channel.is_closed:
+                self._channel.close()
+        except (Exception, KeyboardInterrupt):
+            pass
+
+        try:
+            if self._connection and not self._connection.is_closed:
+                self._connection.close()
+        except (Exception, KeyboardInterrupt):
+            pass
+
+        self._channel = None
+        self._connection = None
+
+    def _basic_publish(self, body: bytes, message_id: str):
+        """Отправляет сообщение. В режиме confirm_delivery ждет basic.ack (при basic.nack - NackError)"""
+        self._channel.basic_publish(
+            exchange='',
+            routing_key=DIP_QUEUE,
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=2,  # persistent
+                message_id=message_id,
+            )
+        )
+
+    def _run_with_retry(self, action) -> bool:
+        """
+        Выполняет action(), пока не получится (DIP_RETRY). При ошибке переподключается.
+        Попытки бесконечные, поэтому всегда возвращает True.
+        """
+        attempts = {'count': 0}
+
+        def attempt():
+            attempts['count'] += 1
+            self._connect()
+            # Обрабатываем heartbeat'ы, накопившиеся с прошлой отправки
+            self._connection.process_data_events(time_limit=0)
+            action()
+
+        def on_retry(attempt_num, delay, error, result):
+            self._close_quietly()
+            print(f"   ⚠️  Ошибка при отправке в RabbitMQ (попытка {attempt_num}): {type(error).__name__}: {error}")
+            print(f"   ⏳ Повторная попытка через {delay:.1f} секунд...")
+
+        DIP_RETRY.call(attempt, on_retry=on_retry)
+
+        if attempts['count'] > 1:
+            print(f"   ✓ Сообщение успешно отправлено в RabbitMQ (попытка {attempts['count']})")
+        return True
+
+    def publish(self, message: dict, message_id: Optional[str] = None) -> bool:
+        """
+        Отправляет сообщение в очередь DIP
+
+        Args:
+            message: Сообщение
+            message_id: Идентификатор сообщения для отбрасывания дублей в DIP
+                (по умолчанию - новый UUID)
+
+        Returns:
+            True (попытки бесконечные)
+        """
+        return self.publish_body(dumps(message), message_id)
+
+    def publish_body(self, body: bytes, message_id: Optional[str] = None) -> bool:
+        """То же, что publish, но сообщение уже закодировано в JSON"""
+        message_id = message_id or uuid.uuid4().hex
+        return self._run_with_retry(lambda: self._basic_publish(body, message_id))
+
+    def close(self):
+        """Закрывает соединение"""
+        self._close_quietly()
+
+
+class DipBatcher:
+    """
+    Копит карточки по (dip_module_id, fileName) и отправляет их в DIP одним сообщением.
+
+    Пачка отправляется, когда в ней набралось max_cards карточек, когда ее размер
+    превысил бы max_bytes, или когда с первой карточки прошло больше max_age секунд.
+    Возраст проверяется при каждом add() и в flush_expired(): общий накопитель
+    (get_dip_batcher) вызывает ее из фонового потока раз в DIP_FLUSH_INTERVAL секунд,
+    поэтому пачка уходит вовремя, даже если новые карточки перестали поступать.
+    В конце сессии нужно вызвать flush() или close().
+
+    source_id в add() - идентификатор источника карточек (например, записи в очереди
+    scan_base.spool). Пачка, начатая карточкой с source_id, получает message_id
+    "<source_id>-<номер пачки>": при повторной записи того же источника пачки
+    собираются в том же порядке и получают те же message_id.
+    """
+
+    def __init__(self, publisher: DipPublisher, max_cards: int = 20, max_bytes: int = 1_000_000, max_age: float = 30.0):
+        self.publisher = publisher
+        self.max_cards = max_cards
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # (dip_module_id, file_name) -> {'cards': [закодированные карточки], 'bytes': int, 'started_at': float, 'message_id': str}
+        self._batches: Dict[Tuple[int, str], dict] = {}
+        # Источник последней начатой пачки и сколько пачек он уже начал
+        self._source_id: Optional[str] = None
+        self._source_batches = 0
+
+    def add(self, card_json: dict, dip_module_id: int, file_name: str, encoded: Optional[bytes] = None, source_id: Optional[str] = None) -> bool:
+        """
+        Добавляет карточку в пачку и отправляет пачку, если сработал один из порогов.
+        encoded - карточка, уже закодированная encode_card, чтобы не кодировать ее второй раз
+        """
+        key = (dip_module_id, file_name)
+        if encoded is None:
+            encoded = encode_card(card_json)
+        card_bytes = len(encoded)
+
+        batch = self._batches.get(key)
+        if batch and batch['bytes'] + card_bytes > self.max_bytes:
+            self._flush_key(key)
+            batch = None
+
+        if batch is None:
+            batch = {'cards': [], 'bytes': 0, 'started_at': time.monotonic(), 'message_id': self._next_message_id(source_id)}
+            self._batches[key] = batch
+
+        batch['cards'].append(encoded)
+        batch['bytes'] += card_bytes
+
+        if len(batch['cards']) >= self.max_cards or batch['bytes'] >= self.max_bytes:
+            self._flush_key(key)
+
+        self.flush_expired()
+        return True
+
+    def _next_message_id(self, source_id: Optional[str]) -> Optional[str]:
+        """message_id новой пачки (None - publisher выдаст новый UUID)"""
+        if source_id is None:
+            return None
+        if source_id != self._source_id:
+            self._source_id = source_id
+            self._source_batches = 0
+        self._source_batches += 1
+        return f"{source_id}-{self._source_batches}"
+
+    def _flush_key(self, key: Tuple[int, str]) -> bool:
+        batch = self._batches.pop(key, None)
+        if not batch or not batch['cards']:
+            return True
+        dip_module_id, file_name = key
+        return self.publisher.publish_body(build_dip_body(batch['cards'], dip_module_id, file_name), batch['message_id'])
+
+    def flush_expired(self) -> None:
+        """Отправляет пачки, которые копятся дольше max_age секунд"""
+        now = time.monotonic()
+        for key in [k for k, b in self._batches.items() if now - b['started_at'] >= self.max_age]:
+            self._flush_key(key)
+
+    def flush(self) -> bool:
+        """Отправляет все накопленные пачки"""
+        for key in list(self._batches):
+            self._flush_key(key)
+        return True
+
+    def close(self):
+        self.flush()
+
+
+# Как часто фоновый поток проверяет возраст пачек общего накопителя (секунды)
+DIP_FLUSH_INTERVAL = 1.0
+
+# Общий для всех вызовов send_to_dip publisher
+_publisher: Optional[DipPublisher] = None
+_batcher: Optional[DipBatcher] = None
+# Соединение pika не потокобезопасно: функции ниже можно вызывать из нескольких потоков
+_lock = threading.RLock()
+# Фоновый поток, который отправляет устаревшие пачки, и событие для его остановки
+_flush_thread: Optional[threading.Thread] = None
+_flush_stop = threading.Event()
+
+
+def _run_flush_timer(stop: threading.Event) -> None:
+    """Раз в DIP_FLUSH_INTERVAL секунд отправляет пачки, которые копятся дольше max_age"""
+    while not stop.wait(DIP_FLUSH_INTERVAL):
+        try:
+            with _lock:
+                if _batcher is not None:
+                    _batcher.flush_expired()
+        except Exception as e:
+            print(f"   ⚠️  Не удалось отправить устаревшие пачки в DIP: {type(e).__name__}: {e}")
+
+
+def get_dip_publisher() -> DipPublisher:
+    """Возвращает общий publisher, создавая его при первом обращении"""
+    global _publisher
+    with _lock:
+        if _publisher is None:
+            _publisher = DipPublisher(
+                confirm_delivery=Config.get_rabbitmq_config()['confirm_delivery']
+            )
+        return _publisher
+
+
+def get_dip_batcher() -> DipBatcher:
+    """Возвращает общий накопитель карточек поверх общего publisher'а"""
+    global _batcher
+    with _lock:
+        if _batcher is None:
+            rmq_config = Config.get_rabbitmq_config()
+            _batcher = DipBatcher(
+                get_dip_publisher(),
+                max_cards=rmq_config['batch_max_cards'],
+                max_bytes=rmq_config['batch_max_bytes'],
+                max_age=rmq_config['batch_max_age'],
+            )
+            _start_flush_timer()
+        return _batcher
+
+
+def _start_flush_timer() -> None:
+    global _flush_thread, _flush_stop
+    _flush_stop = threading.Event()
+    _flush_thread = threading.Thread(target=_run_flush_timer, args=(_flush_stop,), name='dip-flush', daemon=True)
+    _flush_thread.start()
+
+
+def _stop_flush_timer() -> None:
+    global _flush_thread
+    _flush_stop.set()
+    if _flush_thread is not None and _flush_thread is not threading.current_thread():
+        # Поток может ждать _lock, поэтому ждем его без блокировки
+        _flush_thread.join()
+    _flush_thread = None
+
+
+def flush_dip_batches() -> None:
+    """
+    Отправляет все накопленные пачки карточек (например, в конце сессии).
+    Когда функция вернула управление, брокер подтвердил все пачки (если включен confirm_delivery)
+    """
+    with _lock:
+        if _batcher is not None:
+            _batcher.flush()
+
+
+def close_dip_publisher() -> None:
+    """
+    Отправляет накопленные пачки и закрывает общий publisher. Сканеры вызывают ее в блоке finally.
+    """
+    global _publisher, _batcher
+    _stop_flush_timer()
+    with _lock:
+        if _batcher is not None:
+            _batcher.close()
+            _batcher = None
+        if _publisher is not None:
+            _publisher.close()
+            _publisher = None
+
+
+def build_dip_message(cards: List[dict], dip_module_id: int, file_name: str) -> dict:
+    """Формирует сообщение для воркера process-source-wcrawler"""
+    return {
+        "workerName": DIP_QUEUE,
+        "params": {
+            "params": {
+                "dip_module_id": dip_module_id,
+                "fileName": file_name
+            },
+            "source": cards
+        }
+    }
+
+
+def build_dip_body(encoded_cards: List[bytes], dip_module_id: int, file_name: str) -> bytes:
+    """
+    То же, что dumps(build_dip_message(...)), но карточки уже закодированы:
+    их байты вставляются в сообщение как есть
+    """
+    head = dumps(build_dip_message([], dip_module_id, file_name))
+    # head заканчивается на '"source":[]}}' - подставляем массив закодированных карточек
+    return head[:-4] + join_array(encoded_cards) + b'}}'
 
 
 def send_to_dip(card_json: dict, dip_module_id: int, file_name: str) -> bool:
     """
     Отправляет карточку в DIP через RabbitMQ
-    
+
     Args:
         card_json: json одной карточки
         dip_module_id: ID модуля разбора данных из DIP
         file_name: Имя job'а для DIP в формате "avito-sale-flat-mo", последовательность не имеет значения, главное передать суть
-    
+
     Returns:
         True если отправка успешна (всегда возвращает True, так как попытки бесконечные)
     """
-    rmq_config = Config.get_rabbitmq_config()
-    attempt = 0
-    
-    while True:
-        attempt += 1
-        connection = None
-        channel = None
-        
-        try:
-            credentials = pika.PlainCredentials(rmq_config['username'], rmq_config['password'])
-            parameters = pika.ConnectionParameters(
-                host=rmq_config['host'],
-                port=rmq_config['port'],
-                virtual_host=rmq_config['vhost'],
-                credentials=credentials,
-                # Увеличиваем таймауты для более надежного соединения
-                socket_timeout=30,
-                connection_attempts=3,
-                retry_delay=2
-            )
-            
-            # Подключаемся к RabbitMQ
-            connection = pika.BlockingConnection(parameters)
-            channel = connection.channel()
-            
-            queue = 'process-source-wcrawler'
-            message = {
-                "workerName": "process-source-wcrawler",
-                "params": {
-                    "params": {
-                        "dip_module_id": dip_module_id,
-                        "fileName": file_name
-                    },
-                    "source": [card_json]
-                }
-            }
-            
-            # Отправляем сообщение
-            channel.basic_publish(
-                exchange='',
-                routing_key=queue,
-                body=json.dumps(message),
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # persistent
-                )
-            )
-            
-            # Закрываем канал и соединение безопасно
-            def safe_close():
-                """Безопасно закрывает канал и соединение"""
-                try:
-                    if channel and not channel.is_closed:
-                        channel.close()
-                except (Exception, KeyboardInterrupt):
-                    pass
-                
-                try:
-                    if connection and not connection.is_closed:
-                        connection.close()
-                except (Exception, KeyboardInterrupt):
-                    pass
-            
-            safe_close()
-            
-            # Успешная отправка
-            if attempt > 1:
-                print(f"   ✓ Карточка успешно отправлена в RabbitMQ (попытка {attempt})")
-            return True
-        
-        except Exception as e:
-            # Закрываем соединение при любой ошибке
-            try:
-                if channel and not channel.is_closed:
-                    channel.close()
-            except Exception:
-                pass
-            try:
-                if connection and not connection.is_closed:
-                    connection.close()
-            except Exception:
-                pass
-            
-            print(f"   ⚠️  Ошибка при отправке в RabbitMQ (попытка {attempt}): {type(e).__name__}: {e}")
-            print(f"   ⏳ Повторная попытка через 2 секунды...")
-            time.sleep(2)
-            continue
-
+    with _lock:
+        return get_dip_publisher().publish(build_dip_message([card_json], dip_module_id, file_name))
 
 
+def send_to_dip_batched(card_json: dict, dip_module_id: int, file_name: str, encoded: Optional[bytes] = None, source_id: Optional[str] = None) -> bool:
+    """
+    То же, что send_to_dip, но карточка попадает в общую пачку и уходит
+    в DIP вместе с другими карточками того же dip_module_id и fileName.
+    encoded - карточка, уже закодированная encode_card,
+    source_id - источник карточки для message_id пачки (см. DipBatcher)
+    """
+    with _lock:
+        return get_dip_batcher().add(card_json, dip_module_id, file_name, encoded, source_id)
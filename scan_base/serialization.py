@@ -0,0 +1,49 @@
+"""
+Сериализация JSON для горячего пути сканеров.
+
+Если установлен orjson, используется он (в разы быстрее стандартного json), иначе - json.
+Карточка кодируется один раз (encode_card), и одни и те же байты идут
+в хеш карточки, в параметр запроса к БД и в тело сообщения для DIP.
+"""
+
+import json
+from typing import Any, Iterable, List
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """JSON в UTF-8 без лишних пробелов"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data) -> Any:
+    """Разбирает JSON из bytes или str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode_card(card: dict) -> bytes:
+    """
+    Каноническое представление карточки: ключи отсортированы, без пробелов, UTF-8.
+    Не зависит от порядка ключей, поэтому годится и для хеша карточки
+    """
+    if orjson is not None:
+        return orjson.dumps(card, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(card, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def join_array(encoded_items: Iterable[bytes]) -> bytes:
+    """Собирает JSON-массив из уже закодированных элементов, не кодируя их заново"""
+    return b'[' + b','.join(encoded_items) + b']'
+
+
+def decode_all(encoded_items: List[bytes]) -> List[str]:
+    """bytes -> str для параметров psycopg2 (bytes он передает как bytea, а не как текст)"""
+    return [item.decode('utf-8') for item in encoded_items]
@@ -0,0 +1,196 @@
+"""
+Локальная очередь записей (write-ahead spool) на случай недоступности БД или RabbitMQ.
+
+Сканер кладет запись в SQLite-файл и сразу продолжает работу, а фоновый поток
+(SpoolDrainer) выполняет записи строго по порядку. Пока БД или RabbitMQ недоступны,
+поток ждет внутри retry-логики, а записи копятся на диске; после перезапуска
+сканера невыполненные записи выполняются первыми.
+
+Доставка "хотя бы один раз": запись удаляется из очереди только после sync()
+(например, после подтверждения отправки в DIP). Если сканер упадет раньше,
+запись будет выполнена повторно, поэтому обработчики должны быть идемпотентными.
+Повторно добавленная запись с тем же message_id, пока она еще в очереди, игнорируется.
+"""
+
+import sqlite3
+import threading
+from typing import Callable, List, Optional, Tuple
+
+
+class Spool:
+    """
+    Очередь записей в SQLite: (seq, kind, message_id, payload), seq задает порядок.
+    Запись надежно сохранена на диске, когда append() вернул управление. Потокобезопасно.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Запись в очереди не должна теряться даже при сбое питания
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "kind TEXT NOT NULL, "
+            "message_id TEXT NOT NULL UNIQUE, "
+            "payload BLOB NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def append(self, kind: str, message_id: str, payload: bytes) -> bool:
+        """Добавляет запись в конец очереди. False - запись с таким message_id уже в очереди"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO spool (kind, message_id, payload) VALUES (?, ?, ?)",
+                (kind, message_id, payload)
+            )
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def peek(self, after_seq: int = 0, limit: int = 100) -> List[Tuple[int, str, str, bytes]]:
+        """Записи после after_seq в порядке добавления: (seq, kind, message_id, payload)"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT seq, kind, message_id, payload FROM spool WHERE seq > ? ORDER BY seq LIMIT ?",
+                (after_seq, limit)
+            ).fetchall()
+
+    def ack_through(self, seq: int) -> None:
+        """Удаляет выполненные записи (все до seq включительно)"""
+        with self._lock:
+            self._conn.execute("DELETE FROM spool WHERE seq <= ?", (seq,))
+            self._conn.commit()
+
+    def last_seq(self) -> int:
+        """seq последней записи в очереди (0 - очередь пуста)"""
+        with self._lock:
+            return self._conn.execute("SELECT coalesce(max(seq), 0) FROM spool").fetchone()[0]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM spool").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SpoolDrainer:
+    """
+    Фоновый поток, который выполняет записи Spool по порядку.
+
+    handler(seq, kind, payload) выполняет одну запись (сам ждет, пока БД/RabbitMQ не станут доступны).
+    seq не меняется между запусками, поэтому из него можно получить идентификатор для отбрасывания дублей.
+    sync() вызывается перед удалением выполненных записей - после sync_every записей,
+    когда очередь опустела или кто-то ждет в wait_drained(); после него записи
+    должны быть доставлены надежно.
+    Ошибка обработчика останавливает поток (запись остается в очереди до следующего запуска)
+    и пробрасывается в основной поток при следующем check() или wait_drained().
+    """
+
+    def __init__(
+        self,
+        spool: Spool,
+        handler: Callable[[int, str, bytes], None],
+        sync: Optional[Callable[[], None]] = None,
+        sync_every: int = 20,
+        interval: float = 0.5,
+    ):
+        self.spool = spool
+        self.handler = handler
+        self.sync = sync
+        self.sync_every = sync_every
+        self.interval = interval
+        self.replayed = 0
+        # Последняя удаленная из очереди запись и запись, которую ждут в wait_drained()
+        self.acked_seq = 0
+        self._wanted_seq = 0
+        self._error: Optional[BaseException] = None
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._acked = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='spool-drainer', daemon=True)
+        self._thread.start()
+
+    def notify(self) -> None:
+        """Будит поток после append(), чтобы не ждать interval"""
+        self._wakeup.set()
+
+    def _sync_and_ack(self, seq: int) -> None:
+        if self.sync:
+            self.sync()
+        self.spool.ack_through(seq)
+        with self._acked:
+            self.acked_seq = seq
+            if self._wanted_seq <= seq:
+                self._wanted_seq = 0
+            self._acked.notify_all()
+
+    def _run(self):
+        done_seq = 0
+        unsynced = 0
+        try:
+            while True:
+                entries = self.spool.peek(after_seq=done_seq)
+                if not entries:
+                    if unsynced:
+                        self._sync_and_ack(done_seq)
+                        unsynced = 0
+                    if self._stop.is_set():
+                        return
+                    self._wakeup.wait(self.interval)
+                    self._wakeup.clear()
+                    continue
+
+                for seq, kind, message_id, payload in entries:
+                    self.handler(seq, kind, payload)
+                    done_seq = seq
+                    unsynced += 1
+                    self.replayed += 1
+                    if unsynced >= self.sync_every or (self._wanted_seq and done_seq >= self._wanted_seq):
+                        self._sync_and_ack(done_seq)
+                        unsynced = 0
+        except BaseException as e:
+            self._error = e
+            with self._acked:
+                self._acked.notify_all()
+
+    def check(self) -> None:
+        """Пробрасывает ошибку фонового потока, если она была"""
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def wait_drained(self) -> None:
+        """
+        Ждет, пока будут выполнены и удалены все записи, добавленные до вызова.
+        Записи, которые другие потоки добавляют во время ожидания, не ждет
+        """
+        target = self.spool.last_seq()
+        if not target:
+            return
+        with self._acked:
+            self._wanted_seq = max(self._wanted_seq, target)
+            self.notify()
+            while self._error is None and self._thread.is_alive() and self.acked_seq < target:
+                self._acked.wait(self.interval)
+        self.check()
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """
+        Выполняет оставшиеся записи и останавливает поток. Если за timeout секунд
+        это не удалось (БД или RabbitMQ недоступны), записи остаются в очереди до следующего запуска.
+
+        Returns:
+            True, если поток остановлен
+        """
+        self._stop.set()
+        self.notify()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f"   ⚠️ В очереди {self.spool.path} остались записи ({self.spool.count()}), они будут выполнены при следующем запуске")
+            return False
+        self.check()
+        return True
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+from scan_base.card_hashes import CardHashStore, card_hash
+from scan_base.serialization import encode_card
+
+
+class TestCardHash(unittest.TestCase):
+    def test_does_not_depend_on_key_order(self):
+        self.assertEqual(card_hash({'id': 1, 'price': 100}), card_hash({'price': 100, 'id': 1}))
+
+    def test_changes_with_content(self):
+        self.assertNotEqual(card_hash({'id': 1, 'price': 100}), card_hash({'id': 1, 'price': 101}))
+
+    def test_ignore_keys(self):
+        """Ключи из ignore_keys (например, время показа) не меняют хеш"""
+        self.assertEqual(
+            card_hash({'id': 1, 'price': 100, 'seen_at': 'today'}, ignore_keys=('seen_at',)),
+            card_hash({'id': 1, 'price': 100, 'seen_at': 'yesterday'}, ignore_keys=('seen_at',)),
+        )
+
+    def test_encoded_card_gives_same_hash(self):
+        card = {'id': 1, 'price': 100}
+
+        self.assertEqual(card_hash(card, encoded=encode_card(card)), card_hash(card))
+
+
+class TestCardHashStore(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'card_hashes.sqlite')
+
+    def open_store(self) -> CardHashStore:
+        store = CardHashStore(self.path)
+        self.addCleanup(store.close)
+        return store
+
+    def test_put_and_get(self):
+        store = self.open_store()
+        store.put_many(1, [(10, 'a'), (11, 'b')])
+
+        self.assertEqual(store.get_many([10, 11, 12]), {10: 'a', 11: 'b'})
+        self.assertEqual(store.get_many([]), {})
+
+    def test_newer_hash_replaces_older(self):
+        store = self.open_store()
+        store.put_many(1, [(10, 'a')])
+        store.put_many(2, [(10, 'b')])
+
+        self.assertEqual(store.get_many([10]), {10: 'b'})
+
+    def test_only_committed_hashes_survive_restart(self):
+        """Хеши, не зафиксированные commit() (карточки не дошли до DIP), после перезапуска забываются"""
+        store = CardHashStore(self.path)
+        store.put_many(1, [(10, 'a')])
+        store.commit()
+        store.put_many(1, [(11, 'b')])
+        store.close()
+
+        self.assertEqual(self.open_store().get_many([10, 11]), {10: 'a'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+import threading
+import unittest
+from unittest import mock
+
+import psycopg2
+import psycopg2.extensions
+
+from scan_base.db import ConnectionPool, StatementRegistry, TransactionLostError, execute_db_query, unit_of_work
+
+
+class FakeConnection:
+    """Подключение psycopg2 в памяти: считает commit() и может оборвать commit()"""
+
+    def __init__(self, fail_commit: bool = False):
+        self.closed = 0
+        self.fail_commit = fail_commit
+        self.commits = 0
+        self.rollbacks = 0
+
+    def commit(self):
+        if self.fail_commit:
+            self.closed = 2
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+
+class TestUnitOfWork(unittest.TestCase):
+    def test_one_commit_for_the_group(self):
+        conn = FakeConnection()
+        calls = []
+
+        def query(current_conn):
+            calls.append(current_conn)
+            current_conn.commit()
+            return len(calls)
+
+        with unit_of_work(conn, 'host=db') as uow:
+            first, conn = execute_db_query(conn, 'host=db', query)
+            second, conn = execute_db_query(conn, 'host=db', query)
+
+        self.assertEqual((first, second), (1, 2))
+        self.assertIs(uow.conn, conn)
+        self.assertEqual(conn.commits, 1)
+
+    def test_lost_connection_fails_the_group(self):
+        """Обрыв посреди группы: группа не повторяется, ранее выполненные запросы не перезапускаются"""
+        conn = FakeConnection()
+        calls = []
+
+        def query(current_conn):
+            calls.append('query')
+            return 1
+
+        def broken_query(current_conn):
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+        with self.assertRaises(TransactionLostError):
+            with unit_of_work(conn, 'host=db') as uow:
+                execute_db_query(conn, 'host=db', query)
+                execute_db_query(conn, 'host=db', broken_query)
+
+        self.assertEqual(calls, ['query'])
+        self.assertIsNone(uow.conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(conn.commits, 0)
+
+    @mock.patch('scan_base.db.psycopg2.connect')
+    def test_lost_commit_is_not_replayed(self, connect):
+        """Исход оборванного commit() неизвестен: группа не выполняется заново вслепую"""
+        conn = FakeConnection(fail_commit=True)
+        calls = []
+
+        with self.assertRaises(TransactionLostError) as raised:
+            with unit_of_work(conn, 'host=db') as uow:
+                execute_db_query(conn, 'host=db', lambda current_conn: calls.append('query'))
+
+        self.assertEqual(calls, ['query'])
+        self.assertIsInstance(raised.exception.cause, psycopg2.OperationalError)
+        self.assertIsNone(uow.conn)
+        connect.assert_not_called()
+
+    @mock.patch('scan_base.db.psycopg2.connect')
+    def test_group_without_connection_connects(self, connect):
+        connect.return_value = FakeConnection()
+
+        with unit_of_work(None, 'host=db') as uow:
+            result, conn = execute_db_query(None, 'host=db', lambda current_conn: 'ok')
+
+        self.assertEqual(result, 'ok')
+        self.assertIs(uow.conn, connect.return_value)
+        self.assertEqual(uow.conn.commits, 1)
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.connection = FakeConnection()
+        self.executed = []
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+
+
+class TestStatementRegistry(unittest.TestCase):
+    def test_execute_has_one_placeholder_per_param(self):
+        """Скобки внутри запроса (приведения, вложенные вызовы, VALUES) не попадают в EXECUTE"""
+        registry = StatementRegistry()
+        registry.register(
+            'add_rows',
+            "INSERT INTO t (a, b) VALUES (coalesce(%s, 0), %s::int8[]) RETURNING (id)",
+            ('int8', 'int8[]'),
+        )
+        cursor = RecordingCursor()
+
+        registry.execute(cursor, 'add_rows', (1, [2, 3]))
+
+        self.assertEqual(cursor.executed, [
+            ("PREPARE add_rows(int8, int8[]) AS INSERT INTO t (a, b) VALUES (coalesce($1, 0), $2::int8[]) RETURNING (id)", None),
+            ("EXECUTE add_rows(%s::int8, %s::int8[])", (1, [2, 3])),
+        ])
+
+    def test_prepares_once_per_connection(self):
+        registry = StatementRegistry()
+        registry.register('get_session', "SELECT * FROM get_session(%s)", ('int8',))
+        cursor = RecordingCursor()
+
+        registry.execute(cursor, 'get_session', (1,))
+        registry.execute(cursor, 'get_session', (2,))
+
+        self.assertEqual([query for query, _ in cursor.executed], [
+            "PREPARE get_session(int8) AS SELECT * FROM get_session($1)",
+            "EXECUTE get_session(%s::int8)",
+            "EXECUTE get_session(%s::int8)",
+        ])
+
+    def test_without_params(self):
+        registry = StatementRegistry()
+        registry.register('ping', "SELECT 1", ())
+        cursor = RecordingCursor()
+
+        registry.execute(cursor, 'ping')
+
+        self.assertEqual([query for query, _ in cursor.executed], ["PREPARE ping AS SELECT 1", "EXECUTE ping"])
+
+    def test_placeholder_count_must_match_types(self):
+        with self.assertRaises(ValueError):
+            StatementRegistry().register('bad', "SELECT f(%s, %s)", ('int8',))
+
+
+class PooledConnection(FakeConnection):
+    """Подключение для ConnectionPool: статус транзакции и курсор, который может не выполнить SELECT 1"""
+
+    def __init__(self, status=psycopg2.extensions.TRANSACTION_STATUS_IDLE, ping_fails: bool = False):
+        super().__init__()
+        self.status = status
+        self.ping_fails = ping_fails
+        self.pings = 0
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        super().rollback()
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, query):
+                conn.pings += 1
+                if conn.ping_fails:
+                    raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+        return Cursor()
+
+
+@mock.patch('scan_base.db.time.monotonic', return_value=1000.0)
+@mock.patch('scan_base.db.connect_to_db', side_effect=lambda db_config: PooledConnection())
+class TestConnectionPool(unittest.TestCase):
+    def test_reuses_released_connection(self, connect_to_db, monotonic):
+        pool = ConnectionPool('host=db')
+        conn = pool.acquire()
+        pool.release(conn)
+
+        self.assertIs(pool.acquire(), conn)
+        self.assertEqual(connect_to_db.call_count, 1)
+
+    def test_replaces_closed_connection(self, connect_to_db, monotonic):
+        pool = ConnectionPool('host=db')
+        conn = pool.acquire()
+        pool.release(conn)
+        conn.closed = 2
+
+        self.assertIsNot(pool.acquire(), conn)
+        self.assertEqual(pool.stats()['health_check_failures'], 1)
+
+    def test_rolls_back_previous_owners_transaction(self, connect_to_db, monotonic):
+        pool = ConnectionPool('host=db')
+        conn = pool.acquire()
+        conn.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        pool.release(conn)
+
+        self.assertIs(pool.acquire(), conn)
+        self.assertEqual(conn.rollbacks, 1)
+
+    def test_pings_only_after_idle_timeout(self, connect_to_db, monotonic):
+        """SELECT 1 только для подключения, простоявшего дольше ping_after; не ответившее заменяется"""
+        pool = ConnectionPool('host=db', ping_after=30.0)
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertIs(pool.acquire(), conn)
+        self.assertEqual(conn.pings, 0)
+
+        conn.ping_fails = True
+        pool.release(conn)
+        monotonic.return_value = 1031.0
+
+        self.assertIsNot(pool.acquire(), conn)
+        self.assertEqual(conn.pings, 1)
+        self.assertTrue(conn.closed)
+
+    def test_acquire_waits_for_free_connection(self, connect_to_db, monotonic):
+        pool = ConnectionPool('host=db', max_size=1)
+        conn = pool.acquire()
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+        waiter.start()
+
+        waiter.join(0.1)
+        self.assertEqual(acquired, [])
+        pool.release(conn)
+        waiter.join(5)
+
+        self.assertEqual(acquired, [conn])
+        self.assertEqual(connect_to_db.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+from unittest import mock
+
+from scan_base import db_async
+from scan_base.db import DB_RETRY
+from scan_base.db_async import ASYNC_DB_RETRY, dsn_to_connect_kwargs, execute_db_query_async
+from scan_base.retry import CircuitBreaker, RetryBudget, RetryError
+
+asyncpg = db_async.asyncpg
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.terminated = False
+
+    def is_closed(self):
+        return self.closed
+
+    def terminate(self):
+        self.closed = self.terminated = True
+
+
+def new_breaker() -> CircuitBreaker:
+    return CircuitBreaker('PostgreSQL (asyncpg)', failure_threshold=5, reset_timeout=15.0)
+
+
+def new_connect() -> mock.AsyncMock:
+    """asyncpg.connect, который отдает новые FakeConnection"""
+    return mock.AsyncMock(side_effect=lambda **kwargs: FakeConnection())
+
+
+@unittest.skipUnless(asyncpg, "нужен пакет asyncpg")
+@mock.patch.object(ASYNC_DB_RETRY, 'breaker', new_callable=new_breaker)
+@mock.patch.object(ASYNC_DB_RETRY, 'budget', new_callable=RetryBudget)
+@mock.patch.object(ASYNC_DB_RETRY, 'compute_delay', return_value=0)
+@mock.patch('scan_base.db_async.asyncpg.connect', new_callable=new_connect)
+class TestExecuteDbQueryAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_reconnects_after_connection_loss(self, connect, compute_delay, budget, breaker):
+        """Оборванное соединение закрывается, запрос повторяется на новом"""
+        broken = FakeConnection()
+        calls = []
+
+        async def query(conn):
+            calls.append(conn)
+            if conn is broken:
+                raise asyncpg.exceptions.ConnectionDoesNotExistError("connection was closed in the middle of operation")
+            return 42
+
+        result, conn = await execute_db_query_async(broken, 'host=db port=5432 dbname=scan', query)
+
+        self.assertEqual(result, 42)
+        self.assertIsNot(conn, broken)
+        self.assertTrue(broken.terminated)
+        self.assertEqual(len(calls), 2)
+        connect.assert_awaited_once_with(host='db', port=5432, database='scan')
+
+    async def test_interface_error_not_retried(self, connect, compute_delay, budget, breaker):
+        """Ошибка использования подключения пробрасывается сразу и не трогает breaker"""
+        conn = FakeConnection()
+        query = mock.AsyncMock(side_effect=asyncpg.exceptions.InterfaceError("cannot perform operation: another operation is in progress"))
+
+        with self.assertRaises(asyncpg.exceptions.InterfaceError):
+            await execute_db_query_async(conn, 'host=db', query)
+
+        query.assert_awaited_once()
+        self.assertFalse(conn.terminated)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    async def test_query_error_not_retried(self, connect, compute_delay, budget, breaker):
+        conn = FakeConnection()
+        query = mock.AsyncMock(side_effect=asyncpg.exceptions.UndefinedTableError('relation "cards" does not exist'))
+
+        with self.assertRaises(asyncpg.exceptions.UndefinedTableError):
+            await execute_db_query_async(conn, 'host=db', query)
+
+        query.assert_awaited_once()
+
+    async def test_own_breaker(self, connect, compute_delay, budget, breaker):
+        """Обрывы асинхронных подключений размыкают свой breaker, а не DB_RETRY синхронного кода"""
+        connect.side_effect = ConnectionRefusedError("connection refused")
+        query = mock.AsyncMock()
+
+        with mock.patch.object(ASYNC_DB_RETRY, 'max_attempts', 5):
+            with self.assertRaises(RetryError):
+                await execute_db_query_async(None, 'host=db', query)
+
+        query.assert_not_awaited()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(DB_RETRY.breaker.state, CircuitBreaker.CLOSED)
+
+
+class TestDsnToConnectKwargs(unittest.TestCase):
+    def test_libpq_keywords(self):
+        self.assertEqual(
+            dsn_to_connect_kwargs('host=localhost port=5433 dbname=scan user=u password=p connect_timeout=10'),
+            {'host': 'localhost', 'port': 5433, 'database': 'scan', 'user': 'u', 'password': 'p', 'timeout': 10.0},
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from scan_base.rate_limit import AdaptivePacer, TokenBucket
+
+
+class FakeClock:
+    """time.monotonic и time.sleep: sleep сдвигает часы, а не ждет"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class FakeClockTestCase(unittest.TestCase):
+    """Часы модуля rate_limit подменены на FakeClock (self.clock)"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.multiple('scan_base.rate_limit.time', monotonic=self.clock.monotonic, sleep=self.clock.sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestTokenBucket(FakeClockTestCase):
+    def test_burst_up_to_capacity(self):
+        bucket = TokenBucket(rate=2.0, capacity=3.0)
+
+        self.assertEqual([bucket.try_acquire() for _ in range(4)], [True, True, True, False])
+
+    def test_refills_at_rate(self):
+        bucket = TokenBucket(rate=2.0, capacity=1.0)
+        bucket.try_acquire()
+
+        self.clock.now += 0.25
+        self.assertFalse(bucket.try_acquire())
+        self.clock.now += 0.25
+        self.assertTrue(bucket.try_acquire())
+
+    def test_refill_does_not_exceed_capacity(self):
+        bucket = TokenBucket(rate=10.0, capacity=2.0)
+
+        self.clock.now += 60
+        self.assertEqual([bucket.try_acquire() for _ in range(3)], [True, True, False])
+
+    def test_acquire_waits_for_tokens(self):
+        """Без токенов acquire ждет ровно столько, сколько нужно на пополнение"""
+        bucket = TokenBucket(rate=4.0, capacity=1.0)
+
+        for _ in range(5):
+            bucket.acquire()
+
+        self.assertEqual(self.clock.slept, [0.25] * 4)
+        self.assertAlmostEqual(self.clock.now, 1001.0)
+
+
+@mock.patch('scan_base.rate_limit.random.uniform', return_value=1.0)
+class TestAdaptivePacer(FakeClockTestCase):
+    def make_pacer(self, **kwargs) -> AdaptivePacer:
+        params = dict(key='domclick.ru', min_rate=0.5, max_rate=4.0, start_rate=1.0, increase=0.5, decrease=0.5)
+        params.update(kwargs)
+        return AdaptivePacer(**params)
+
+    def test_spaces_requests_at_rate(self, uniform):
+        pacer = self.make_pacer(start_rate=2.0)
+
+        for _ in range(3):
+            pacer.acquire()
+
+        self.assertEqual(self.clock.slept, [0.5, 0.5])
+
+    def test_success_increases_rate_up_to_max(self, uniform):
+        pacer = self.make_pacer()
+
+        for _ in range(10):
+            pacer.record(200, latency=0.1)
+
+        self.assertEqual(pacer.rate, 4.0)
+
+    def test_throttle_halves_rate_once_per_burst(self, uniform):
+        """Несколько 429 из одной пачки снижают темп один раз и откладывают следующий запрос"""
+        pacer = self.make_pacer(start_rate=2.0)
+
+        pacer.record(429)
+        pacer.record(429)
+        pacer.record(503)
+
+        self.assertEqual(pacer.rate, 1.0)
+        pacer.acquire()
+        self.assertEqual(self.clock.slept, [1.0])
+
+    def test_rate_does_not_drop_below_min(self, uniform):
+        pacer = self.make_pacer()
+
+        for _ in range(5):
+            pacer.record(403)
+            self.clock.now += 10
+
+        self.assertEqual(pacer.rate, 0.5)
+
+    def test_slow_responses_hold_rate(self, uniform):
+        """Пока ответы заметно медленнее обычного, темп не растет"""
+        pacer = self.make_pacer()
+        pacer.record(200, latency=0.1)
+        rate = pacer.rate
+
+        for _ in range(5):
+            pacer.record(200, latency=5.0)
+
+        self.assertEqual(pacer.rate, rate)
+
+    def test_state_survives_restart(self, uniform):
+        with tempfile.TemporaryDirectory() as tmp:
+            state_path = os.path.join(tmp, 'pacer.json')
+            pacer = self.make_pacer(state_path=state_path, save_every=2)
+            pacer.record(200, latency=0.1)
+            pacer.record(200, latency=0.1)
+
+            with open(state_path, encoding='utf-8') as f:
+                self.assertEqual(json.load(f)['domclick.ru']['statuses'], {'200': 2})
+            restarted = self.make_pacer(state_path=state_path)
+
+        # После перезапуска темп чуть ниже сохраненного
+        self.assertEqual(restarted.rate, 2.0 * 0.8)
+        self.assertEqual(restarted.statuses, {'200': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
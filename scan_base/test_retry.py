@@ -0,0 +1,181 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from scan_base.retry import BackoffPolicy, CircuitBreaker, CircuitOpenError, RetryBudget, RetryError
+
+
+def half_open_breaker() -> CircuitBreaker:
+    """Breaker, который уже разомкнулся и готов пропустить пробный запрос"""
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    return breaker
+
+
+class TestProbeRelease(unittest.TestCase):
+    def test_non_retryable_error_releases_probe(self):
+        """Ошибка не из retry_on во время пробного запроса не оставляет breaker занятым"""
+        breaker = half_open_breaker()
+        policy = BackoffPolicy('test', base_delay=0.001, max_delay=0.001, breaker=breaker)
+
+        def bad_query():
+            raise ValueError("ошибка в запросе")
+
+        with self.assertRaises(ValueError):
+            policy.call(bad_query, retry_on=(OSError,))
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker._probe_in_flight)
+
+        # Следующий вызов выполняется как пробный и замыкает цепь
+        self.assertEqual(policy.call(lambda: 42, retry_on=(OSError,)), 42)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_cancelled_async_call_releases_probe(self):
+        """Отмена корутины во время пробного запроса тоже освобождает breaker"""
+        breaker = half_open_breaker()
+        policy = BackoffPolicy('test', base_delay=0.001, max_delay=0.001, breaker=breaker)
+
+        async def slow_query():
+            await asyncio.sleep(10)
+
+        async def run():
+            task = asyncio.ensure_future(policy.call_async(slow_query, retry_on=(OSError,)))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+            async def fast_query():
+                return 'ok'
+
+            return await asyncio.wait_for(policy.call_async(fast_query, retry_on=(OSError,)), timeout=1)
+
+        self.assertEqual(asyncio.run(run()), 'ok')
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_retryable_error_still_reopens(self):
+        """Ошибка из retry_on во время пробного запроса снова размыкает breaker"""
+        breaker = half_open_breaker()
+        policy = BackoffPolicy('test', base_delay=0.001, max_delay=0.001, max_attempts=1, breaker=breaker)
+
+        def broken():
+            raise OSError("нет соединения")
+
+        with self.assertRaises(Exception):
+            policy.call(broken, retry_on=(OSError,))
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
+@mock.patch('scan_base.retry.time.monotonic', return_value=1000.0)
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_threshold_in_a_row(self, monotonic):
+        breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=10.0)
+
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+    def test_one_probe_after_reset_timeout(self, monotonic):
+        """После reset_timeout пропускается ровно один пробный запрос"""
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=10.0)
+        breaker.record_failure()
+
+        monotonic.return_value = 1005.0
+        self.assertFalse(breaker.allow_request())
+        self.assertEqual(breaker.seconds_until_retry(), 5.0)
+
+        monotonic.return_value = 1010.0
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow_request())
+
+    def test_probe_success_closes(self, monotonic):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=10.0)
+        breaker.record_failure()
+        monotonic.return_value = 1010.0
+        breaker.allow_request()
+
+        breaker.record_success()
+
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow_request())
+
+    def test_probe_failure_reopens_for_full_timeout(self, monotonic):
+        breaker = CircuitBreaker('test', failure_threshold=5, reset_timeout=10.0)
+        for _ in range(5):
+            breaker.record_failure()
+        monotonic.return_value = 1010.0
+        breaker.allow_request()
+
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.seconds_until_retry(), 10.0)
+
+
+@mock.patch('scan_base.retry.time.sleep')
+class TestBackoffPolicy(unittest.TestCase):
+    def test_retries_until_success(self, sleep):
+        policy = BackoffPolicy('test', base_delay=1.0, max_delay=4.0, multiplier=2.0)
+        func = mock.Mock(side_effect=[OSError("нет соединения"), OSError("нет соединения"), 'ok'])
+        on_retry = mock.Mock()
+
+        self.assertEqual(policy.call(func, retry_on=(OSError,), on_retry=on_retry), 'ok')
+
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual([c.args[0] for c in on_retry.call_args_list], [1, 2])
+        # Половина задержки фиксированная: 1 * 2^(attempt-1) / 2 .. 1 * 2^(attempt-1)
+        first, second = [c.args[0] for c in sleep.call_args_list]
+        self.assertTrue(0.5 <= first <= 1.0)
+        self.assertTrue(1.0 <= second <= 2.0)
+
+    def test_max_attempts_keeps_last_error(self, sleep):
+        policy = BackoffPolicy('test', max_attempts=2)
+        error = OSError("нет соединения")
+
+        with self.assertRaises(RetryError) as raised:
+            policy.call(mock.Mock(side_effect=error), retry_on=(OSError,))
+
+        self.assertIs(raised.exception.last_error, error)
+        self.assertEqual(sleep.call_count, 1)
+
+    def test_retry_if_result(self, sleep):
+        policy = BackoffPolicy('test', max_attempts=3)
+        func = mock.Mock(side_effect=[503, 503, 200])
+
+        self.assertEqual(policy.call(func, retry_if_result=lambda status: status >= 500), 200)
+        self.assertEqual(func.call_count, 3)
+
+    def test_budget_limits_retries(self, sleep):
+        """Бюджет на один повтор: второй повтор не выполняется"""
+        policy = BackoffPolicy('test', max_attempts=10, budget=RetryBudget(ratio=0.5, max_tokens=1.0))
+        func = mock.Mock(side_effect=OSError("нет соединения"))
+
+        with self.assertRaises(RetryError):
+            policy.call(func, retry_on=(OSError,))
+
+        self.assertEqual(func.call_count, 2)
+
+    def test_fail_fast_when_open(self, sleep):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=60.0)
+        breaker.record_failure()
+        policy = BackoffPolicy('test', breaker=breaker, fail_fast=True)
+        func = mock.Mock()
+
+        with self.assertRaises(CircuitOpenError):
+            policy.call(func)
+
+        func.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
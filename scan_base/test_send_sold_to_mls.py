@@ -0,0 +1,278 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import psycopg2
+import requests
+
+from scan_base import send_sold_to_mls
+from scan_base.retry import CircuitBreaker
+from scan_base.send_sold_to_mls import MLS_RETRY, SoldStatusSink, create_mls_http_session, get_mls_guids_bulk, iter_external_ids_to_mark_sold
+
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.text = ''
+
+
+class PoisonSession:
+    """MLS, который отвечает 500 на любую пачку с плохим guid"""
+
+    def __init__(self, poison: str):
+        self.poison = poison
+        self.requests = 0
+
+    def put(self, url, headers=None, json=None, timeout=None):
+        self.requests += 1
+        return FakeResponse(500 if self.poison in json else 200)
+
+
+def new_mls_breaker() -> CircuitBreaker:
+    return CircuitBreaker('MLS', failure_threshold=10, reset_timeout=60.0)
+
+
+@mock.patch.object(send_sold_to_mls, 'MLS_BREAKER', new_callable=new_mls_breaker)
+@mock.patch.object(MLS_RETRY, 'compute_delay', return_value=0)
+class TestSoldStatusSink(unittest.TestCase):
+    def test_poison_guid_does_not_open_breaker(self, compute_delay, breaker):
+        """Один плохой guid в начале пачки не размыкает MLS_BREAKER, остальные помечаются проданными"""
+        guids = [f'guid-{i}' for i in range(200)]
+        session = PoisonSession(poison=guids[0])
+        sink = SoldStatusSink(session=session, chunk_size=200)
+
+        sink.add(guids)
+        sink.flush()
+
+        self.assertEqual(sink.guids_sold, 199)
+        self.assertEqual(sink.guids_failed, 1)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_transport_errors_open_breaker(self, compute_delay, breaker):
+        """Сетевые ошибки по-прежнему размыкают MLS_BREAKER"""
+        session = mock.Mock()
+        session.put.side_effect = requests.ConnectionError("connection refused")
+        sink = SoldStatusSink(session=session, chunk_size=4)
+
+        sink.add([f'guid-{i}' for i in range(4)])
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(sink.guids_sold, 0)
+        self.assertEqual(sink.guids_failed, 4)
+
+
+class CountingServer(ThreadingHTTPServer):
+    """Локальный MLS на HTTP/1.1 keep-alive, который считает принятые соединения"""
+    daemon_threads = True
+
+    def __init__(self):
+        self.connections = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_PUT(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        super().__init__(('127.0.0.1', 0), Handler)
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+
+class TestMlsHttpSession(unittest.TestCase):
+    def setUp(self):
+        self.server = CountingServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/sold'
+
+    def put_many(self, http, requests_count: int = 60, threads: int = 4) -> None:
+        def put(i):
+            response = http.put(self.url, json=[f'guid-{i}'], timeout=5)
+            self.assertEqual(response.status_code, 200)
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(put, range(requests_count)))
+
+    def test_session_reuses_connections(self):
+        """Сессия держит не больше pool_size keep-alive соединений на все потоки"""
+        session = create_mls_http_session(pool_size=4)
+        self.addCleanup(session.close)
+
+        self.put_many(session)
+
+        self.assertLessEqual(self.server.connections, 4)
+
+    def test_without_session_connection_per_request(self):
+        """Без сессии каждый PUT открывает новое соединение"""
+        self.put_many(requests)
+
+        self.assertEqual(self.server.connections, 60)
+
+
+class FakeReadCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params):
+        if self.connection.fail_queries:
+            self.connection.fail_queries -= 1
+            self.connection.closed = 2
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.connection.in_transaction = True
+        after_external_id, limit = params[-2:]
+        self.rows = [{'external_id': i} for i in range(after_external_id + 1, self.connection.count + 1)][:limit]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeReadConnection:
+    """Подключение psycopg2, в котором есть external_id 1..count"""
+
+    def __init__(self, count: int, fail_queries: int = 0):
+        self.closed = 0
+        self.count = count
+        self.fail_queries = fail_queries
+        self.in_transaction = False
+        self.commits = 0
+
+    def cursor(self, cursor_factory=None):
+        return FakeReadCursor(self)
+
+    def commit(self):
+        self.in_transaction = False
+        self.commits += 1
+
+    def close(self):
+        self.closed = 1
+
+
+class TestIterExternalIdsToMarkSold(unittest.TestCase):
+    def iterate(self, conn):
+        return iter_external_ids_to_mark_sold(conn, 10, 20, 1, 1, 'host=db', 24, chunk_size=3)
+
+    def test_reads_in_chunks(self):
+        conn = FakeReadConnection(7)
+
+        chunks = [chunk for chunk, _ in self.iterate(conn)]
+
+        self.assertEqual(chunks, [[1, 2, 3], [4, 5, 6], [7]])
+        self.assertEqual(conn.commits, 3)
+
+    def test_no_transaction_open_between_chunks(self):
+        """Пока потребитель обрабатывает порцию, транзакция на соединении уже зафиксирована"""
+        conn = FakeReadConnection(7)
+
+        for chunk, current_conn in self.iterate(conn):
+            self.assertFalse(current_conn.in_transaction)
+
+    @mock.patch('scan_base.retry.time.sleep')
+    def test_resumes_after_reconnect(self, sleep):
+        """После обрыва соединения чтение продолжается с последнего прочитанного external_id"""
+        conn = FakeReadConnection(7)
+        new_conn = FakeReadConnection(7)
+        stream = self.iterate(conn)
+        first, _ = next(stream)
+        conn.fail_queries = 1
+
+        with mock.patch('scan_base.db.psycopg2.connect', return_value=new_conn):
+            rest = [(chunk, current_conn) for chunk, current_conn in stream]
+
+        self.assertEqual(first, [1, 2, 3])
+        self.assertEqual([chunk for chunk, _ in rest], [[4, 5, 6], [7]])
+        self.assertIs(rest[-1][1], new_conn)
+
+
+class ScrollSession:
+    """Elasticsearch с count документами: первая страница - поиск с scroll, следующие - по scroll_id"""
+
+    def __init__(self, count: int):
+        self.docs = [{'_source': {'guid': f'guid-{i}', 'external_id': str(i)}} for i in range(count)]
+        self.offset = 0
+        self.size = 0
+        self.posts = []
+        self.cleared = []
+
+    def post(self, url, json=None, timeout=None):
+        self.posts.append((url, json))
+        if 'query' in json:
+            self.size = json['size']
+        page, self.offset = self.docs[self.offset:self.offset + self.size], self.offset + self.size
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'_scroll_id': 'scroll-1', 'hits': {'hits': page}}
+        return response
+
+    def delete(self, url, json=None, timeout=None):
+        self.cleared.append((url, json))
+
+
+class TestGetMlsGuidsBulk(unittest.TestCase):
+    @mock.patch.object(send_sold_to_mls, 'MLS_SEARCH_PAGE_SIZE', 10)
+    @mock.patch.object(send_sold_to_mls, 'MLS_RGN_ELASTIC_URL', 'http://es:9200/mls/')
+    def test_reads_all_pages_through_scroll(self):
+        """Выдача больше страницы читается через scroll (без from), контекст scroll закрывается"""
+        session = ScrollSession(25)
+
+        found = get_mls_guids_bulk(list(range(25)), 'spb', 24, session=session)
+
+        self.assertEqual(found, {i: [f'guid-{i}'] for i in range(25)})
+        self.assertEqual([url for url, _ in session.posts], [
+            'http://es:9200/mls/_search?scroll=1m',
+            'http://es:9200/_search/scroll',
+            'http://es:9200/_search/scroll',
+        ])
+        self.assertTrue(all('from' not in body for _, body in session.posts))
+        self.assertEqual(session.posts[1][1], {'scroll': '1m', 'scroll_id': 'scroll-1'})
+        self.assertEqual(session.cleared, [('http://es:9200/_search/scroll', {'scroll_id': ['scroll-1']})])
+
+
+DOMCLICK_PROJECT = 24
+
+
+@mock.patch.object(send_sold_to_mls, '_session_context_cache', new_callable=dict)
+@mock.patch.object(send_sold_to_mls, 'execute_db_query')
+class TestSessionContextCache(unittest.TestCase):
+    def session_row(self, execute_db_query, previous_sessions):
+        row = {'region': 1, 'facet': 2, 'region_code': 'msk', 'previous_sessions': previous_sessions}
+        execute_db_query.side_effect = lambda conn, db_config, query_func: (row, conn)
+
+    def test_context_cached_while_session_lives(self, execute_db_query, cache):
+        self.session_row(execute_db_query, [9, 8])
+
+        first, conn = send_sold_to_mls.get_session_context('conn', 10, 'host=db', DOMCLICK_PROJECT)
+        second, conn = send_sold_to_mls.get_session_context('conn', 10, 'host=db', DOMCLICK_PROJECT)
+
+        self.assertIs(first, second)
+        self.assertEqual(execute_db_query.call_count, 1)
+
+    def test_finished_session_leaves_cache(self, execute_db_query, cache):
+        """После send_sold_to_mls (закрытие сессии) контекст сессии удаляется, контексты других сессий остаются"""
+        self.session_row(execute_db_query, [])
+        send_sold_to_mls.get_session_context('conn', 11, 'host=db', DOMCLICK_PROJECT)
+
+        send_sold_to_mls.send_sold_to_mls('conn', 10, DOMCLICK_PROJECT)
+
+        self.assertEqual([key[1] for key in cache], [11])
+
+
+if __name__ == '__main__':
+    unittest.main()
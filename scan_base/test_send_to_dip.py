@@ -0,0 +1,204 @@
+import time
+import unittest
+from unittest import mock
+
+import pika.exceptions
+
+from scan_base import send_to_dip
+from scan_base.send_to_dip import DipBatcher, DipPublisher
+
+
+class FakeChannel:
+    """
+    Канал RabbitMQ в памяти. В режиме confirm_delivery сообщение попадает в acked,
+    только если basic_publish не упал: так брокер подтверждает его basic.ack.
+    fail_publishes - сколько первых отправок оборвать (соединение потеряно до подтверждения)
+    """
+
+    def __init__(self, fail_publishes: int = 0, nack_publishes: int = 0):
+        self.is_open = True
+        self.is_closed = False
+        self.confirming = False
+        self.fail_publishes = fail_publishes
+        self.nack_publishes = nack_publishes
+        self.published = []
+        self.acked = []
+
+    def confirm_delivery(self):
+        self.confirming = True
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((body, properties.message_id))
+        if self.fail_publishes:
+            self.fail_publishes -= 1
+            raise pika.exceptions.StreamLostError("соединение с RabbitMQ потеряно")
+        if self.nack_publishes:
+            self.nack_publishes -= 1
+            raise pika.exceptions.NackError([])
+        if self.confirming:
+            self.acked.append((body, properties.message_id))
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    is_open = True
+    is_closed = False
+
+    def process_data_events(self, time_limit=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakePublisher(DipPublisher):
+    """DipPublisher без RabbitMQ: сообщения остаются в FakeChannel"""
+
+    def __init__(self, confirm_delivery: bool = True, fail_publishes: int = 0, nack_publishes: int = 0):
+        super().__init__(confirm_delivery)
+        self.channel = FakeChannel(fail_publishes, nack_publishes)
+        self.connects = 0
+
+    def _connect(self):
+        if self._channel is None:
+            self.connects += 1
+            self._connection = FakeConnection()
+            self._channel = self.channel
+            if self.confirm_delivery:
+                self._channel.confirm_delivery()
+
+
+@mock.patch('scan_base.retry.time.sleep')
+class TestConfirmDelivery(unittest.TestCase):
+    def test_confirms_by_default(self, sleep):
+        publisher = FakePublisher()
+        publisher.publish_body(b'{}', 'page-1')
+
+        self.assertTrue(publisher.channel.confirming)
+        self.assertEqual(publisher.channel.acked, [(b'{}', 'page-1')])
+
+    def test_lost_connection_before_ack_resends_same_id(self, sleep):
+        """Обрыв до подтверждения - переподключение и повтор с тем же message_id"""
+        publisher = FakePublisher(fail_publishes=1)
+        publisher.publish_body(b'{"a":1}', 'page-1')
+
+        self.assertEqual(publisher.connects, 2)
+        self.assertEqual(publisher.channel.published, [(b'{"a":1}', 'page-1')] * 2)
+        self.assertEqual(publisher.channel.acked, [(b'{"a":1}', 'page-1')])
+
+    def test_nack_is_retried(self, sleep):
+        publisher = FakePublisher(nack_publishes=1)
+        publisher.publish_body(b'{}', 'page-1')
+
+        self.assertEqual(publisher.channel.acked, [(b'{}', 'page-1')])
+
+    def test_confirms_can_be_disabled(self, sleep):
+        publisher = FakePublisher(confirm_delivery=False)
+        publisher.publish_body(b'{}')
+
+        self.assertFalse(publisher.channel.confirming)
+        self.assertEqual(len(publisher.channel.published), 1)
+
+
+class TestMessageId(unittest.TestCase):
+    def test_identical_messages_get_distinct_ids(self):
+        """Одинаковые по содержимому сообщения - не дубли"""
+        publisher = FakePublisher()
+        publisher.publish_body(b'{}')
+        publisher.publish_body(b'{}')
+
+        ids = [message_id for _, message_id in publisher.channel.published]
+        self.assertEqual(len(set(ids)), 2)
+
+    def test_replayed_source_gets_same_ids(self):
+        """Повторная запись того же источника дает те же message_id, другой источник - другие"""
+        def send(source_ids):
+            publisher = FakePublisher()
+            batcher = DipBatcher(publisher, max_cards=2)
+            for i, source_id in enumerate(source_ids):
+                batcher.add({'id': i}, 1, 'file', source_id=source_id)
+            batcher.flush()
+            return [message_id for _, message_id in publisher.channel.published]
+
+        first = send(['10-1', '10-1', '10-1', '10-2', '10-2'])
+        self.assertEqual(first, ['10-1-1', '10-1-2', '10-2-1'])
+        self.assertEqual(send(['10-1', '10-1', '10-1', '10-2', '10-2']), first)
+        self.assertTrue(set(send(['11-1', '11-1'])).isdisjoint(first))
+
+
+def published_cards(publisher: FakePublisher):
+    """Сколько карточек в каждом отправленном сообщении"""
+    return [body.count(b'"id"') for body, _ in publisher.channel.published]
+
+
+@mock.patch('scan_base.send_to_dip.time.monotonic', return_value=0.0)
+class TestDipBatcherTriggers(unittest.TestCase):
+    def test_count_trigger(self, monotonic):
+        publisher = FakePublisher()
+        batcher = DipBatcher(publisher, max_cards=3)
+        for i in range(7):
+            batcher.add({'id': i}, 1, 'file')
+
+        self.assertEqual(published_cards(publisher), [3, 3])
+        batcher.flush()
+        self.assertEqual(published_cards(publisher), [3, 3, 1])
+
+    def test_byte_trigger(self, monotonic):
+        """Карточка, с которой пачка превысила бы max_bytes, начинает новую пачку"""
+        publisher = FakePublisher()
+        card_bytes = len(send_to_dip.encode_card({'id': 0, 'text': 'x' * 100}))
+        batcher = DipBatcher(publisher, max_cards=100, max_bytes=card_bytes * 2 + 1)
+        for i in range(5):
+            batcher.add({'id': i, 'text': 'x' * 100}, 1, 'file')
+
+        self.assertEqual(published_cards(publisher), [2, 2])
+
+    def test_age_trigger(self, monotonic):
+        publisher = FakePublisher()
+        batcher = DipBatcher(publisher, max_cards=100, max_age=30.0)
+        batcher.add({'id': 1}, 1, 'file')
+        batcher.add({'id': 2}, 2, 'file')
+
+        monotonic.return_value = 29.0
+        batcher.flush_expired()
+        self.assertEqual(published_cards(publisher), [])
+
+        monotonic.return_value = 30.0
+        batcher.flush_expired()
+        self.assertEqual(published_cards(publisher), [1, 1])
+
+    def test_batches_are_per_module_and_file(self, monotonic):
+        publisher = FakePublisher()
+        batcher = DipBatcher(publisher, max_cards=2)
+        batcher.add({'id': 1}, 1, 'a')
+        batcher.add({'id': 2}, 1, 'b')
+        batcher.add({'id': 3}, 1, 'a')
+
+        self.assertEqual(len(publisher.channel.published), 1)
+        self.assertIn(b'"fileName":"a"', publisher.channel.published[0][0])
+
+
+class TestFlushTimer(unittest.TestCase):
+    @mock.patch.object(send_to_dip, 'DIP_FLUSH_INTERVAL', 0.01)
+    @mock.patch.object(send_to_dip.Config, 'get_rabbitmq_config', return_value={
+        'batch_max_cards': 100, 'batch_max_bytes': 1_000_000, 'batch_max_age': 0.05,
+    })
+    def test_aged_batch_is_sent_without_new_cards(self, get_rabbitmq_config):
+        """Карточки перестали поступать - пачка все равно уходит по возрасту"""
+        publisher = FakePublisher()
+        with mock.patch.object(send_to_dip, '_publisher', publisher):
+            self.addCleanup(send_to_dip.close_dip_publisher)
+            send_to_dip.send_to_dip_batched({'id': 1}, 1, 'file')
+
+            for _ in range(200):
+                if publisher.channel.published:
+                    break
+                time.sleep(0.01)
+
+        self.assertEqual(published_cards(publisher), [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+"""
+Несколько браузеров Chrome для сканирования Домклика.
+
+Каждый браузер запускается со своим профилем и портом remote debugging
+(DEBUGGER_ENDPOINTS в const.py). У каждого браузера свой адаптивный темп запросов
+(AdaptivePacer, история по каждому браузеру в PACER_STATE_FILE), а сумму их запросов
+ограничивает общий TokenBucket (PACER_TOTAL_MAX_RATE). У каждого браузера свое состояние
+здоровья: после BROWSER_MAX_FAILURES ответов не 200 подряд браузер выводится
+из работы на BROWSER_COOLDOWN секунд, а его запросы выполняют остальные браузеры.
+"""
+
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from scan_base.rate_limit import TokenBucket
+from scan_base.retry import CircuitBreaker
+from scan_domclick_v2.const import *
+from scan_domclick_v2.main import SCAN_RETRY, _execute_cdp_request_single, connecting_to_browser, create_pacer
+
+
+class BrowserSlot:
+    """
+    Подключенный браузер: driver, свой темп запросов и состояние здоровья.
+    bucket - общий для всех браузеров потолок частоты запросов к сайту
+    """
+
+    def __init__(self, host: str, port: int, driver, bucket: Optional[TokenBucket] = None):
+        self.host = host
+        self.port = port
+        self.driver = driver
+        self.name = f"{host}:{port}"
+        self.pacer = create_pacer(f"{PACER_HOST}@{self.name}")
+        self.bucket = bucket
+        self.health = CircuitBreaker(
+            f"Браузер {self.name}",
+            failure_threshold=BROWSER_MAX_FAILURES,
+            reset_timeout=BROWSER_COOLDOWN,
+        )
+        # selenium WebDriver и CdpWebsocketDriver нельзя использовать из нескольких потоков одновременно
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+
+    def fetch(self, api_url: str) -> Dict[str, Any]:
+        """Выполняет один запрос через этот браузер в его темпе"""
+        self.pacer.acquire()
+        if self.bucket:
+            self.bucket.acquire()
+        with self._lock:
+            self.requests += 1
+            started = time.monotonic()
+            result = _execute_cdp_request_single(self.driver, api_url)
+        self.pacer.record(result.get('status', 'N/A'), time.monotonic() - started)
+        return result
+
+
+class BrowserPool:
+    """
+    Набор браузеров. Запрос выполняется через предпочтительный браузер потока,
+    а если он выведен из работы или вернул ошибку - через другой здоровый браузер.
+    """
+
+    def __init__(
+        self,
+        endpoints: List[Tuple[str, int]] = DEBUGGER_ENDPOINTS,
+        backend: str = CDP_BACKEND,
+    ):
+        self.backend = backend
+        self.slots: List[BrowserSlot] = []
+        # Один потолок частоты на все браузеры: запросы к сайту идут с одного адреса
+        self.bucket = TokenBucket(PACER_TOTAL_MAX_RATE)
+
+        for host, port in endpoints:
+            try:
+                driver = connecting_to_browser(host, port, backend)
+            except Exception as e:
+                print(f"⚠️ Браузер {host}:{port} пропущен: {e}")
+                continue
+            self.slots.append(BrowserSlot(host, port, driver, bucket=self.bucket))
+
+        if not self.slots:
+            raise Exception("❌ Не удалось подключиться ни к одному браузеру")
+
+        print(f"✓ Подключено браузеров: {len(self.slots)} из {len(endpoints)}")
+
+    def _pick(self, preferred: Optional[BrowserSlot], exclude: Optional[BrowserSlot] = None) -> Optional[BrowserSlot]:
+        """Выбирает здоровый браузер: сначала preferred, потом остальные по порядку"""
+        candidates = ([preferred] if preferred else []) + [s for s in self.slots if s is not preferred]
+        for slot in candidates:
+            if slot is not exclude and slot.health.allow_request():
+                return slot
+        return None
+
+    def execute_cdp_request(self, api_url: str, page_num: int = 0, preferred: Optional[BrowserSlot] = None) -> Dict[str, Any]:
+        """
+        То же, что execute_cdp_request из main.py, но с переключением между браузерами.
+        После ошибки запрос сразу повторяется через другой здоровый браузер;
+        если другого нет - через тот же браузер после растущей паузы (SCAN_RETRY).
+
+        Args:
+            api_url: URL для запроса
+            page_num: Номер страницы (для сообщений)
+            preferred: Браузер, через который запрос выполняется в первую очередь
+
+        Returns:
+            Словарь (json) с объявлениями
+        """
+        retry_count = 0
+        failed_slot: Optional[BrowserSlot] = None
+
+        while retry_count <= MAX_RETRY_SCAN_URL:
+            slot = self._pick(preferred, exclude=failed_slot)
+
+            if slot is None and failed_slot is not None and failed_slot.health.allow_request():
+                # Другого здорового браузера нет - повторяем через тот же после паузы
+                slot = failed_slot
+                delay = SCAN_RETRY.compute_delay(retry_count)
+                print(f"   ⏳ Повторная попытка {retry_count} из {MAX_RETRY_SCAN_URL} через {slot.name}. Ждем {delay:.0f} секунд...")
+                time.sleep(delay)
+
+            if slot is None:
+                # Все браузеры выведены из работы - ждем, пока первый из них не вернется
+                wait = min(s.health.seconds_until_retry() for s in self.slots)
+                print(f"   ⏳ Все браузеры выведены из работы. Ждем {wait:.0f} секунд...")
+                time.sleep(max(wait, 1.0))
+                failed_slot = None
+                continue
+
+            if failed_slot is not None and slot is not failed_slot:
+                print(f"   🔀 Страница {page_num}: переключаемся с {failed_slot.name} на {slot.name}")
+
+            result = slot.fetch(api_url)
+            status = result.get('status', 'N/A')
+
+            if status == 200:
+                slot.health.record_success()
+                return result
+
+            print(f"   ⚠️  {slot.name}: HTTP {status} ({result.get('statusText', 'N/A')})")
+            slot.failures += 1
+            slot.health.record_failure()
+            failed_slot = slot
+            retry_count += 1
+
+        # Все попытки исчерпаны - завершаем программу
+        print(f"\n❌ Не удалось получить успешный ответ для страницы {page_num} после {MAX_RETRY_SCAN_URL + 1} попыток")
+        print("Завершаем выполнение программы")
+        sys.exit(1)
+
+    def report(self) -> None:
+        """Печатает статистику по браузерам"""
+        for slot in self.slots:
+            print(f"   {slot.name}: запросов {slot.requests}, ошибок {slot.failures}, состояние {slot.health.state}, темп {slot.pacer.rate:.2f} запросов/с")
+
+    def close(self) -> None:
+        """Сохраняет историю темпа запросов и закрывает websocket'ы к DevTools (сами браузеры продолжают работать)"""
+        for slot in self.slots:
+            slot.pacer.save()
+        if self.backend != 'websocket':
+            return
+        for slot in self.slots:
+            try:
+                slot.driver.quit()
+            except Exception:
+                pass
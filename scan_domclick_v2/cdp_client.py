@@ -0,0 +1,146 @@
+"""
+Клиент Chrome DevTools Protocol напрямую через websocket, без Selenium и ChromeDriver.
+
+Подключается к уже запущенному браузеру (google-chrome --remote-debugging-port=9222)
+и умеет выполнять любые команды CDP (Network.enable, Runtime.evaluate с awaitPromise и т.д.).
+"""
+
+import asyncio
+import itertools
+import json
+import urllib.request
+from typing import Any, Dict, Optional
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+
+class CdpError(Exception):
+    """Браузер вернул ошибку на команду CDP"""
+
+
+class CdpClient:
+    """
+    asyncio-клиент CDP. Команды отправляются с уникальным id,
+    ответы сопоставляются по id, события CDP игнорируются.
+    Если браузер закрыл websocket, следующая команда подключается к вкладке заново.
+    """
+
+    def __init__(self, host: str, port: int, url_hint: Optional[str] = None):
+        self.host = host
+        self.port = port
+        # Если открыто несколько вкладок, берем ту, в адресе которой есть url_hint
+        self.url_hint = url_hint
+        self.target_url: Optional[str] = None
+        self._ws = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+
+    def _get_websocket_url(self) -> str:
+        """Находит вкладку через http://host:port/json и возвращает ее webSocketDebuggerUrl"""
+        with urllib.request.urlopen(f"http://{self.host}:{self.port}/json", timeout=10) as response:
+            targets = json.loads(response.read().decode('utf-8'))
+
+        pages = [t for t in targets if t.get('type') == 'page' and t.get('webSocketDebuggerUrl')]
+        if not pages:
+            raise CdpError(f"В браузере {self.host}:{self.port} нет открытых вкладок")
+
+        page = next((t for t in pages if self.url_hint and self.url_hint in t.get('url', '')), pages[0])
+        self.target_url = page.get('url')
+        return page['webSocketDebuggerUrl']
+
+    async def connect(self) -> None:
+        if websockets is None:
+            raise ImportError("Для CDP_BACKEND = 'websocket' нужен пакет websockets (pip install websockets)")
+
+        loop = asyncio.get_running_loop()
+        ws_url = await loop.run_in_executor(None, self._get_websocket_url)
+        # Ответ Runtime.evaluate со страницей объявлений может быть больше лимита по умолчанию (1 МБ)
+        self._ws = await websockets.connect(ws_url, max_size=None, ping_interval=None)
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    def _is_connected(self) -> bool:
+        return self._ws is not None and self._ws.close_code is None and not self._reader_task.done()
+
+    async def _reconnect(self) -> None:
+        """Закрывает оборванное соединение и подключается к вкладке заново"""
+        print(f"   🔌 Соединение с DevTools {self.host}:{self.port} потеряно, переподключаемся...")
+        await self.close()
+        await self.connect()
+        print("   ✓ DevTools websocket переподключен")
+
+    async def _read_loop(self) -> None:
+        try:
+            async for raw in self._ws:
+                message = json.loads(raw)
+                future = self._pending.pop(message.get('id'), None)
+                if future is None or future.done():
+                    continue
+                if 'error' in message:
+                    future.set_exception(CdpError(message['error'].get('message', str(message['error']))))
+                else:
+                    future.set_result(message.get('result', {}))
+        except Exception as e:
+            error = e
+        else:
+            error = CdpError("Соединение с браузером закрыто")
+
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+
+    async def send(self, method: str, params: Optional[Dict[str, Any]] = None, timeout: float = 120.0) -> Dict[str, Any]:
+        """Отправляет команду CDP и возвращает ее result"""
+        if self._ws is None:
+            raise CdpError("Нет соединения с браузером")
+        if not self._is_connected():
+            await self._reconnect()
+
+        command_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[command_id] = future
+
+        try:
+            await self._ws.send(json.dumps({'id': command_id, 'method': method, 'params': params or {}}))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(command_id, None)
+
+    async def close(self) -> None:
+        if self._ws is not None:
+            await self._ws.close()
+        if self._reader_task is not None:
+            await self._reader_task
+        self._ws = None
+        self._reader_task = None
+
+
+class CdpWebsocketDriver:
+    """
+    Синхронная обертка над CdpClient с тем же интерфейсом, что использует сканер
+    у selenium WebDriver: execute_cdp_cmd() и current_url.
+    Можно подставлять вместо driver в execute_cdp_request.
+    """
+
+    def __init__(self, host: str, port: int, url_hint: Optional[str] = None):
+        self._loop = asyncio.new_event_loop()
+        self._client = CdpClient(host, port, url_hint=url_hint)
+        self._loop.run_until_complete(self._client.connect())
+
+    def execute_cdp_cmd(self, cmd: str, cmd_args: Dict[str, Any]) -> Dict[str, Any]:
+        return self._loop.run_until_complete(self._client.send(cmd, cmd_args))
+
+    @property
+    def current_url(self) -> str:
+        result = self.execute_cdp_cmd('Runtime.evaluate', {'expression': 'location.href', 'returnByValue': True})
+        return result.get('result', {}).get('value') or self._client.target_url or ''
+
+    def quit(self) -> None:
+        """Закрывает websocket. Сам браузер продолжает работать"""
+        if not self._loop.is_closed():
+            self._loop.run_until_complete(self._client.close())
+            self._loop.close()
@@ -1,3 +1,5 @@
+import os
+
 HOME_URL = "domclick.ru"
 
 DIP_MODULE_ID = 23
@@ -5,12 +7,73 @@ PROJECT_ID = 24
 
 MAX_PAGES = 99 # максимум 99, offset=1980
 
-# Задержка перед запросом к API Домклика (в секундах)
-INTERVAL = (1, 4)
+# Адаптивный темп запросов к API Домклика (AdaptivePacer): после успешного ответа частота растет
+# на PACER_INCREASE запросов в секунду, после 403/429/5xx - умножается на PACER_DECREASE.
+# Частота, задержка ответов и счетчики ответов по каждому хосту сохраняются в PACER_STATE_FILE
+# и подхватываются при следующем запуске
+PACER_HOST = "bff-search-web.domclick.ru"
+PACER_MIN_RATE = 0.1
+PACER_MAX_RATE = 2.0
+PACER_START_RATE = 0.4 # как раньше: в среднем одна страница за 1-4 секунды
+PACER_INCREASE = 0.02
+PACER_DECREASE = 0.5
+PACER_STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pacer_state.json')
+# Общий потолок частоты запросов к API Домклика через все браузеры scan_domclick_v2/multi.py
+# (запросов в секунду): темп каждого браузера свой, но сайт видит их сумму
+PACER_TOTAL_MAX_RATE = 4.0
+# Задержка перед повтором запроса, который не вернул HTTP 200: растет от 10 до 120 секунд
+RETRY_BASE_DELAY = 10
+RETRY_MAX_DELAY = 120
+
+# Делить раздел на непересекающиеся диапазоны цен (шарды), каждый из которых помещается
+# в MAX_PAGES страниц (scan_domclick_v2/shards.py). Шарды сканируются независимо, в том числе
+# разными браузерами. Работает в scan_domclick_v2/multi.py
+USE_PRICE_SHARDS = False
+# Сколько объявлений может быть в одном шарде. Меньше MAX_PAGES*20 с запасом
+# на объявления, которые появятся во время сканирования
+SHARD_MAX_ITEMS = MAX_PAGES * 20 - 200
 
 # Количество повторных попыток получить данные от Домклика в случае ошибки
 MAX_RETRY_SCAN_URL = 10
 
+# Сколько карточек сохраняем в БД одним запросом (add_card_shots_v2) и одной транзакцией:
+# целая страница Домклика (замеры - в bench/card_shots.py)
+CARD_SHOT_BATCH_SIZE = 20
+
+# Не сохранять заново в БД и не отправлять в DIP объявления, которые не изменились с прошлого
+# сканирования (хеш карточки совпал с хешем в локальном хранилище CARD_HASH_DB).
+# Такие объявления только отмечаются в текущей сессии (touch_card_shots_v2)
+SKIP_UNCHANGED_CARDS = True
+CARD_HASH_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'card_hashes.sqlite3')
+# Ключи карточки, изменение которых не считается изменением объявления
+CARD_HASH_IGNORE_KEYS = ()
+# Через сколько страниц отправлять накопленные пачки в DIP и фиксировать хеши карточек.
+# Если сканер упадет, заново в DIP уйдут карточки не больше чем этих страниц
+CARD_HASH_COMMIT_EVERY = 20
+
+# Сколько полученных страниц может ждать записи в БД и отправки в DIP,
+# прежде чем получение следующих страниц приостановится
+PIPELINE_QUEUE_SIZE = 3
+
+# Полученные страницы сначала записываются в локальную очередь WRITE_SPOOL_DB, а в БД и DIP
+# их по порядку переносит фоновый поток. Пока БД или RabbitMQ недоступны, сканирование
+# продолжается, страницы копятся в очереди; после перезапуска очередь дописывается первой.
+# Включать вместо ожидания записи в IngestWorker: с очередью он только кладет страницы на диск
+USE_WRITE_SPOOL = False
+WRITE_SPOOL_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'write_spool.sqlite3')
+# Через сколько страниц фоновый поток подтверждает отправку в DIP и удаляет страницы из очереди
+WRITE_SPOOL_SYNC_EVERY = 20
+
+# Как часто (в секундах) фоновый поток сохраняет в сессию, с какой страницы продолжать.
+# Точка ставится после записи каждой страницы, в БД уходит только последняя за интервал
+CHECKPOINT_INTERVAL = 1.0
+
+# Сколько страниц (offset'ов) запрашиваем одним вызовом CDP Runtime.evaluate.
+# 1 - по одной странице, как раньше
+CDP_BATCH_PAGES = 1
+# Сколько fetch() одновременно выполняется внутри страницы браузера при пакетном запросе
+CDP_BATCH_CONCURRENCY = 2
+
 # Количество сессий подряд, в которых объект должен отсутствовать, чтобы отправиться в проданные
 # Например:
 # если = 1, то объект отправляется в проданные, если его не было в последней сессии
@@ -20,6 +83,23 @@ SKIP_SESSIONS_COUNT = 4
 DEBUGGER_HOST = "127.0.0.1"
 DEBUGGER_PORT = 9222
 
+# Браузеры для scan_domclick_v2/multi.py: у каждого свой профиль и порт remote debugging.
+# Разделы распределяются между браузерами, у каждого браузера свой адаптивный темп запросов (PACER_*)
+DEBUGGER_ENDPOINTS = [
+    (DEBUGGER_HOST, DEBUGGER_PORT),
+    # (DEBUGGER_HOST, 9223),
+]
+
+# Сколько ответов не 200 подряд выводят браузер из работы и на сколько секунд.
+# Пока браузер выведен из работы, его запросы выполняют остальные браузеры
+BROWSER_MAX_FAILURES = 3
+BROWSER_COOLDOWN = 300
+
+# Как общаться с браузером:
+# 'selenium' - через ChromeDriver (webdriver.Chrome + execute_cdp_cmd)
+# 'websocket' - напрямую через DevTools websocket (scan_domclick_v2/cdp_client.py, нужен пакет websockets)
+CDP_BACKEND = 'selenium'
+
 
 RED = "\033[31m"
 GREEN = "\033[32m"
@@ -68,6 +148,9 @@ python3 -m scan_domclick_v2.main flat-sale-mo && python3 -m scan_domclick_v2.mai
 МО - аренда
 python3 -m scan_domclick_v2.main flat-rent-mo && python3 -m scan_domclick_v2.main room-rent-mo && python3 -m scan_domclick_v2.main house-rent-mo && python3 -m scan_domclick_v2.main house_part-rent-mo && python3 -m scan_domclick_v2.main townhouse-rent-mo && python3 -m scan_domclick_v2.main garage-rent-mo && python3 -m scan_domclick_v2.main comm-rent-mo
 
+Или несколько разделов одним процессом (браузеры из DEBUGGER_ENDPOINTS, разделы сканируются вперемешку)
+python3 -m scan_domclick_v2.multi flat-sale-msk layout-sale-msk room-sale-msk house-sale-msk
+
 
 список типов недвижимости хранится в таблице facetlar_v2:
 - flat
@@ -197,6 +197,97 @@ end;
 $$ language plpgsql;
 
 
+-- хеш содержимого карточки (card_hash в scan_base/card_hashes.py), по нему touch_card_shots_v2
+-- проверяет, что карточка в БД та же, что и в локальном хранилище хешей сканера
+alter table card_shotlar_v2 add column if not exists card_hash text;
+
+
+DROP FUNCTION if exists add_card_shots_v2(int8, int8[], text[], jsonb[]);
+DROP FUNCTION if exists add_card_shots_v2(int8, int8[], text[], jsonb[], text[]);
+create function add_card_shots_v2(
+	_scan_session bigint,
+	_external_ids int8[],
+	_external_urls text[],
+	_cards jsonb[],
+	_card_hashes text[] default null
+)
+returns table(o_external_id int8, o_card_id integer)
+as $$
+begin
+	-- пакетная версия add_card_shot_v2: сохраняет всю страницу объявлений одним запросом
+	-- если external_id встречается в пачке несколько раз, берем последнюю карточку
+	return query
+	with src as (
+		select distinct on (s.external_id)
+			s.external_id, s.external_url, s.card, s.card_hash
+		from unnest(_external_ids, _external_urls, _cards, _card_hashes)
+			with ordinality as s(external_id, external_url, card, card_hash, ord)
+		order by s.external_id, s.ord desc
+	),
+	existing as (
+		select distinct on (cs.external_id) cs.external_id, cs.id
+		from card_shotlar_v2 cs
+		join src on src.external_id = cs.external_id
+		order by cs.external_id, cs.id
+	),
+	updated as (
+		update card_shotlar_v2 cs
+		set scan_session = _scan_session, card = src.card, card_hash = src.card_hash, updated_at = now()
+		from existing e
+		join src on src.external_id = e.external_id
+		where cs.id = e.id
+		returning cs.external_id, cs.id
+	),
+	inserted as (
+		insert into card_shotlar_v2 (scan_session, external_id, external_url, card, card_hash)
+		select _scan_session, src.external_id, src.external_url, src.card, src.card_hash
+		from src
+		where not exists (select 1 from existing e where e.external_id = src.external_id)
+		returning card_shotlar_v2.external_id, card_shotlar_v2.id
+	)
+	select u.external_id, u.id from updated u
+	union all
+	select i.external_id, i.id from inserted i;
+end;
+$$ language plpgsql;
+
+
+DROP FUNCTION if exists touch_card_shots_v2(int8, int8[], text[]);
+create function touch_card_shots_v2(
+	_scan_session bigint,
+	_external_ids int8[],
+	_card_hashes text[]
+)
+returns table(o_external_id int8, o_card_id integer)
+as $$
+begin
+	-- объявление не изменилось с прошлого сканирования: только отмечаем, что видели его в этой сессии,
+	-- карточку и updated_at не трогаем.
+	-- Если карточки нет или хеш в БД другой - объявление не возвращается,
+	-- и его нужно сохранить полностью через add_card_shots_v2
+	return query
+	with src as (
+		select distinct on (s.external_id) s.external_id, s.card_hash
+		from unnest(_external_ids, _card_hashes) as s(external_id, card_hash)
+		order by s.external_id
+	),
+	existing as (
+		select distinct on (cs.external_id) cs.external_id, cs.id, cs.card_hash
+		from card_shotlar_v2 cs
+		join src on src.external_id = cs.external_id
+		order by cs.external_id, cs.id
+	)
+	update card_shotlar_v2 cs
+	set scan_session = _scan_session
+	from existing e
+	join src on src.external_id = e.external_id
+	where cs.id = e.id
+		and (e.card_hash is null or e.card_hash = src.card_hash)
+	returning cs.external_id, cs.id;
+end;
+$$ language plpgsql;
+
+
 DROP FUNCTION if exists update_scan_session_v2(int8, smallint, int8);
 create function update_scan_session_v2(
 	_session_id int8,
@@ -267,3 +358,128 @@ begin
 	o_facet_name := _region_name || '::' || _facet_name_part;
 end;
 $$ language plpgsql;
+
+
+
+-- --------------------------------------
+-- Поиск проданных (send_sold_to_mls): в card_shotlar_v2 одна строка на объявление
+-- с последней сессией, в которой его видели, поэтому запрос берет старые сессии раздела
+-- и по индексу на scan_session читает только их карточки, без отдельной таблицы.
+-- Блок можно выполнить отдельно на существующей БД.
+
+create index if not exists card_shotlar_v2_scan_session_idx
+	on card_shotlar_v2 (scan_session);
+
+create index if not exists scan_sessionlar_v2_region_facet_id_idx
+	on scan_sessionlar_v2 (region, facet, id) where finished_at is not null;
+
+-- таблица последних сессий и ее триггер больше не нужны: они добавляли запись на каждую карточку
+DROP FUNCTION if exists touch_card_last_seen_v2() cascade;
+drop table if exists card_last_seen_v2;
+
+
+
+-- --------------------------------------
+-- Шарды сессии: непересекающиеся диапазоны цен [price_from, price_to], в каждом из которых
+-- объявлений помещается в MAX_PAGES страниц. price_to is null - без верхней границы.
+-- page_num и min_price - откуда продолжать шард, finished_at - шард пройден до конца.
+-- После перезапуска сканируются только шарды с finished_at is null.
+
+create table if not exists scan_shardlar_v2 (
+	id serial8 primary key,
+	scan_session int8 not null references scan_sessionlar_v2(id) on delete cascade,
+	price_from int8 not null,
+	price_to int8,
+	total int,
+	page_num smallint not null default 1,
+	min_price int8 not null,
+	finished_at timestamptz
+);
+
+create index if not exists scan_shardlar_v2_scan_session_idx
+	on scan_shardlar_v2 (scan_session);
+
+
+DROP FUNCTION if exists add_scan_shards_v2(int8, int8[], int8[], int[]);
+create function add_scan_shards_v2(
+	_scan_session int8,
+	_price_from int8[],
+	_price_to int8[],
+	_totals int[]
+)
+returns table(o_shard_id int8, o_price_from int8)
+as $$
+begin
+	return query
+	insert into scan_shardlar_v2 (scan_session, price_from, price_to, total, min_price)
+	select _scan_session, s.price_from, s.price_to, s.total, s.price_from
+	from unnest(_price_from, _price_to, _totals) as s(price_from, price_to, total)
+	returning id, price_from;
+end;
+$$ language plpgsql;
+
+
+DROP FUNCTION if exists get_scan_shards_v2(int8);
+create function get_scan_shards_v2(
+	_scan_session int8
+)
+returns table(
+	o_shard_id int8,
+	o_price_from int8,
+	o_price_to int8,
+	o_total int,
+	o_page_num smallint,
+	o_min_price int8,
+	o_finished boolean
+)
+as $$
+begin
+	return query
+	select id, price_from, price_to, total, page_num, min_price, finished_at is not null
+	from scan_shardlar_v2
+	where scan_session = _scan_session
+	order by price_from;
+end;
+$$ language plpgsql;
+
+
+DROP FUNCTION if exists update_scan_shard_v2(int8, smallint, int8);
+create function update_scan_shard_v2(
+	_shard_id int8,
+	_page_num smallint,
+	_min_price int8
+)
+returns boolean
+as $$
+declare
+	_updated_id int8;
+begin
+	update scan_shardlar_v2
+	set 
+		page_num = _page_num,
+		min_price = _min_price
+	where id = _shard_id
+	returning id into _updated_id;
+	
+	return _updated_id is not null;
+end;
+$$ language plpgsql;
+
+
+DROP FUNCTION if exists finish_scan_shard_v2(int8);
+create function finish_scan_shard_v2(
+	_shard_id int8
+)
+returns boolean
+as $$
+declare
+	_updated_id int8;
+begin
+	update scan_shardlar_v2
+	set finished_at = NOW()
+	where id = _shard_id
+	returning id into _updated_id;
+	
+	return _updated_id is not null;
+end;
+$$ language plpgsql;
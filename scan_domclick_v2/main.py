@@ -11,22 +11,93 @@ https://bff-search-web.domclick.ru/api/offers/v1?address=1d1463ae-c80f-4d19-9331
 """
 
 import time
+import hashlib
 import json
 import sys
-import random
 import re
 import socket
+import threading
 from datetime import datetime
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Optional, Tuple, List
 
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from scan_base.card_hashes import CardHashStore, card_hash
 from scan_base.config import Config
-from scan_base.send_to_dip import send_to_dip
+from scan_base.send_to_dip import send_to_dip_batched, flush_dip_batches, close_dip_publisher
 from scan_base.send_sold_to_mls import send_sold_to_mls
-from scan_base.db import execute_db_query, connect_to_db
+from scan_base.serialization import decode_all, dumps, encode_card, loads
+from scan_base.db import DB_RETRY, ConnectionPool, TransactionLostError, execute_db_query, execute_prepared, prepare_statement, unit_of_work, close_db_pools, get_db_pool
+from scan_base.rate_limit import AdaptivePacer
+from scan_base.retry import BackoffPolicy
+from scan_base.spool import Spool, SpoolDrainer
 from scan_domclick_v2.const import *
+from scan_domclick_v2.pipeline import Checkpointer, IngestWorker
+
+
+# Повторы запроса к Домклику, который не вернул HTTP 200: задержка растет с каждой попыткой
+SCAN_RETRY = BackoffPolicy('Домклик', base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY)
+
+# Частые вызовы функций БД: подготавливаются один раз на подключение (PREPARE)
+ADD_CARD_SHOT = prepare_statement(
+    'add_card_shot_v2',
+    "SELECT * FROM add_card_shot_v2(%s, %s, %s, %s)",
+    ('bigint', 'int8', 'text', 'jsonb'),
+)
+ADD_CARD_SHOTS = prepare_statement(
+    'add_card_shots_v2',
+    "SELECT * FROM add_card_shots_v2(%s, %s::int8[], %s::text[], %s::jsonb[], %s::text[])",
+    ('bigint', 'int8[]', 'text[]', 'jsonb[]', 'text[]'),
+)
+TOUCH_CARD_SHOTS = prepare_statement(
+    'touch_card_shots_v2',
+    "SELECT * FROM touch_card_shots_v2(%s, %s::int8[], %s::text[])",
+    ('bigint', 'int8[]', 'text[]'),
+)
+GET_OR_CREATE_SESSION = prepare_statement(
+    'get_or_create_scan_session_v2',
+    "SELECT * FROM get_or_create_scan_session_v2(%s, %s, %s)",
+    ('text', 'text', 'text'),
+)
+UPDATE_SESSION = prepare_statement(
+    'update_scan_session_v2',
+    "SELECT update_scan_session_v2(%s::bigint, %s::smallint, %s::bigint)",
+    ('int8', 'smallint', 'int8'),
+)
+FINISH_SESSION = prepare_statement(
+    'finish_scan_session_v2',
+    "SELECT finish_scan_session_v2(%s)",
+    ('int8',),
+)
+
+# Общий темп запросов к API Домклика, создается при первом обращении
+_pacer: Optional[AdaptivePacer] = None
+
+
+def create_pacer(key: str = PACER_HOST) -> AdaptivePacer:
+    """Адаптивный темп запросов с настройками из const.py и историей из PACER_STATE_FILE"""
+    return AdaptivePacer(
+        key,
+        min_rate=PACER_MIN_RATE,
+        max_rate=PACER_MAX_RATE,
+        start_rate=PACER_START_RATE,
+        increase=PACER_INCREASE,
+        decrease=PACER_DECREASE,
+        state_path=PACER_STATE_FILE,
+    )
+
+
+def get_pacer() -> AdaptivePacer:
+    global _pacer
+    if _pacer is None:
+        _pacer = create_pacer()
+    return _pacer
+
+
+def close_pacer() -> None:
+    """Сохраняет историю темпа запросов"""
+    if _pacer is not None:
+        _pacer.save()
 
 
 def check_port_available(host: str, port: int, timeout: float = 2.0) -> bool:
@@ -41,32 +112,44 @@ def check_port_available(host: str, port: int, timeout: float = 2.0) -> bool:
         return False
 
 
-def connecting_to_browser():
+def connecting_to_browser(host: str = DEBUGGER_HOST, port: int = DEBUGGER_PORT, backend: str = CDP_BACKEND):
     """
     Подключается к уже запущенному браузеру Chrome с remote debugging
-    """
-    from selenium import webdriver
-    from selenium.webdriver.chrome.options import Options
     
+    Args:
+        host: Хост remote debugging
+        port: Порт remote debugging
+        backend: 'selenium' - через ChromeDriver, 'websocket' - напрямую к DevTools websocket
+    """
     print(f"\n{'='*60}")
-    print(f"🔌 Подключение к браузеру Chrome (remote debugging)")
-    print(f"   ✓ Хост: {DEBUGGER_HOST}:{DEBUGGER_PORT}")
+    print(f"🔌 Подключение к браузеру Chrome (remote debugging, {backend})")
+    print(f"   ✓ Хост: {host}:{port}")
     
     # Проверяем доступность порта перед попыткой подключения
-    if not check_port_available(DEBUGGER_HOST, DEBUGGER_PORT):
+    if not check_port_available(host, port):
         raise Exception(
-            f"❌ Порт {DEBUGGER_HOST}:{DEBUGGER_PORT} недоступен!\n"
+            f"❌ Порт {host}:{port} недоступен!\n"
         )
-    print(f"   ✓ Порт {DEBUGGER_PORT} доступен")
+    print(f"   ✓ Порт {port} доступен")
     
-    # Создаем опции для подключения к уже запущенному браузеру
-    chrome_options = Options()
-    chrome_options.add_experimental_option("debuggerAddress", f"{DEBUGGER_HOST}:{DEBUGGER_PORT}")
-    
-    # Selenium запускает ChromeDriver и через него подключается к уже запущенному Chrome
     try:
-        driver = webdriver.Chrome(options=chrome_options)
-        print("   ✓ WebDriver создан")
+        if backend == 'websocket':
+            from scan_domclick_v2.cdp_client import CdpWebsocketDriver
+            
+            # Подключаемся напрямую к websocket вкладки, без ChromeDriver
+            driver = CdpWebsocketDriver(host, port, url_hint=HOME_URL)
+            print("   ✓ DevTools websocket подключен")
+        else:
+            from selenium import webdriver
+            from selenium.webdriver.chrome.options import Options
+            
+            # Создаем опции для подключения к уже запущенному браузеру
+            chrome_options = Options()
+            chrome_options.add_experimental_option("debuggerAddress", f"{host}:{port}")
+            
+            # Selenium запускает ChromeDriver и через него подключается к уже запущенному Chrome
+            driver = webdriver.Chrome(options=chrome_options)
+            print("   ✓ WebDriver создан")
     except Exception as e:
         raise Exception(
             f"❌ Не удалось подключиться к браузеру!\n"
@@ -76,7 +159,7 @@ def connecting_to_browser():
     # Получаем адрес текущей открытой страницы в браузере
     try:
         current_url = driver.current_url
-        print(f"   ✓ Подключились к браузеру")
+        print("   ✓ Подключились к браузеру")
         print(f"   Текущий URL: {current_url}")
     except Exception as e:
         raise Exception(
@@ -113,6 +196,17 @@ def parse_arguments():
     return parts[0], parts[1], parts[2]
 
 
+def _parse_body(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Разбирает bodyText ответа в body: JSON, а если это не JSON - сам текст"""
+    text = result.pop('bodyText', None)
+    if text is not None:
+        try:
+            result['body'] = loads(text)
+        except ValueError:
+            result['body'] = text
+    return result
+
+
 def _execute_cdp_request_single(driver, api_url: str) -> Dict[str, Any]:
     """
     Выполняет один запрос через CDP Runtime.evaluate (внутренняя функция)
@@ -136,19 +230,15 @@ def _execute_cdp_request_single(driver, api_url: str) -> Dict[str, Any]:
                     }}
                 }});
                 
+                // Тело возвращаем строкой и разбираем в Python (_parse_body):
+                // строку CDP передает намного дешевле, чем объект с тысячами полей
                 const text = await response.text();
-                let jsonData = null;
-                try {{
-                    jsonData = JSON.parse(text);
-                }} catch (e) {{
-                    // Если не JSON, возвращаем текст
-                }}
                 
                 return {{
                     success: true,
                     status: response.status,
                     statusText: response.statusText,
-                    body: jsonData || text,
+                    bodyText: text,
                     bodyLength: text.length
                 }};
             }} catch (error) {{
@@ -180,7 +270,7 @@ def _execute_cdp_request_single(driver, api_url: str) -> Dict[str, Any]:
                 'message': exception.get('exception', {}).get('description', 'Unknown exception')
             }
         elif result_data.get('type') == 'object' and 'value' in result_data:
-            return result_data['value']
+            return _parse_body(result_data['value'])
         else:
             return {
                 'success': False,
@@ -202,30 +292,182 @@ def _execute_cdp_request_single(driver, api_url: str) -> Dict[str, Any]:
         }
 
 
-def execute_cdp_request(driver, api_url: str, page_num: int = 0):
+def _execute_cdp_request_batch(driver, api_urls: List[str], concurrency: int = CDP_BATCH_CONCURRENCY) -> List[Dict[str, Any]]:
+    """
+    Выполняет несколько запросов одним вызовом CDP Runtime.evaluate (внутренняя функция).
+    Внутри страницы одновременно выполняется не больше concurrency запросов.
+    
+    Args:
+        driver: WebDriver объект
+        api_urls: Список URL для запроса
+        concurrency: Сколько fetch() одновременно выполняется внутри страницы
+    
+    Returns:
+        Список словарей с результатом каждого запроса, в том же порядке, что и api_urls
+    """
+    fetch_script = f"""
+        (async function() {{
+            const urls = {json.dumps(api_urls)};
+            const concurrency = {int(concurrency)};
+            const results = new Array(urls.length);
+            let next = 0;
+            
+            async function fetchOne(url) {{
+                try {{
+                    const response = await fetch(url, {{
+                        method: 'GET',
+                        credentials: 'include',
+                        headers: {{
+                            'Accept': '*/*',
+                            'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+                        }}
+                    }});
+                    
+                    const text = await response.text();
+                    
+                    return {{
+                        success: true,
+                        status: response.status,
+                        statusText: response.statusText,
+                        bodyText: text,
+                        bodyLength: text.length
+                    }};
+                }} catch (error) {{
+                    return {{
+                        success: false,
+                        error: error.toString(),
+                        message: error.message,
+                        status: error.status || null,
+                        statusText: error.statusText || null
+                    }};
+                }}
+            }}
+            
+            async function worker() {{
+                while (next < urls.length) {{
+                    const i = next++;
+                    results[i] = await fetchOne(urls[i]);
+                }}
+            }}
+            
+            const workers = [];
+            for (let w = 0; w < Math.min(concurrency, urls.length); w++) {{
+                workers.push(worker());
+            }}
+            await Promise.all(workers);
+            return results;
+        }})()
+    """
+    
+    def failed(error: str, message: str) -> List[Dict[str, Any]]:
+        return [{'success': False, 'error': error, 'message': message} for _ in api_urls]
+    
+    try:
+        cdp_result = driver.execute_cdp_cmd('Runtime.evaluate', {
+            'expression': fetch_script,
+            'awaitPromise': True,
+            'returnByValue': True
+        })
+        
+        result_data = cdp_result.get('result', {})
+        
+        if cdp_result.get('exceptionDetails'):
+            exception = cdp_result.get('exceptionDetails', {})
+            return failed(
+                exception.get('text', 'Unknown error'),
+                exception.get('exception', {}).get('description', 'Unknown exception')
+            )
+        elif result_data.get('type') == 'object' and isinstance(result_data.get('value'), list):
+            return [_parse_body(result) for result in result_data['value']]
+        else:
+            return failed('Unexpected result format', f"Result type: {result_data.get('type', 'unknown')}")
+    except Exception as e:
+        return failed('CDP execution error', str(e))
+
+
+def execute_cdp_requests(driver, api_urls: List[str], page_nums: List[int], pacer: Optional[AdaptivePacer] = None) -> List[Dict[str, Any]]:
+    """
+    Выполняем несколько запросов одним вызовом CDP с повторными попытками при ошибках.
+    Повторно запрашиваются только страницы, которые не вернули HTTP 200.
+    Темп запросов задает pacer (по умолчанию общий get_pacer()).
+    
+    Args:
+        driver: WebDriver объект
+        api_urls: Список URL для запроса
+        page_nums: Номера страниц (для сообщений)
+        pacer: Адаптивный темп запросов
+    
+    Returns:
+        Список словарей (json) с объявлениями, в том же порядке, что и api_urls
+    """
+    pacer = pacer or get_pacer()
+    results: List[Optional[Dict[str, Any]]] = [None] * len(api_urls)
+    pending = list(range(len(api_urls)))
+    retry_count = 0
+    
+    while retry_count <= MAX_RETRY_SCAN_URL:
+        if retry_count > 0:
+            delay = SCAN_RETRY.compute_delay(retry_count)
+            print(f"   ⏳ Повторная попытка {retry_count} из {MAX_RETRY_SCAN_URL} для страниц {[page_nums[i] for i in pending]}. Ждем {delay:.0f} секунд...")
+            time.sleep(delay)
+        
+        pacer.acquire(len(pending))
+        started = time.monotonic()
+        batch_results = _execute_cdp_request_batch(driver, [api_urls[i] for i in pending])
+        latency = time.monotonic() - started
+        
+        still_pending = []
+        for i, result in zip(pending, batch_results):
+            status = result.get('status', 'N/A')
+            pacer.record(status, latency)
+            if status == 200:
+                results[i] = result
+            else:
+                print(f"   ⚠️  Страница {page_nums[i]}: HTTP {status} ({result.get('statusText', 'N/A')})")
+                still_pending.append(i)
+        
+        if not still_pending:
+            return results
+        
+        pending = still_pending
+        retry_count += 1
+    
+    # Все попытки исчерпаны - завершаем программу
+    print(f"\n❌ Не удалось получить успешный ответ для страниц {[page_nums[i] for i in pending]} после {MAX_RETRY_SCAN_URL + 1} попыток")
+    print("Завершаем выполнение программы")
+    sys.exit(1)
+
+
+def execute_cdp_request(driver, api_url: str, page_num: int = 0, pacer: Optional[AdaptivePacer] = None):
     """
     Выполняем запрос через CDP с повторными попытками при ошибках.
+    Темп запросов задает pacer (по умолчанию общий get_pacer()).
     
     Args:
         driver: WebDriver объект
         api_url: URL для запроса
         page_num: Номер страницы (пока что не используется)
+        pacer: Адаптивный темп запросов
     
     Returns:
         Словарь (json) с объявлениями
     """
+    pacer = pacer or get_pacer()
     retry_count = 0
     
     while retry_count <= MAX_RETRY_SCAN_URL:
         if retry_count > 0:
-            delay = random.randint(30, 60)
-            print(f"   ⏳ Повторная попытка {retry_count} из {MAX_RETRY_SCAN_URL}. Ждем {delay} секунд...")
+            delay = SCAN_RETRY.compute_delay(retry_count)
+            print(f"   ⏳ Повторная попытка {retry_count} из {MAX_RETRY_SCAN_URL}. Ждем {delay:.0f} секунд...")
             time.sleep(delay)
         
+        pacer.acquire()
+        started = time.monotonic()
         result = _execute_cdp_request_single(driver, api_url)
         
         status = result.get('status', 'N/A')
         status_text = result.get('statusText', 'N/A')
+        pacer.record(status, time.monotonic() - started)
         
         if status == 200:
             return result  # Успешный запрос, возвращаем результат
@@ -261,9 +503,10 @@ def add_card_shot(conn, scan_session: int, external_id: int, external_url: str,
     
     def add_card_query(current_conn):
         with current_conn.cursor() as cursor:
-            cursor.execute(
-                "SELECT * FROM add_card_shot_v2(%s, %s, %s, %s)",
-                (scan_session, external_id, external_url, json.dumps(card))
+            execute_prepared(
+                cursor,
+                ADD_CARD_SHOT,
+                (scan_session, external_id, external_url, encode_card(card).decode('utf-8'))
             )
             result = cursor.fetchone()
             current_conn.commit()
@@ -278,7 +521,137 @@ def add_card_shot(conn, scan_session: int, external_id: int, external_url: str,
         raise
 
 
-def process_items(conn, scan_session: int, items: list, facet_name: str, file_name: str, db_config: str = None) -> Tuple[int, Any]:
+def add_card_shots(
+    conn,
+    scan_session: int,
+    cards: List[Tuple[int, str, dict]],
+    db_config: str = None,
+    card_hashes: Optional[List[str]] = None,
+    encoded_cards: Optional[List[bytes]] = None,
+) -> Tuple[Dict[int, int], Any]:
+    """
+    Сохраняет пачку карточек в БД одним запросом и одной транзакцией (add_card_shots_v2).
+    
+    Args:
+        conn: Подключение к БД (может быть пересоздано при обрыве)
+        scan_session: ID сессии сканирования
+        cards: Список кортежей (external_id, external_url, card)
+        db_config: Строка конфигурации БД для переподключения (обязательно для retry-логики)
+        card_hashes: Хеши карточек в том же порядке, что и cards (сохраняются в card_hash)
+        encoded_cards: Карточки, уже закодированные encode_card, в том же порядке, что и cards
+    
+    Returns:
+        Кортеж (словарь external_id -> card_id, новое соединение)
+    """
+    if not db_config:
+        raise ValueError("db_config обязателен для add_card_shots")
+    
+    if not cards:
+        return ({}, conn)
+    
+    external_ids = [int(external_id) for external_id, _, _ in cards]
+    external_urls = [external_url for _, external_url, _ in cards]
+    if encoded_cards is None:
+        encoded_cards = [encode_card(card) for _, _, card in cards]
+    card_jsons = decode_all(encoded_cards)
+    
+    def add_cards_query(current_conn):
+        with current_conn.cursor() as cursor:
+            execute_prepared(
+                cursor,
+                ADD_CARD_SHOTS,
+                (scan_session, external_ids, external_urls, card_jsons, card_hashes)
+            )
+            rows = cursor.fetchall()
+            current_conn.commit()
+            return {row[0]: row[1] for row in rows}
+    
+    try:
+        card_ids, conn = execute_db_query(conn, db_config, add_cards_query)
+        return (card_ids, conn)
+    except Exception as e:
+        # Если это не ошибка соединения, пробрасываем исключение
+        print(f"❌ Ошибка при сохранении пачки из {len(cards)} карточек: {e}")
+        raise
+
+
+def touch_card_shots(conn, scan_session: int, external_ids: List[int], card_hashes: List[str], db_config: str = None) -> Tuple[set, Any]:
+    """
+    Отмечает неизменившиеся карточки как увиденные в сессии, не перезаписывая их (touch_card_shots_v2).
+    
+    Returns:
+        Кортеж (множество external_id, которые удалось отметить, новое соединение).
+        Остальные карточки нужно сохранить полностью через add_card_shots
+    """
+    if not external_ids:
+        return (set(), conn)
+    
+    def touch_cards_query(current_conn):
+        with current_conn.cursor() as cursor:
+            execute_prepared(
+                cursor,
+                TOUCH_CARD_SHOTS,
+                (scan_session, external_ids, card_hashes)
+            )
+            rows = cursor.fetchall()
+            current_conn.commit()
+            return {row[0] for row in rows}
+    
+    return execute_db_query(conn, db_config, touch_cards_query)
+
+
+# Локальное хранилище хешей карточек (SKIP_UNCHANGED_CARDS), открывается при первом обращении
+_card_hash_store: Optional[CardHashStore] = None
+_card_hash_store_lock = threading.Lock()
+# Отправка карточек в DIP вместе с записью их хешей и фиксация хешей вместе с отправкой
+# пачек в DIP выполняются под этой блокировкой: иначе можно зафиксировать хеш карточки,
+# которая еще лежит в неотправленной пачке
+_card_hash_commit_lock = threading.Lock()
+_pages_since_hash_commit = 0
+
+
+def get_card_hash_store() -> Optional[CardHashStore]:
+    """Возвращает общее хранилище хешей или None, если SKIP_UNCHANGED_CARDS выключен"""
+    global _card_hash_store
+    if not SKIP_UNCHANGED_CARDS:
+        return None
+    with _card_hash_store_lock:
+        if _card_hash_store is None:
+            _card_hash_store = CardHashStore(CARD_HASH_DB)
+        return _card_hash_store
+
+
+def commit_card_hashes() -> None:
+    """Отправляет накопленные пачки в DIP и фиксирует хеши отправленных карточек"""
+    global _pages_since_hash_commit
+    with _card_hash_commit_lock:
+        flush_dip_batches()
+        if _card_hash_store is not None:
+            _card_hash_store.commit()
+        _pages_since_hash_commit = 0
+
+
+def commit_card_hashes_periodically() -> None:
+    """Вызывается после каждой страницы: раз в CARD_HASH_COMMIT_EVERY страниц фиксирует хеши"""
+    global _pages_since_hash_commit
+    with _card_hash_commit_lock:
+        _pages_since_hash_commit += 1
+        if _pages_since_hash_commit < CARD_HASH_COMMIT_EVERY:
+            return
+    commit_card_hashes()
+
+
+def close_card_hash_store() -> None:
+    """Фиксирует хеши и закрывает хранилище. Вызывать после close_dip_publisher()"""
+    global _card_hash_store
+    with _card_hash_store_lock:
+        if _card_hash_store is not None:
+            _card_hash_store.commit()
+            _card_hash_store.close()
+            _card_hash_store = None
+
+
+def process_items(conn, scan_session: int, items: list, facet_name: str, file_name: str, db_config: str = None, source_id: Optional[str] = None) -> Tuple[int, Any]:
     """
     Обрабатывает список объявлений и возвращает максимальную цену и обновленное соединение
     
@@ -289,11 +662,13 @@ def process_items(conn, scan_session: int, items: list, facet_name: str, file_na
         facet_name: Название фасета
         file_name: Имя файла
         db_config: Строка конфигурации БД для переподключения (опционально)
+        source_id: Идентификатор страницы в очереди записей для message_id сообщений DIP (опционально)
     
     Returns:
         Кортеж (min_price, обновленное соединение)
     """
     min_price = 0
+    cards = []
     
     for item in items:
 
@@ -305,132 +680,249 @@ def process_items(conn, scan_session: int, items: list, facet_name: str, file_na
                 external_url = 'https://domclick.ru' + external_url
         
         if not external_id or not external_url:
-            print(f"!!!!!!!!!!! кажется этот элемент не карточка. item = ", item)
+            print("!!!!!!!!!!! кажется этот элемент не карточка. item = ", item)
             continue
 
-        # Сохраняем карточку в БД mirror
-        card_id, conn = add_card_shot(conn, scan_session, external_id, external_url, item, db_config=db_config)
-        if not card_id:
-            print(f"Карточка {external_id} не сохранена в БД")
-            sys.exit(1)
+        cards.append((external_id, external_url, item))
+
+    store = get_card_hash_store()
+    state = {'conn': conn}
+
+    def write_page():
+        """
+        Все записи страницы - одна транзакция и один commit. Внутри нее карточки
+        сохраняются пачками по CARD_SHOT_BATCH_SIZE - один запрос на пачку.
+        Returns:
+            (карточки для DIP: [(item, encoded)], новые хеши: [(external_id, hash)], число неизменившихся)
+        """
+        to_send = []
+        new_hashes = []
+        unchanged_count = 0
+        with unit_of_work(state['conn'], db_config) as uow:
+            page_conn = uow.conn
+            for start in range(0, len(cards), CARD_SHOT_BATCH_SIZE):
+                batch = cards[start:start + CARD_SHOT_BATCH_SIZE]
+                # Каждая карточка кодируется в JSON один раз: эти байты идут в хеш, в БД и в DIP
+                encoded = [encode_card(item) for _, _, item in batch]
+                hashes = None
+                changed = list(range(len(batch)))
+
+                if store is not None:
+                    # Карточки, которые не изменились с прошлого раза, только отмечаем в сессии
+                    hashes = {
+                        int(external_id): card_hash(item, CARD_HASH_IGNORE_KEYS, encoded=encoded_card)
+                        for (external_id, _, item), encoded_card in zip(batch, encoded)
+                    }
+                    known = store.get_many(list(hashes))
+                    unchanged_ids = [external_id for external_id, h in hashes.items() if known.get(external_id) == h]
+                    touched, page_conn = touch_card_shots(page_conn, scan_session, unchanged_ids, [hashes[i] for i in unchanged_ids], db_config=db_config)
+                    changed = [i for i in changed if int(batch[i][0]) not in touched]
+                    unchanged_count += len(touched)
+
+                changed_hashes = [hashes[int(batch[i][0])] for i in changed] if hashes else None
+                card_ids, page_conn = add_card_shots(
+                    page_conn,
+                    scan_session,
+                    [batch[i] for i in changed],
+                    db_config=db_config,
+                    card_hashes=changed_hashes,
+                    encoded_cards=[encoded[i] for i in changed],
+                )
 
-        # Отправляем карточку в DIP 
-        send_to_dip(item, DIP_MODULE_ID, file_name)
+                for i in changed:
+                    external_id, external_url, item = batch[i]
+                    if not card_ids.get(int(external_id)):
+                        print(f"Карточка {external_id} не сохранена в БД")
+                        sys.exit(1)
+                    to_send.append((item, encoded[i]))
+                    if hashes is not None:
+                        new_hashes.append((int(external_id), hashes[int(external_id)]))
+        state['conn'] = uow.conn
+        return to_send, new_hashes, unchanged_count
 
+    def on_retry(attempt_num, delay, error, result):
+        # Результаты оборванной транзакции не используем: страница записывается заново целиком
+        print(f"⚠️ {error}. Записываем страницу заново через {delay:.1f} секунд...")
+        state['conn'] = None
+
+    to_send, new_hashes, unchanged_count = DB_RETRY.call(write_page, retry_on=(TransactionLostError,), on_retry=on_retry)
+    conn = state['conn']
+
+    # В DIP уходит ровно то, что зафиксировано в БД (карточки страницы уходят одним сообщением)
+    with _card_hash_commit_lock:
+        for item, encoded_card in to_send:
+            send_to_dip_batched(item, DIP_MODULE_ID, file_name, encoded=encoded_card, source_id=source_id)
+        if store is not None:
+            store.put_many(scan_session, new_hashes)
+
+    for external_id, external_url, item in cards:
         if price := item.get('price'):
             if price > min_price:
                 min_price = price
+
+    if store is not None:
+        # Хеши фиксируются по ходу сессии: после падения сканера заново в DIP уйдут
+        # только карточки последних страниц, а не всей сессии
+        commit_card_hashes_periodically()
+
+    if unchanged_count:
+        print(f"   Без изменений: {unchanged_count} из {len(cards)}")
                 
     return (min_price, conn)
 
 
-def scan_pages(
-    driver,
-    conn,
-    scan_session: int,
-    scan_url: str,
-    page_num: int,
-    min_price: int,
-    facet_name: str,
-    file_name: str,
-    db_config: str = None
-) -> tuple:
+# Локальная очередь записей страниц (USE_WRITE_SPOOL), открывается при первом обращении
+_write_spool: Optional[Spool] = None
+_spool_drainer: Optional[SpoolDrainer] = None
+_spool_pool: Optional[ConnectionPool] = None
+_spool_conn = None
+_write_spool_lock = threading.Lock()
+
+
+def get_spool_drainer(db_config: str) -> Optional[SpoolDrainer]:
     """
-    Сканирует страницы от page_num до MAX_PAGES
-    
-    Args:
-        driver: WebDriver объект
-        conn: Подключение к БД
-        scan_session: ID сессии сканирования
-        scan_url: Начальный URL для сканирования
-        page_num: Начальный номер страницы
-        offer_type: Тип предложения
-        deal_type: Тип сделки
-        region_code: Код региона
-    
-    Returns:
-        Кортеж (page_num, min_price, scan_url) - последний номер страницы, минимальная цена и URL
+    Возвращает общий поток, который переносит страницы из очереди в БД и DIP,
+    или None, если USE_WRITE_SPOOL выключен. Страницы, оставшиеся в очереди
+    с прошлого запуска, поток начинает записывать сразу
     """
-    new_min_price = 0
-    
-    while page_num <= MAX_PAGES:
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f'\n[{current_time}]{GREEN}\n   facet_name = "{facet_name}", \n   сессия = {scan_session}, min_price = {min_price}, page_num = {page_num}{RESET}')
-        print(f"   URL: {scan_url}")
-        time.sleep(random.randint(*INTERVAL))
+    global _write_spool, _spool_drainer, _spool_pool, _spool_conn
+    if not USE_WRITE_SPOOL:
+        return None
+    with _write_spool_lock:
+        if _spool_drainer is None:
+            _write_spool = Spool(WRITE_SPOOL_DB)
+            pending = _write_spool.count()
+            if pending:
+                print(f"   📼 В очереди записей {pending} страниц с прошлого запуска, дописываем их в БД и DIP")
+            # У потока свое подключение из общего пула
+            _spool_pool = get_db_pool(db_config)
+            _spool_conn = _spool_pool.acquire()
 
-        result = execute_cdp_request(driver, scan_url, page_num)
+            def replay_page(seq: int, kind: str, payload: bytes):
+                global _spool_conn
+                page = loads(payload)
+                # Повторная запись той же страницы (после перезапуска) дает те же message_id в DIP
+                page_max_price, _spool_conn = process_items(
+                    _spool_conn, page['scan_session'], page['items'], page['facet_name'], page['file_name'], db_config,
+                    source_id=f"{page['scan_session']}-{seq}",
+                )
+
+            # Страницы удаляются из очереди только после того, как карточки подтверждены в DIP
+            _spool_drainer = SpoolDrainer(_write_spool, replay_page, sync=flush_dip_batches, sync_every=WRITE_SPOOL_SYNC_EVERY)
+    return _spool_drainer
 
-        # Извлекаем body.catalog.items - это массив объявлений
-        items = result.get('body', {}).get('result', {}).get('items')
-        
-        items_count = len(items)
-        print(f"   Получено карточек: {items_count}")
-
-        if not items_count:
-            # Сохраняем body в файл result.json
-            # body_data = result.get('body', {})
-            # try:
-            #     with open('result.json', 'w', encoding='utf-8') as f:
-            #         json.dump(body_data, f, ensure_ascii=False, indent=2)
-            #     print(f"   💾 Сохранено body в result.json")
-            # except Exception as e:
-            #     print(f"   ⚠️  Ошибка при сохранении result.json: {e}")
-            
-            # если массив карточек пустой, значит прошлая страница была последней, закрываем сессию
-            def finish_session_query(current_conn):
-                with current_conn.cursor() as cursor:
-                    cursor.execute("SELECT finish_scan_session_v2(%s)", (scan_session,))
-                    result = cursor.fetchone()
-                    session_finished = result[0] if result else False
-                    current_conn.commit()
-                    return session_finished
-            
-            session_finished, conn = execute_db_query(conn, db_config, finish_session_query)
-            
-            if session_finished:
-                print(f"   ✅ Сессия {scan_session} завершена (finished_at установлен)")
-
-                # Отправляем объявления из прошлых сессий в статус "продано"
-                try:
-                    send_sold_to_mls(conn, scan_session, PROJECT_ID)
-                except Exception as e:
-                    print(f"   ⚠️  Ошибка при отправке объявлений в статус 'продано': {e}")
-            else:
-                print(f"   ⚠️ Сессия {scan_session} не найдена в БД")
-            
-            print("Завершаем выполнение программы")
-            sys.exit(0)
-        
-        new_min_price, conn = process_items(conn, scan_session, items, facet_name, file_name, db_config)
-        # print(f"   Максимальная цена на странице = {new_min_price} (будет использована как pmin для следующего цикла)")
 
-        page_num = page_num + 1
-        scan_url = re.sub(r'&offset=\d+&', f'&offset={page_num*20-20}&', scan_url)
+def max_item_price(items: list) -> int:
+    """Максимальная цена объявлений страницы - с нее начинается следующий цикл"""
+    return max((item.get('price') or 0 for item in items), default=0)
+
+
+def store_page(conn, db_config: str, scan_session: int, items: list, facet_name: str, file_name: str) -> Tuple[int, Any]:
+    """
+    Сохраняет страницу объявлений: через локальную очередь (USE_WRITE_SPOOL),
+    не дожидаясь БД и RabbitMQ, или сразу через process_items
     
-    return page_num, new_min_price, scan_url, conn
+    Returns:
+        Кортеж (максимальная цена на странице, обновленное соединение)
+    """
+    drainer = get_spool_drainer(db_config)
+    if drainer is None:
+        return process_items(conn, scan_session, items, facet_name, file_name, db_config)
 
+    # Если фоновый поток остановился с ошибкой - сообщаем о ней здесь
+    drainer.check()
+    payload = dumps({
+        'scan_session': scan_session,
+        'items': items,
+        'facet_name': facet_name,
+        'file_name': file_name,
+    })
+    # Та же страница, полученная повторно, пока она в очереди, второй раз не добавляется
+    _write_spool.append('page', hashlib.blake2b(payload, digest_size=16).hexdigest(), payload)
+    drainer.notify()
+    return (max_item_price(items), conn)
 
 
-# ============================================================================== #
-# ============================================================================== #
+def drain_write_spool() -> None:
+    """Ждет, пока все уже полученные страницы будут записаны в БД и отправлены в DIP"""
+    if _spool_drainer is not None:
+        _spool_drainer.wait_drained()
 
-def main():
 
-    # ============================ ПОДКЛЮЧАЕМСЯ К БД ============================ #
-    db_config = Config.get_db_config('domclick')
-    conn = connect_to_db(db_config)
+def close_write_spool(timeout: float = 60.0) -> bool:
+    """
+    Дописывает очередь (не дольше timeout секунд) и закрывает ее. Вызывать до close_dip_publisher().
+    Недописанные страницы остаются в WRITE_SPOOL_DB до следующего запуска
     
+    Returns:
+        False, если фоновый поток так и не дождался БД или RabbitMQ. Он продолжает
+        держать общий publisher DIP, поэтому close_dip_publisher() вызывать нельзя - она зависнет
+    """
+    global _write_spool, _spool_drainer, _spool_pool, _spool_conn
+    with _write_spool_lock:
+        if _spool_drainer is None:
+            return True
+        try:
+            stopped = _spool_drainer.stop(timeout)
+        except BaseException as e:
+            print(f"   ⚠️ Ошибка при записи страниц из очереди: {e}")
+            stopped = True
+        # Если поток так и не дождался БД или RabbitMQ, очередь и подключение он еще использует
+        if stopped:
+            _write_spool.close()
+            _spool_pool.release(_spool_conn)
+        _write_spool = _spool_drainer = _spool_pool = _spool_conn = None
+        return stopped
+
 
-    # ===================== ФОРМИРУЕМ ССЫЛКУ ДЛЯ СКАНИРОВАНИЯ ===================== #
+def build_scan_url(
+    params_for_url: dict,
+    min_price: int = 0,
+    page_num: int = 1,
+    max_price: Optional[int] = None,
+    limit: int = 20,
+    sort_dir: str = 'asc',
+) -> str:
+    """
+    Формирует URL API Домклика для раздела
     
-    # Парсим аргументы командной строки
-    offer_type, deal_type, region_code = parse_arguments()
-    page_num = 1
+    Args:
+        params_for_url: Результат get_params_for_url_v2
+        min_price: Минимальная цена (sale_price__gte), 0 - без ограничения
+        page_num: Номер страницы (offset = page_num*limit-limit)
+        max_price: Максимальная цена включительно (sale_price__lte), None - без ограничения
+        limit: Объявлений на странице
+        sort_dir: Сортировка по цене, 'asc' или 'desc'
+    """
+    # базовый URL
+    scan_url = (
+        f"https://bff-search-web.domclick.ru/api/offers/v1?address={params_for_url['o_region']}&"
+        f"offset={page_num*limit-limit}&limit={limit}&sort=price&sort_dir={sort_dir}&deal_type={params_for_url['o_deal_type']}&"
+        f"category={params_for_url['o_category']}&"
+    )
+    
+    # для Коммерческой и Гаражей offer_type отсутствует
+    if params_for_url.get('o_offer_type'):
+        scan_url += f"offer_type={params_for_url.get('o_offer_type')}&"
+    
+    scan_url += f"aids={params_for_url['o_aids']}"
+    
+    # добавляем min_price
+    if min_price > 0:
+        scan_url += f"&sale_price__gte={min_price}" # rent_price__gte
+    if max_price is not None:
+        scan_url += f"&sale_price__lte={max_price}"
+    
+    return scan_url
 
-    scan_url = ''
-    # scan_url = 'https://bff-search-web.domclick.ru/api/offers/v1?address=1d1463ae-c80f-4d19-9331-a1b68a85b553&offset=0&limit=20&sort=price&sort_dir=asc&deal_type=sale&category=living&offer_type=layout&offer_type=flat&aids=2299&sale_price__gte=1000'
 
+def prepare_facet(conn, db_config: str, offer_type: str, deal_type: str, region_code: str) -> Tuple[Optional[dict], Any]:
+    """
+    Получает из БД параметры URL, facet name для DIP и сессию сканирования раздела
+    
+    Returns:
+        Кортеж (словарь с параметрами раздела или None, если раздел не найден, обновленное соединение)
+    """
     def get_params_for_url_query(current_conn):
         # with - контекстный менеджер, гарантирует автоматическое закрытие ресурса при выходе из блока
         with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
@@ -441,20 +933,7 @@ def main():
             return cursor.fetchone()
     
     params_for_url, conn = execute_db_query(conn, db_config, get_params_for_url_query)
-    # Формируем базовый URL
-    scan_url = (
-        f"https://bff-search-web.domclick.ru/api/offers/v1?address={params_for_url['o_region']}&"
-        f"offset=0&limit=20&sort=price&sort_dir=asc&deal_type={params_for_url['o_deal_type']}&"
-        f"category={params_for_url['o_category']}&"
-    )
-        
-    # для Коммерческой и Гаражей offer_type отсутствует
-    if params_for_url.get('o_offer_type'):
-        scan_url += f"offer_type={params_for_url.get('o_offer_type')}&"
-        
-    scan_url += f"aids={params_for_url['o_aids']}"
-    
-        
+
 
     # ============================ ПОЛУЧАЕМ FACET NAME ДЛЯ DIP ============================ #
     def get_facet_name_query(current_conn):
@@ -472,15 +951,15 @@ def main():
         
     if not facet_name:
         print(f"Не удалось получить facet для region_code='{region_code}', deal_type='{deal_type}', offer_type='{offer_type}'")
-        sys.exit(1)
-
+        return None, conn
 
 
     # =============================== ПОЛУЧАЕМ СЕССИЮ ================================ #
     def get_or_create_session_query(current_conn):
         with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "SELECT * FROM get_or_create_scan_session_v2(%s, %s, %s)",
+            execute_prepared(
+                cursor,
+                GET_OR_CREATE_SESSION,
                 (region_code, deal_type, offer_type)
             )
             result = cursor.fetchone()
@@ -492,14 +971,222 @@ def main():
     min_price = result['_min_price']
     page_num = result['_page_num']
     
-    if min_price > 0:
-        scan_url = f"{scan_url}&sale_price__gte={min_price}" # rent_price__gte
-    if page_num < MAX_PAGES:
-        scan_url = scan_url.replace('&offset=0&', f'&offset={page_num*20-20}&')
+    scan_url = build_scan_url(params_for_url, min_price, page_num if page_num <= MAX_PAGES else 1)
 
     print(f"сессия = {scan_session}, min_price = {min_price}, page_num = {page_num}")
     print(f"\nscan_url = {scan_url}")
 
+    facet = {
+        'section': f"{offer_type}-{deal_type}-{region_code}",
+        'params_for_url': params_for_url,
+        'facet_name': facet_name,
+        # FILE_NAME для DIP
+        'file_name': f"domclick-{offer_type}-{deal_type}-{region_code}",
+        'scan_session': scan_session,
+        'min_price': min_price,
+        'page_num': page_num,
+        'scan_url': scan_url,
+    }
+    return facet, conn
+
+
+def update_session(conn, db_config: str, scan_session: int, page_num: int, min_price: int) -> Tuple[bool, Any]:
+    """
+    Сохраняет в сессии, откуда продолжать сканирование (update_scan_session_v2)
+    
+    Returns:
+        Кортеж (сессия обновлена, обновленное соединение)
+    """
+    def update_session_query(current_conn):
+        with current_conn.cursor() as cursor:
+            execute_prepared(
+                cursor,
+                UPDATE_SESSION,
+                (scan_session, page_num, min_price)
+            )
+            result = cursor.fetchone()
+            session_updated = result[0] if result else False
+            current_conn.commit()
+            return session_updated
+    
+    return execute_db_query(conn, db_config, update_session_query)
+
+
+def finish_session(conn, db_config: str, scan_session: int) -> Tuple[bool, Any]:
+    """
+    Закрывает сессию (finish_scan_session_v2) и отправляет объявления
+    из прошлых сессий в статус "продано"
+    
+    Returns:
+        Кортеж (сессия завершена, обновленное соединение)
+    """
+    # дожидаемся записи страниц из очереди: карточки, которые еще в ней, не должны уйти в проданные
+    drain_write_spool()
+    # отправляем в DIP все накопленные карточки и фиксируем их хеши
+    commit_card_hashes()
+
+    def finish_session_query(current_conn):
+        with current_conn.cursor() as cursor:
+            execute_prepared(cursor, FINISH_SESSION, (scan_session,))
+            result = cursor.fetchone()
+            session_finished = result[0] if result else False
+            current_conn.commit()
+            return session_finished
+    
+    session_finished, conn = execute_db_query(conn, db_config, finish_session_query)
+    
+    if session_finished:
+        print(f"   ✅ Сессия {scan_session} завершена (finished_at установлен)")
+
+        # Отправляем объявления из прошлых сессий в статус "продано"
+        try:
+            send_sold_to_mls(conn, scan_session, PROJECT_ID, SKIP_SESSIONS_COUNT)
+        except Exception as e:
+            print(f"   ⚠️  Ошибка при отправке объявлений в статус 'продано': {e}")
+    else:
+        print(f"   ⚠️ Сессия {scan_session} не найдена в БД")
+    
+    return session_finished, conn
+
+
+def scan_pages(
+    driver,
+    conn,
+    scan_session: int,
+    scan_url: str,
+    page_num: int,
+    min_price: int,
+    facet_name: str,
+    file_name: str,
+    db_config: str = None,
+    checkpointer: Optional[Checkpointer] = None
+) -> tuple:
+    """
+    Сканирует страницы от page_num до MAX_PAGES
+    
+    Args:
+        driver: WebDriver объект
+        conn: Подключение к БД
+        scan_session: ID сессии сканирования
+        scan_url: Начальный URL для сканирования
+        page_num: Начальный номер страницы
+        offer_type: Тип предложения
+        deal_type: Тип сделки
+        region_code: Код региона
+        checkpointer: Если задан, после записи каждой страницы в сессию ставится
+            контрольная точка (следующая страница, min_price цикла)
+    
+    Returns:
+        Кортеж (page_num, min_price, scan_url) - последний номер страницы, минимальная цена и URL
+    """
+    new_min_price = 0
+    
+    # Запись в БД и отправка в DIP идут в фоновом потоке,
+    # пока основной поток ждет своей очереди (AdaptivePacer) и получает следующую страницу
+    def process_page(current_conn, page):
+        page_num, items = page
+        page_max_price, current_conn = store_page(current_conn, db_config, scan_session, items, facet_name, file_name)
+
+        if checkpointer is not None:
+            # Страница записана: после перезапуска продолжаем со следующей.
+            # После последней страницы цикла - с первой страницы следующего цикла
+            if page_num >= MAX_PAGES:
+                checkpointer.record(scan_session, update_session, scan_session, 1, page_max_price)
+            else:
+                checkpointer.record(scan_session, update_session, scan_session, page_num + 1, min_price)
+
+        return page_max_price, current_conn
+    
+    worker = IngestWorker(conn, process_page, queue_size=PIPELINE_QUEUE_SIZE)
+    
+    try:
+        while page_num <= MAX_PAGES:
+            # Сколько страниц запрашиваем за один вызов CDP
+            page_nums = list(range(page_num, min(page_num + CDP_BATCH_PAGES, MAX_PAGES + 1)))
+            
+            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            pages_text = page_num if len(page_nums) == 1 else f"{page_nums[0]}-{page_nums[-1]}"
+            print(f'\n[{current_time}]{GREEN}\n   facet_name = "{facet_name}", \n   сессия = {scan_session}, min_price = {min_price}, page_num = {pages_text}{RESET}')
+            print(f"   URL: {scan_url}")
+
+            if len(page_nums) == 1:
+                results = [execute_cdp_request(driver, scan_url, page_num)]
+            else:
+                page_urls = [re.sub(r'&offset=\d+&', f'&offset={num*20-20}&', scan_url) for num in page_nums]
+                results = execute_cdp_requests(driver, page_urls, page_nums)
+
+            for result in results:
+                # Извлекаем body.catalog.items - это массив объявлений
+                items = result.get('body', {}).get('result', {}).get('items')
+                
+                items_count = len(items)
+                print(f"   Страница {page_num}. Получено карточек: {items_count}")
+
+                if not items_count:
+                    # Сохраняем body в файл result.json
+                    # body_data = result.get('body', {})
+                    # try:
+                    #     with open('result.json', 'w', encoding='utf-8') as f:
+                    #         json.dump(body_data, f, ensure_ascii=False, indent=2)
+                    #     print(f"   💾 Сохранено body в result.json")
+                    # except Exception as e:
+                    #     print(f"   ⚠️  Ошибка при сохранении result.json: {e}")
+                
+                    # если массив карточек пустой, значит прошлая страница была последней, закрываем сессию
+                    # перед этим дожидаемся записи всех страниц
+                    new_min_price, conn = worker.wait()
+                    if checkpointer is not None:
+                        checkpointer.flush()
+                    session_finished, conn = finish_session(conn, db_config, scan_session)
+                
+                    print("Завершаем выполнение программы")
+                    sys.exit(0)
+            
+                # Страница уходит на запись в фоновый поток, страницы пишутся строго по порядку
+                worker.submit((page_num, items))
+
+                page_num = page_num + 1
+                scan_url = re.sub(r'&offset=\d+&', f'&offset={page_num*20-20}&', scan_url)
+        
+        # Дожидаемся записи последних страниц цикла: min_price для следующего цикла
+        # берется с последней страницы, поэтому сессию можно обновлять только после этого
+        new_min_price, conn = worker.wait()
+        # print(f"   Максимальная цена на странице = {new_min_price} (будет использована как pmin для следующего цикла)")
+    finally:
+        worker.stop()
+    
+    return page_num, new_min_price, scan_url, conn
+
+
+
+# ============================================================================== #
+# ============================================================================== #
+
+def main():
+
+    # ============================ ПОДКЛЮЧАЕМСЯ К БД ============================ #
+    db_config = Config.get_db_config('domclick')
+    db_pool = get_db_pool(db_config)
+    conn = db_pool.acquire()
+    
+
+    # ============ ФОРМИРУЕМ ССЫЛКУ ДЛЯ СКАНИРОВАНИЯ, ПОЛУЧАЕМ FACET И СЕССИЮ ============ #
+    
+    # Парсим аргументы командной строки
+    offer_type, deal_type, region_code = parse_arguments()
+
+    facet, conn = prepare_facet(conn, db_config, offer_type, deal_type, region_code)
+    if not facet:
+        sys.exit(1)
+
+    params_for_url = facet['params_for_url']
+    facet_name = facet['facet_name']
+    file_name = facet['file_name']
+    scan_session = facet['scan_session']
+    min_price = facet['min_price']
+    page_num = facet['page_num'] if facet['page_num'] <= MAX_PAGES else 1
+    scan_url = facet['scan_url']
+
 
     # ============================ ПОДКЛЮЧАЕМСЯ К БРАУЗЕРУ ============================ #
     driver = None
@@ -507,16 +1194,16 @@ def main():
         driver = connecting_to_browser()
     except Exception as e:
         print(f"\n❌ Не удалось подключиться к браузеру: {e}")
-        if conn:
-            conn.close()
+        db_pool.release(conn)
+        close_db_pools()
         return
-    
-
-    # ========================== ФОРМИРУЕМ FILE_NAME ДЛЯ DIP ========================= #
-    file_name = f"domclick-{offer_type}-{deal_type}-{region_code}"
 
 
     # ========================= ПОЛУЧАЕМ ДАННЫЕ ПО scan_url ========================== #     
+    # Контрольные точки сессии пишет фоновый поток (подключение берет из того же пула)
+    checkpointer = Checkpointer(db_config, interval=CHECKPOINT_INTERVAL)
+    # Страницы, оставшиеся в локальной очереди с прошлого запуска, начинают записываться сразу
+    get_spool_drainer(db_config)
     try:
         while True:            
             # min_price для первого цикла берется из сессии, для последующих - из результата scan_pages
@@ -529,59 +1216,51 @@ def main():
                 min_price,
                 facet_name,
                 file_name,
-                db_config
+                db_config,
+                checkpointer
             )
             
             print(f"\n🔄 Обновляем сессию в БД: session_id={scan_session}, page_num=1, min_price={min_price}")
-            # Обновляем сессию в БД после завершения цикла с retry-логикой
-            def update_session_query(current_conn):
-                with current_conn.cursor() as cursor:
-                    cursor.execute(
-                        "SELECT update_scan_session_v2(%s::bigint, %s::smallint, %s::bigint)",
-                        (scan_session, 1, min_price)
-                    )
-                    result = cursor.fetchone()
-                    session_updated = result[0] if result else False
-                    current_conn.commit()
-                    return session_updated
-            
-            session_updated, conn = execute_db_query(conn, db_config, update_session_query)
-            
-            if session_updated:
-                print(f"✅ Сессия обновлена в БД\n")
-            else:
-                print(f"⚠️ Сессия {scan_session} не найдена в БД\n")
+            # Точку после последней страницы цикла уже поставил scan_pages,
+            # дожидаемся ее записи (с retry-логикой) в фоновом потоке
+            checkpointer.record(scan_session, update_session, scan_session, 1, min_price)
+            checkpointer.flush()
+            print("✅ Сессия обновлена в БД\n")
             
 
             # Формируем новый URL и начинаем снова с первой страницы
             print(f"   Формируем новый URL для следующего цикла с min_price={min_price}")
             page_num = 1
-            
-            # базовый URL
-            scan_url = (
-                f"https://bff-search-web.domclick.ru/api/offers/v1?address={params_for_url['o_region']}&"
-                f"offset=0&limit=20&sort=price&sort_dir=asc&deal_type={params_for_url['o_deal_type']}&"
-                f"category={params_for_url['o_category']}&"
-            )
-            
-            # для Коммерческой и Гаражей offer_type отсутствует
-            if params_for_url.get('o_offer_type'):
-                scan_url += f"offer_type={params_for_url.get('o_offer_type')}&"
-            
-            # добавляем min_price
-            scan_url += f"aids={params_for_url['o_aids']}&"
-            scan_url += f"sale_price__gte={min_price}"
+            scan_url = build_scan_url(params_for_url, min_price)
 
 
             print(f"   URL: {scan_url}\n")
     except KeyboardInterrupt:
         print("\n\n⚠️ Получено прерывание (Ctrl+C). Завершаем выполнение...")
     finally:
-        # Закрываем соединение с БД
-        if conn:
-            conn.close()
-            print("✓ Соединение с БД закрыто")
-            print(f"\n{'='*60}\n")
+        # Записываем последнюю контрольную точку и историю темпа запросов
+        checkpointer.stop()
+        close_pacer()
+        # Дописываем страницы из локальной очереди, пока открыты RabbitMQ и БД
+        if close_write_spool():
+            # Отправляем остатки и закрываем соединение с RabbitMQ
+            close_dip_publisher()
+            # Все карточки ушли в DIP - фиксируем их хеши
+            close_card_hash_store()
+        else:
+            # Фоновый поток все еще ждет RabbitMQ внутри отправки: не ждем его,
+            # хеши не фиксируем - страницы будут дописаны из очереди при следующем запуске
+            print("   ⚠️ RabbitMQ недоступен, соединение с ним не закрываем")
+
+        # websocket к DevTools закрываем сами (сам браузер продолжает работать)
+        if driver is not None and CDP_BACKEND == 'websocket':
+            driver.quit()
+
+        # Закрываем соединения с БД
+        db_pool.release(conn)
+        close_db_pools()
+        print("✓ Соединения с БД закрыты")
+        print(f"\n{'='*60}\n")
 
 
 if __name__ == "__main__":
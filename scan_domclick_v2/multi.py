@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Сканирование нескольких разделов Домклика одним процессом
+
+Разделы распределяются между браузерами из DEBUGGER_ENDPOINTS, на каждый браузер
+работает свой поток со своим подключением к БД. Внутри потока страницы разных
+разделов запрашиваются по очереди. Паузы между запросами задает только темп браузера:
+частота запросов через каждый браузер подстраивается под ответы сайта (AdaptivePacer),
+сумму запросов всех браузеров ограничивает PACER_TOTAL_MAX_RATE.
+При ошибках браузера запросы уходят в другие браузеры.
+Сессии (get_or_create_scan_session_v2 / update_scan_session_v2) у каждого раздела свои.
+
+Если USE_PRICE_SHARDS = True, каждый раздел делится на диапазоны цен (scan_domclick_v2/shards.py),
+и между браузерами распределяются уже шарды.
+
+Запуск:
+python3 -m scan_domclick_v2.multi flat-sale-msk layout-sale-msk room-sale-msk
+"""
+
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from scan_base.config import Config
+from scan_base.db import close_db_pools, get_db_pool
+from scan_base.send_to_dip import close_dip_publisher
+from scan_domclick_v2.browsers import BrowserPool, BrowserSlot
+from scan_domclick_v2.pipeline import Checkpointer, SessionFinisher
+from scan_domclick_v2.shards import finish_shard, prepare_shards, shard_done, update_shard
+from scan_domclick_v2.const import *
+from scan_domclick_v2.main import (
+    build_scan_url,
+    close_card_hash_store,
+    close_write_spool,
+    finish_session,
+    get_spool_drainer,
+    prepare_facet,
+    store_page,
+    update_session,
+)
+
+
+def parse_sections(argv: List[str]) -> List[Tuple[str, str, str]]:
+    """Разбирает разделы вида 'flat-sale-msk' в кортежи (offer_type, deal_type, region_code)"""
+    if not argv:
+        sys.exit("Укажите разделы для сканирования, например, 'flat-sale-msk room-sale-msk'")
+    sections = []
+    for section in argv:
+        parts = section.split('-')
+        if len(parts) != 3:
+            sys.exit(f"Неверный раздел '{section}', нужно, например, 'flat-sale-msk'")
+        sections.append((parts[0], parts[1], parts[2]))
+    return sections
+
+
+def complete_facet(conn, db_config: str, facet: dict, finisher: SessionFinisher) -> Any:
+    """
+    Помечает раздел (или шард раздела) завершенным. Сессия закрывается,
+    когда завершен весь раздел, то есть его последний шард: закрытие
+    и отправку проданных в MLS делает finisher в своем потоке.
+
+    Returns:
+        Обновленное соединение с БД
+    """
+    facet['finished'] = True
+
+    if facet.get('shard_id') is not None:
+        shard_finished, conn = finish_shard(conn, db_config, facet['shard_id'])
+        if not shard_done(facet):
+            return conn
+
+    finisher.submit(facet['scan_session'])
+    return conn
+
+
+def record_checkpoint(checkpointer: Checkpointer, facet: dict) -> None:
+    """Ставит контрольную точку раздела (или шарда): откуда продолжать после перезапуска"""
+    if facet.get('shard_id') is not None:
+        checkpointer.record(('shard', facet['shard_id']), update_shard, facet['shard_id'], facet['page_num'], facet['min_price'])
+    else:
+        checkpointer.record(facet['scan_session'], update_session, facet['scan_session'], facet['page_num'], facet['min_price'])
+
+
+def scan_facet_page(
+    pool: BrowserPool,
+    slot: Optional[BrowserSlot],
+    conn,
+    db_config: str,
+    facet: dict,
+    checkpointer: Checkpointer,
+    finisher: SessionFinisher,
+) -> Any:
+    """
+    Получает и обрабатывает одну страницу раздела (или шарда), двигает его на следующую страницу.
+    После каждой страницы ставит контрольную точку, после MAX_PAGES страниц
+    начинает новый цикл с min_price последней страницы.
+    Если страница пустая (у шарда - неполная) - помечает раздел завершенным.
+
+    Returns:
+        Обновленное соединение с БД
+    """
+    scan_session = facet['scan_session']
+    page_num = facet['page_num']
+    scan_url = build_scan_url(facet['params_for_url'], facet['min_price'], page_num, max_price=facet.get('max_price'))
+
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f'\n[{current_time}]{GREEN}\n   facet_name = "{facet["facet_name"]}", \n   сессия = {scan_session}, min_price = {facet["min_price"]}, page_num = {page_num}{RESET}')
+    print(f"   URL: {scan_url}")
+
+    result = pool.execute_cdp_request(scan_url, page_num, preferred=slot)
+
+    # Извлекаем body.catalog.items - это массив объявлений
+    items = result.get('body', {}).get('result', {}).get('items')
+    print(f"   Получено карточек: {len(items)}")
+
+    if not items:
+        # если массив карточек пустой, значит прошлая страница была последней, закрываем сессию
+        return complete_facet(conn, db_config, facet, finisher)
+
+    facet['last_page_price'], conn = store_page(conn, db_config, scan_session, items, facet['facet_name'], facet['file_name'])
+    facet['page_num'] = page_num + 1
+
+    if facet.get('shard_id') is not None and len(items) < 20:
+        # У шарда неполная страница - последняя, пустую следующую не запрашиваем
+        return complete_facet(conn, db_config, facet, finisher)
+
+    if facet['page_num'] > MAX_PAGES:
+        # Цикл из MAX_PAGES страниц закончен, следующий начинаем с максимальной цены последней страницы
+        next_min_price = facet['last_page_price']
+        if next_min_price <= facet['min_price']:
+            # Все страницы цикла - объявления с одной ценой: цикл с той же min_price вернул бы
+            # те же страницы. Остальные объявления с этой ценой API не отдает, переходим к следующей цене
+            print(f"   ⚠️ Больше {MAX_PAGES} страниц объявлений с ценой {facet['min_price']}, остальные пропускаем")
+            next_min_price = facet['min_price'] + 1
+            if facet.get('max_price') is not None and next_min_price > facet['max_price']:
+                return complete_facet(conn, db_config, facet, finisher)
+        facet['min_price'] = next_min_price
+        facet['page_num'] = 1
+        print(f"\n🔄 Новый цикл: {facet['section']}, page_num=1, min_price={facet['min_price']}")
+
+    # Страница записана - в фоне сохраняем, откуда продолжать
+    record_checkpoint(checkpointer, facet)
+
+    return conn
+
+
+def run_facets(
+    pool: BrowserPool,
+    slot: Optional[BrowserSlot],
+    conn,
+    db_config: str,
+    facets: List[dict],
+    stop: threading.Event,
+    checkpointer: Checkpointer,
+    finisher: SessionFinisher,
+) -> Any:
+    """
+    Сканирует разделы вперемешку, пока все не завершатся или не будет установлен stop.
+    Каждый раз берет раздел, который дольше всех ждет своей страницы.
+    Запросы идут через браузер slot и ждут его темпа (AdaptivePacer), отдельной паузы нет.
+
+    Returns:
+        Обновленное соединение с БД
+    """
+    active = list(facets)
+
+    while active and not stop.is_set():
+        facet = min(active, key=lambda f: f['fetched_at'])
+
+        conn = scan_facet_page(pool, slot, conn, db_config, facet, checkpointer, finisher)
+        facet['fetched_at'] = time.monotonic()
+
+        if facet['finished']:
+            active.remove(facet)
+            print(f"\n🏁 Раздел {facet['section']} завершен, осталось разделов: {len(active)}")
+
+    return conn
+
+
+def run_browser_worker(
+    pool: BrowserPool,
+    slot: BrowserSlot,
+    db_config: str,
+    facets: List[dict],
+    stop: threading.Event,
+    checkpointer: Checkpointer,
+    finisher: SessionFinisher,
+) -> None:
+    """Поток одного браузера: свое подключение к БД из общего пула и своя часть разделов"""
+    db_pool = get_db_pool(db_config)
+    conn = db_pool.acquire()
+    try:
+        conn = run_facets(pool, slot, conn, db_config, facets, stop, checkpointer, finisher)
+    finally:
+        db_pool.release(conn)
+
+
+def main():
+    sections = parse_sections(sys.argv[1:])
+
+    # ============================ ПОДКЛЮЧАЕМСЯ К БД ============================ #
+    db_config = Config.get_db_config('domclick')
+    # Один пул на все потоки: подключения браузеров, контрольных точек и основного потока
+    db_pool = get_db_pool(db_config)
+    conn = db_pool.acquire()
+
+
+    # =================== ПОЛУЧАЕМ ПАРАМЕТРЫ И СЕССИИ ВСЕХ РАЗДЕЛОВ =================== #
+    facets = []
+    for offer_type, deal_type, region_code in sections:
+        facet, conn = prepare_facet(conn, db_config, offer_type, deal_type, region_code)
+        if not facet:
+            print(f"⚠️ Раздел {offer_type}-{deal_type}-{region_code} пропущен")
+            continue
+
+        if facet['page_num'] > MAX_PAGES:
+            facet['page_num'] = 1
+        facets.append(facet)
+
+    if not facets:
+        db_pool.release(conn)
+        close_db_pools()
+        sys.exit(1)
+
+
+    # ============================ ПОДКЛЮЧАЕМСЯ К БРАУЗЕРАМ ============================ #
+    try:
+        pool = BrowserPool()
+    except Exception as e:
+        print(f"\n❌ Не удалось подключиться к браузеру: {e}")
+        db_pool.release(conn)
+        close_db_pools()
+        return
+
+
+    # Сессии закрывает (и отправляет проданные в MLS) отдельный поток, а не потоки браузеров
+    finisher = SessionFinisher(db_config, finish_session)
+
+
+    # ============================ ДЕЛИМ РАЗДЕЛЫ НА ШАРДЫ ============================ #
+    if USE_PRICE_SHARDS:
+        fetch = lambda api_url: pool.execute_cdp_request(api_url)
+        units = []
+        for facet in facets:
+            print(f"\n📐 Шарды раздела {facet['section']}")
+            shards, conn = prepare_shards(conn, db_config, facet, fetch)
+            if not shards:
+                # Все шарды пройдены до перезапуска, осталось закрыть сессию
+                finisher.submit(facet['scan_session'])
+            units.extend(shards)
+        facets = units
+
+    for facet in facets:
+        facet['last_page_price'] = 0
+        facet['fetched_at'] = 0.0
+        facet['finished'] = False
+
+
+    # ============================ СКАНИРУЕМ ВСЕ РАЗДЕЛЫ ============================ #
+    # Разделы раздаем браузерам по кругу, на каждый браузер - свой поток
+    workers = [(slot, facets[i::len(pool.slots)]) for i, slot in enumerate(pool.slots)]
+    workers = [(slot, part) for slot, part in workers if part]
+    stop = threading.Event()
+    # Контрольные точки всех разделов пишет один фоновый поток
+    checkpointer = Checkpointer(db_config, interval=CHECKPOINT_INTERVAL)
+    # Страницы всех разделов пишет в БД и DIP один фоновый поток из локальной очереди (USE_WRITE_SPOOL),
+    # оставшиеся с прошлого запуска страницы он начинает записывать сразу
+    get_spool_drainer(db_config)
+
+    executor = ThreadPoolExecutor(max_workers=max(len(workers), 1), thread_name_prefix='browser')
+    try:
+        futures = [executor.submit(run_browser_worker, pool, slot, db_config, part, stop, checkpointer, finisher) for slot, part in workers]
+        for future in futures:
+            future.result()
+        print("\nВсе разделы завершены")
+    except KeyboardInterrupt:
+        print("\n\n⚠️ Получено прерывание (Ctrl+C). Дописываем текущие страницы и завершаем выполнение...")
+    finally:
+        # Потоки заканчивают текущую страницу и выходят
+        stop.set()
+        executor.shutdown(wait=True)
+        checkpointer.stop()
+        # Дожидаемся закрытия сессий завершенных разделов
+        finisher.stop()
+        pool.report()
+        # Дописываем страницы из локальной очереди, пока открыты RabbitMQ и БД
+        if close_write_spool():
+            # Отправляем остатки и закрываем соединение с RabbitMQ
+            close_dip_publisher()
+            # Все карточки ушли в DIP - фиксируем их хеши
+            close_card_hash_store()
+        else:
+            # Фоновый поток все еще ждет RabbitMQ внутри отправки: не ждем его,
+            # хеши не фиксируем - страницы будут дописаны из очереди при следующем запуске
+            print("   ⚠️ RabbitMQ недоступен, соединение с ним не закрываем")
+
+        # websocket'ы к DevTools закрываем сами (сами браузеры продолжают работать)
+        pool.close()
+
+        # Закрываем соединения с БД
+        db_pool.release(conn)
+        close_db_pools()
+        print("✓ Соединения с БД закрыты")
+        print(f"\n{'='*60}\n")
+
+
+if __name__ == "__main__":
+    main()
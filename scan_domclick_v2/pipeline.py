@@ -0,0 +1,203 @@
+"""
+Конвейер сканирования: страницы получает основной поток, а сохранение в БД
+и отправку в DIP делает фоновый поток. Задержка перед запросом к Домклику
+и запись предыдущей страницы идут одновременно.
+Контрольные точки сессий тоже пишет фоновый поток (Checkpointer),
+а закрывает сессии (с отправкой проданных в MLS) - еще один (SessionFinisher).
+"""
+
+import queue
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from scan_base.db import get_db_pool
+
+
+class IngestWorker:
+    """
+    Фоновый поток, который обрабатывает страницы строго в порядке поступления.
+
+    process_page(conn, page) -> (max_price, conn) вызывается для каждой страницы,
+    page - то, что передано в submit().
+    Очередь ограничена queue_size страницами: если запись отстает, основной поток ждет.
+    Ошибка в потоке (включая sys.exit) пробрасывается в основной поток
+    при следующем submit() или wait().
+    """
+
+    def __init__(self, conn, process_page: Callable[[Any, Any], Tuple[int, Any]], queue_size: int = 3):
+        self.conn = conn
+        self.process_page = process_page
+        self.min_price = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name='ingest-worker', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            page = self._queue.get()
+            try:
+                if page is None:
+                    return
+                # После ошибки только вычерпываем очередь, чтобы wait() не завис
+                if self._error is None:
+                    self.min_price, self.conn = self.process_page(self.conn, page)
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, page: Any) -> None:
+        """Ставит страницу в очередь на запись"""
+        self._raise_error()
+        self._queue.put(page)
+
+    def wait(self) -> Tuple[int, Any]:
+        """
+        Ждет, пока все поставленные страницы будут записаны.
+
+        Returns:
+            Кортеж (максимальная цена на последней записанной странице, соединение с БД)
+        """
+        self._queue.join()
+        self._raise_error()
+        return self.min_price, self.conn
+
+    def stop(self) -> None:
+        """Дописывает очередь и останавливает поток"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+class Checkpointer:
+    """
+    Фоновая запись контрольных точек сессий (откуда продолжать после перезапуска).
+
+    record(key, write, *args) запоминает последнюю точку для key. Раз в interval секунд
+    фоновый поток записывает последние точки через подключение из общего пула БД:
+    write(conn, db_config, *args) -> (результат, conn). Промежуточные точки одного key
+    не записываются, поэтому частые record() не добавляют запросов к БД в основной цикл.
+    """
+
+    def __init__(self, db_config: str, interval: float = 1.0):
+        self.db_config = db_config
+        self.interval = interval
+        self.db_pool = get_db_pool(db_config)
+        self.written = 0
+        self._pending: Dict[Hashable, Tuple[Callable, tuple]] = {}
+        self._lock = threading.Lock()
+        # flush() из основного потока и фоновый поток не пишут одновременно
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='checkpointer', daemon=True)
+        self._thread.start()
+
+    def record(self, key: Hashable, write: Callable, *args) -> None:
+        """Запоминает точку для key, предыдущая незаписанная точка key заменяется"""
+        with self._lock:
+            self._pending[key] = (write, args)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def _requeue(self, failed: Dict[Hashable, Tuple[Callable, tuple]]) -> None:
+        """Возвращает незаписанные точки в очередь, если для key еще не записана более новая"""
+        with self._lock:
+            for key, entry in failed.items():
+                self._pending.setdefault(key, entry)
+
+    def flush(self) -> None:
+        """
+        Сразу записывает все незаписанные точки. Точки, которые записать не удалось,
+        остаются в очереди и записываются при следующем flush()
+        """
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            try:
+                conn = self.db_pool.acquire()
+            except Exception as e:
+                print(f"   ⚠️ Не удалось сохранить контрольные точки: {e}")
+                self._requeue(pending)
+                return
+            failed = {}
+            try:
+                for key, (write, args) in pending.items():
+                    try:
+                        result, conn = write(conn, self.db_config, *args)
+                        self.written += 1
+                    except Exception as e:
+                        print(f"   ⚠️ Не удалось сохранить контрольную точку {key}: {e}")
+                        failed[key] = (write, args)
+            finally:
+                self.db_pool.release(conn)
+                self._requeue(failed)
+
+    def stop(self) -> None:
+        """Записывает последние точки и останавливает поток"""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+
+class SessionFinisher:
+    """
+    Фоновое закрытие сессий разделов: finish(conn, db_config, scan_session) -> (результат, conn).
+
+    Закрытие сессии включает проход по MLS (send_sold_to_mls), который может длиться долго.
+    Потоки браузеров только ставят сессию в очередь submit() и сразу переходят к следующим
+    страницам, не занимая браузер и его долю темпа запросов. Сессии закрываются по очереди
+    на подключении из общего пула БД. Ошибка закрытия печатается, остальные сессии
+    закрываются дальше (незакрытая сессия продолжится при следующем запуске).
+    """
+
+    def __init__(self, db_config: str, finish: Callable[[Any, str, int], Tuple[Any, Any]]):
+        self.db_config = db_config
+        self.finish = finish
+        self.db_pool = get_db_pool(db_config)
+        self.finished = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='session-finisher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            scan_session = self._queue.get()
+            try:
+                if scan_session is None:
+                    return
+                conn = self.db_pool.acquire()
+                try:
+                    result, conn = self.finish(conn, self.db_config, scan_session)
+                    self.finished += 1
+                finally:
+                    self.db_pool.release(conn)
+            except Exception as e:
+                print(f"   ⚠️ Не удалось закрыть сессию {scan_session}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def submit(self, scan_session: int) -> None:
+        """Ставит сессию в очередь на закрытие"""
+        self._queue.put(scan_session)
+
+    def wait(self) -> None:
+        """Ждет, пока будут закрыты все поставленные сессии"""
+        self._queue.join()
+
+    def stop(self) -> None:
+        """Закрывает оставшиеся в очереди сессии и останавливает поток"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
@@ -0,0 +1,249 @@
+"""
+Разбиение раздела Домклика на диапазоны цен (шарды).
+
+API отдает не больше MAX_PAGES страниц по одному запросу, поэтому раздел проходится
+циклами по MAX_PAGES страниц, и каждый следующий цикл начинается с sale_price__gte
+= цене последней карточки (карточки с этой ценой запрашиваются повторно).
+Шарды - непересекающиеся диапазоны [price_from, price_to], в каждом из которых
+не больше SHARD_MAX_ITEMS объявлений. Каждый шард проходится за один цикл,
+а разные шарды можно сканировать независимо и параллельно.
+
+Шарды сессии хранятся в таблице scan_shardlar_v2: после перезапуска
+сканируются только незавершенные шарды.
+"""
+
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from psycopg2.extras import RealDictCursor
+
+from scan_base.db import execute_db_query, execute_prepared, prepare_statement
+from scan_domclick_v2.const import *
+from scan_domclick_v2.main import build_scan_url
+
+
+# Контрольная точка шарда пишется после каждой страницы
+UPDATE_SHARD = prepare_statement(
+    'update_scan_shard_v2',
+    "SELECT update_scan_shard_v2(%s::bigint, %s::smallint, %s::bigint)",
+    ('int8', 'smallint', 'int8'),
+)
+
+
+def get_total(result: Dict[str, Any]) -> Optional[int]:
+    """Количество объявлений по запросу (body.result.pagination.total) или None"""
+    total = result.get('body', {}).get('result', {}).get('pagination', {}).get('total')
+    return int(total) if total is not None else None
+
+
+def probe_total(fetch: Callable[[str], Dict[str, Any]], params_for_url: dict, price_from: int, price_to: Optional[int]) -> Optional[int]:
+    """Запрашивает одно объявление из диапазона цен, чтобы узнать, сколько их всего"""
+    probe_url = build_scan_url(params_for_url, price_from, 1, max_price=price_to, limit=1)
+    return get_total(fetch(probe_url))
+
+
+def probe_max_price(fetch: Callable[[str], Dict[str, Any]], params_for_url: dict) -> Optional[int]:
+    """Цена самого дорогого объявления раздела или None"""
+    probe_url = build_scan_url(params_for_url, 0, 1, limit=1, sort_dir='desc')
+    items = fetch(probe_url).get('body', {}).get('result', {}).get('items') or []
+    price = items[0].get('price') if items else None
+    return int(price) if price else None
+
+
+def plan_shards(fetch: Callable[[str], Dict[str, Any]], params_for_url: dict, max_items: int = SHARD_MAX_ITEMS) -> List[dict]:
+    """
+    Делит раздел на непересекающиеся диапазоны цен, в каждом из которых не больше max_items объявлений.
+    Диапазон, в котором объявлений больше, делится пополам по цене, пока не поместится.
+    Соседние маленькие диапазоны потом склеиваются, чтобы шардов было меньше.
+    Последний шард без верхней границы, чтобы не потерять объявления дороже найденного максимума.
+
+    Args:
+        fetch: Функция, которая выполняет запрос к API и возвращает ответ с HTTP 200
+        params_for_url: Результат get_params_for_url_v2
+        max_items: Максимум объявлений в шарде
+
+    Returns:
+        Список словарей {'price_from', 'price_to', 'total'} по возрастанию цены
+    """
+    max_price = probe_max_price(fetch, params_for_url)
+    total = probe_total(fetch, params_for_url, 0, max_price) if max_price else None
+
+    if max_price is None or total is None:
+        print("   ⚠️ Не удалось узнать количество объявлений, раздел сканируется одним шардом")
+        return [{'price_from': 0, 'price_to': None, 'total': total}]
+
+    leaves = []
+
+    def split(low: int, high: int, count: int):
+        if count <= max_items:
+            leaves.append({'price_from': low, 'price_to': high, 'total': count})
+            return
+        if high <= low:
+            # Диапазон из одной цены делить дальше нельзя: шард сканируется до MAX_PAGES страниц,
+            # остальные объявления с этой ценой API не отдаст (см. scan_facet_page в multi.py)
+            print(f"   ⚠️ {count} объявлений с ценой {low}, больше, чем помещается в MAX_PAGES страниц")
+            leaves.append({'price_from': low, 'price_to': high, 'total': count})
+            return
+        mid = (low + high) // 2
+        left = probe_total(fetch, params_for_url, low, mid)
+        if left is None:
+            leaves.append({'price_from': low, 'price_to': high, 'total': count})
+            return
+        split(low, mid, left)
+        # Правую половину не запрашиваем: объявления в ней - это все остальные
+        split(mid + 1, high, max(count - left, 0))
+
+    split(0, max_price, total)
+
+    # Склеиваем соседние шарды, пока они помещаются в max_items
+    shards = []
+    for leaf in leaves:
+        if shards and shards[-1]['total'] + leaf['total'] <= max_items:
+            shards[-1]['price_to'] = leaf['price_to']
+            shards[-1]['total'] += leaf['total']
+        else:
+            shards.append(dict(leaf))
+    shards[-1]['price_to'] = None
+
+    print(f"   ✓ {total} объявлений разделены на {len(shards)} шардов")
+    return shards
+
+
+def load_shards(conn, db_config: str, scan_session: int) -> Tuple[List[dict], Any]:
+    """
+    Returns:
+        Кортеж (шарды сессии из scan_shardlar_v2, обновленное соединение)
+    """
+    def get_shards_query(current_conn):
+        with current_conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("SELECT * FROM get_scan_shards_v2(%s)", (scan_session,))
+            return cursor.fetchall()
+
+    return execute_db_query(conn, db_config, get_shards_query)
+
+
+def save_shards(conn, db_config: str, scan_session: int, shards: List[dict]) -> Tuple[List[dict], Any]:
+    """
+    Сохраняет план шардов сессии одним запросом
+
+    Returns:
+        Кортеж (шарды в формате load_shards, обновленное соединение)
+    """
+    def add_shards_query(current_conn):
+        with current_conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT * FROM add_scan_shards_v2(%s, %s::int8[], %s::int8[], %s::int[])",
+                (
+                    scan_session,
+                    [s['price_from'] for s in shards],
+                    [s['price_to'] for s in shards],
+                    [s['total'] for s in shards],
+                )
+            )
+            shard_ids = {row[1]: row[0] for row in cursor.fetchall()}
+            current_conn.commit()
+            return shard_ids
+
+    shard_ids, conn = execute_db_query(conn, db_config, add_shards_query)
+    saved = [
+        {
+            'o_shard_id': shard_ids[s['price_from']],
+            'o_price_from': s['price_from'],
+            'o_price_to': s['price_to'],
+            'o_total': s['total'],
+            'o_page_num': 1,
+            'o_min_price': s['price_from'],
+            'o_finished': False,
+        }
+        for s in shards
+    ]
+    return saved, conn
+
+
+def update_shard(conn, db_config: str, shard_id: int, page_num: int, min_price: int) -> Tuple[bool, Any]:
+    """
+    Сохраняет, откуда продолжать шард (update_scan_shard_v2)
+
+    Returns:
+        Кортеж (шард обновлен, обновленное соединение)
+    """
+    def update_shard_query(current_conn):
+        with current_conn.cursor() as cursor:
+            execute_prepared(
+                cursor,
+                UPDATE_SHARD,
+                (shard_id, page_num, min_price)
+            )
+            result = cursor.fetchone()
+            current_conn.commit()
+            return result[0] if result else False
+
+    return execute_db_query(conn, db_config, update_shard_query)
+
+
+def finish_shard(conn, db_config: str, shard_id: int) -> Tuple[bool, Any]:
+    """
+    Отмечает шард пройденным (finish_scan_shard_v2)
+
+    Returns:
+        Кортеж (шард завершен, обновленное соединение)
+    """
+    def finish_shard_query(current_conn):
+        with current_conn.cursor() as cursor:
+            cursor.execute("SELECT finish_scan_shard_v2(%s)", (shard_id,))
+            result = cursor.fetchone()
+            current_conn.commit()
+            return result[0] if result else False
+
+    return execute_db_query(conn, db_config, finish_shard_query)
+
+
+def prepare_shards(conn, db_config: str, facet: dict, fetch: Callable[[str], Dict[str, Any]]) -> Tuple[List[dict], Any]:
+    """
+    Возвращает незавершенные шарды раздела: из scan_shardlar_v2, если сессия уже
+    делилась на шарды, иначе делит раздел заново и сохраняет план.
+
+    Каждый шард - копия словаря раздела (prepare_facet) со своими min_price/max_price/page_num
+    и shard_id. У шардов одного раздела общий словарь 'shard_group': сессия раздела
+    закрывается, когда завершится последний шард.
+
+    Returns:
+        Кортеж (список шардов, обновленное соединение)
+    """
+    rows, conn = load_shards(conn, db_config, facet['scan_session'])
+
+    if rows:
+        print(f"   ✓ Сессия {facet['scan_session']} уже разделена на {len(rows)} шардов")
+    else:
+        rows, conn = save_shards(conn, db_config, facet['scan_session'], plan_shards(fetch, facet['params_for_url']))
+
+    unfinished = [row for row in rows if not row['o_finished']]
+    group = {'shards_left': len(unfinished), 'lock': threading.Lock()}
+    print(f"   Осталось шардов: {len(unfinished)} из {len(rows)}")
+
+    shards = []
+    for row in unfinished:
+        shard = dict(facet)
+        shard.update({
+            'section': f"{facet['section']} [{row['o_price_from']}..{row['o_price_to'] if row['o_price_to'] is not None else ''}]",
+            'shard_id': row['o_shard_id'],
+            'min_price': row['o_min_price'],
+            'max_price': row['o_price_to'],
+            'page_num': row['o_page_num'] if row['o_page_num'] <= MAX_PAGES else 1,
+            'shard_group': group,
+        })
+        shards.append(shard)
+    return shards, conn
+
+
+def shard_done(shard: dict) -> bool:
+    """
+    Уменьшает счетчик незавершенных шардов раздела
+
+    Returns:
+        True, если это был последний шард раздела и сессию пора закрывать
+    """
+    group = shard['shard_group']
+    with group['lock']:
+        group['shards_left'] -= 1
+        return group['shards_left'] == 0
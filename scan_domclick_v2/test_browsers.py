@@ -0,0 +1,85 @@
+import unittest
+from unittest import mock
+
+from scan_domclick_v2 import browsers
+from scan_domclick_v2.browsers import BrowserPool
+
+ENDPOINTS = [('127.0.0.1', 9222), ('127.0.0.1', 9223)]
+
+
+class FakeDriver:
+    """Браузер, который отвечает заданными статусами по очереди, а потом 200"""
+
+    def __init__(self, port: int, statuses=()):
+        self.port = port
+        self.statuses = list(statuses)
+        self.urls = []
+
+
+def fake_request(driver: FakeDriver, api_url: str):
+    driver.urls.append(api_url)
+    status = driver.statuses.pop(0) if driver.statuses else 200
+    return {'status': status, 'statusText': 'test', 'body': {'port': driver.port}}
+
+
+@mock.patch.object(browsers, 'MAX_RETRY_SCAN_URL', 5)
+@mock.patch.object(browsers, 'BROWSER_MAX_FAILURES', 2)
+@mock.patch.object(browsers, 'TokenBucket')
+@mock.patch.object(browsers, 'create_pacer')
+@mock.patch.object(browsers, '_execute_cdp_request_single', side_effect=fake_request)
+@mock.patch.object(browsers.time, 'sleep')
+class TestBrowserFailover(unittest.TestCase):
+    def make_pool(self, statuses_by_port):
+        drivers = {port: FakeDriver(port, statuses_by_port.get(port, ())) for _, port in ENDPOINTS}
+        with mock.patch.object(browsers, 'connecting_to_browser', side_effect=lambda host, port, backend: drivers[port]):
+            pool = BrowserPool(ENDPOINTS)
+        return pool, drivers
+
+    def test_error_switches_to_other_browser_without_pause(self, sleep, request, create_pacer, token_bucket):
+        pool, drivers = self.make_pool({9222: [429]})
+
+        result = pool.execute_cdp_request('url', preferred=pool.slots[0])
+
+        self.assertEqual(result['body'], {'port': 9223})
+        self.assertEqual(len(drivers[9222].urls), 1)
+        sleep.assert_not_called()
+
+    def test_failing_browser_is_taken_out(self, sleep, request, create_pacer, token_bucket):
+        """После BROWSER_MAX_FAILURES ошибок подряд запросы браузера выполняет другой браузер"""
+        pool, drivers = self.make_pool({9222: [403, 403]})
+        first, second = pool.slots
+
+        pool.execute_cdp_request('url-1', preferred=first)
+        pool.execute_cdp_request('url-2', preferred=first)
+        pool.execute_cdp_request('url-3', preferred=first)
+
+        self.assertEqual(first.health.state, browsers.CircuitBreaker.OPEN)
+        self.assertEqual(drivers[9222].urls, ['url-1', 'url-2'])
+        self.assertEqual(drivers[9223].urls, ['url-1', 'url-2', 'url-3'])
+        # Все запросы идут через общий для браузеров потолок частоты
+        self.assertEqual(token_bucket.return_value.acquire.call_count, 5)
+
+    def test_single_browser_retries_after_pause(self, sleep, request, create_pacer, token_bucket):
+        pool, drivers = self.make_pool({9222: [500]})
+        pool.slots = pool.slots[:1]
+
+        result = pool.execute_cdp_request('url', preferred=pool.slots[0])
+
+        self.assertEqual(result['status'], 200)
+        self.assertEqual(drivers[9222].urls, ['url', 'url'])
+        sleep.assert_called_once()
+
+    def test_unreachable_browser_is_skipped(self, sleep, request, create_pacer, token_bucket):
+        def connect(host, port, backend):
+            if port == 9222:
+                raise ConnectionError("connection refused")
+            return FakeDriver(port)
+
+        with mock.patch.object(browsers, 'connecting_to_browser', side_effect=connect):
+            pool = BrowserPool(ENDPOINTS)
+
+        self.assertEqual([slot.port for slot in pool.slots], [9223])
+
+
+if __name__ == '__main__':
+    unittest.main()
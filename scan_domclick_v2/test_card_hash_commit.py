@@ -0,0 +1,36 @@
+import unittest
+from unittest import mock
+
+from scan_domclick_v2 import main
+
+
+@mock.patch.object(main, 'CARD_HASH_COMMIT_EVERY', 3)
+@mock.patch.object(main, '_pages_since_hash_commit', 0)
+@mock.patch.object(main, '_card_hash_store')
+@mock.patch.object(main, 'flush_dip_batches')
+class TestCardHashCommit(unittest.TestCase):
+    def test_commits_every_n_pages_after_dip_flush(self, flush_dip_batches, store):
+        """Хеши фиксируются раз в CARD_HASH_COMMIT_EVERY страниц и только после отправки пачек в DIP"""
+        calls = mock.Mock()
+        calls.attach_mock(flush_dip_batches, 'flush_dip_batches')
+        calls.attach_mock(store, 'store')
+
+        for _ in range(7):
+            main.commit_card_hashes_periodically()
+
+        self.assertEqual(calls.mock_calls, [
+            mock.call.flush_dip_batches(),
+            mock.call.store.commit(),
+        ] * 2)
+
+    def test_session_commit_resets_counter(self, flush_dip_batches, store):
+        main.commit_card_hashes_periodically()
+        main.commit_card_hashes_periodically()
+        main.commit_card_hashes()
+        main.commit_card_hashes_periodically()
+
+        self.assertEqual(store.commit.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import json
+import re
+import unittest
+from unittest import mock
+
+from scan_domclick_v2 import main
+
+
+class FakeBatchDriver:
+    """
+    Driver, который выполняет пакетный Runtime.evaluate: берет список URL из скрипта
+    и отвечает на каждый статусом из statuses[url] по очереди (потом 200)
+    """
+
+    def __init__(self, statuses=None):
+        self.statuses = {url: list(codes) for url, codes in (statuses or {}).items()}
+        self.calls = []
+
+    def execute_cdp_cmd(self, cmd, params):
+        urls = json.loads(re.search(r'const urls = (\[.*?\]);', params['expression']).group(1))
+        self.calls.append(urls)
+        results = []
+        for url in urls:
+            codes = self.statuses.get(url)
+            status = codes.pop(0) if codes else 200
+            results.append({'success': True, 'status': status, 'statusText': 'test', 'bodyText': json.dumps({'url': url})})
+        return {'result': {'type': 'object', 'value': results}}
+
+
+URLS = ['/offers?offset=0', '/offers?offset=20', '/offers?offset=40']
+
+
+@mock.patch.object(main, 'MAX_RETRY_SCAN_URL', 3)
+@mock.patch.object(main.time, 'sleep')
+class TestExecuteCdpRequests(unittest.TestCase):
+    def test_pages_in_one_evaluate(self, sleep):
+        driver = FakeBatchDriver()
+        pacer = mock.Mock()
+
+        results = main.execute_cdp_requests(driver, URLS, [1, 2, 3], pacer=pacer)
+
+        self.assertEqual(driver.calls, [URLS])
+        self.assertEqual([result['body'] for result in results], [{'url': url} for url in URLS])
+        pacer.acquire.assert_called_once_with(3)
+        self.assertEqual(pacer.record.call_count, 3)
+
+    def test_retries_only_failed_pages(self, sleep):
+        """Повторно запрашиваются только страницы без HTTP 200, порядок результатов сохраняется"""
+        driver = FakeBatchDriver({URLS[1]: [429]})
+
+        results = main.execute_cdp_requests(driver, URLS, [1, 2, 3], pacer=mock.Mock())
+
+        self.assertEqual(driver.calls, [URLS, [URLS[1]]])
+        self.assertEqual([result['body']['url'] for result in results], URLS)
+        sleep.assert_called_once()
+
+    def test_script_error_fails_every_page(self, sleep):
+        driver = mock.Mock()
+        driver.execute_cdp_cmd.return_value = {'exceptionDetails': {'text': 'Uncaught', 'exception': {'description': 'ReferenceError'}}}
+
+        results = main._execute_cdp_request_batch(driver, URLS)
+
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(not result['success'] and result['message'] == 'ReferenceError' for result in results))
+
+    def test_gives_up_after_max_retries(self, sleep):
+        driver = FakeBatchDriver({URLS[0]: [503] * 10})
+
+        with self.assertRaises(SystemExit):
+            main.execute_cdp_requests(driver, URLS, [1, 2, 3], pacer=mock.Mock())
+
+        self.assertEqual(len(driver.calls), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
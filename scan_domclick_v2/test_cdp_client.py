@@ -0,0 +1,129 @@
+import asyncio
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import websockets
+
+from scan_domclick_v2.cdp_client import CdpClient, CdpError
+
+
+class FakeDevTools:
+    """
+    Браузер с remote debugging: http://host:port/json со списком вкладок
+    и websocket вкладки, который отвечает на Runtime.evaluate.
+
+    Выражение определяет поведение: "sleep:<секунды>:<значение>" - ответ с задержкой,
+    "hang" - ответа нет, "drop" - соединение закрывается, "fail" - ошибка CDP.
+    """
+
+    async def start(self):
+        self.connections = 0
+        self.ws_server = await websockets.serve(self._handle, '127.0.0.1', 0)
+        ws_port = self.ws_server.sockets[0].getsockname()[1]
+        ws_url = f'ws://127.0.0.1:{ws_port}/devtools/page/1'
+        targets = json.dumps([
+            {'type': 'service_worker', 'url': 'https://example.com/sw.js', 'webSocketDebuggerUrl': 'ws://127.0.0.1:1/'},
+            {'type': 'page', 'url': 'https://domclick.ru/', 'webSocketDebuggerUrl': ws_url},
+        ]).encode('utf-8')
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(targets)))
+                self.end_headers()
+                self.wfile.write(targets)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.http_server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        self.port = self.http_server.server_address[1]
+
+    async def stop(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+        self.ws_server.close()
+        await self.ws_server.wait_closed()
+
+    async def _handle(self, ws):
+        self.connections += 1
+        tasks = []
+        async for raw in ws:
+            tasks.append(asyncio.create_task(self._answer(ws, json.loads(raw))))
+        for task in tasks:
+            task.cancel()
+
+    async def _answer(self, ws, command):
+        expression = command['params'].get('expression', '')
+        # События без id клиент должен пропускать
+        await ws.send(json.dumps({'method': 'Network.dataReceived', 'params': {}}))
+        if expression == 'hang':
+            return
+        if expression == 'drop':
+            await ws.close()
+            return
+        if expression == 'fail':
+            await ws.send(json.dumps({'id': command['id'], 'error': {'code': -32000, 'message': 'Target closed'}}))
+            return
+        value = expression
+        if expression.startswith('sleep:'):
+            _, delay, value = expression.split(':', 2)
+            await asyncio.sleep(float(delay))
+        await ws.send(json.dumps({'id': command['id'], 'result': {'result': {'type': 'string', 'value': value}}}))
+
+
+class TestCdpClient(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.browser = FakeDevTools()
+        await self.browser.start()
+        self.client = CdpClient('127.0.0.1', self.browser.port, url_hint='domclick.ru')
+        await self.client.connect()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.browser.stop()
+
+    async def evaluate(self, expression: str, timeout: float = 5.0) -> str:
+        result = await self.client.send('Runtime.evaluate', {'expression': expression}, timeout=timeout)
+        return result['result']['value']
+
+    async def test_picks_page_target(self):
+        self.assertEqual(self.client.target_url, 'https://domclick.ru/')
+
+    async def test_responses_matched_by_id(self):
+        """Ответы, пришедшие не по порядку, достаются своим командам"""
+        values = await asyncio.gather(
+            self.evaluate('sleep:0.2:first'),
+            self.evaluate('sleep:0.1:second'),
+            self.evaluate('third'),
+        )
+        self.assertEqual(values, ['first', 'second', 'third'])
+
+    async def test_cdp_error(self):
+        with self.assertRaisesRegex(CdpError, 'Target closed'):
+            await self.evaluate('fail')
+        self.assertEqual(await self.evaluate('after error'), 'after error')
+
+    async def test_timeout(self):
+        """Команда без ответа падает по таймауту, опоздавший ответ не достается следующей команде"""
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.evaluate('hang', timeout=0.1)
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.evaluate('sleep:0.3:late', timeout=0.1)
+        self.assertEqual(await self.evaluate('sleep:0.3:next'), 'next')
+        self.assertEqual(self.client._pending, {})
+
+    async def test_reconnect_after_drop(self):
+        """Команда, на которой оборвалось соединение, падает, следующая идет по новому соединению"""
+        with self.assertRaises(CdpError):
+            await self.evaluate('drop')
+        self.assertEqual(await self.evaluate('after reconnect'), 'after reconnect')
+        self.assertEqual(self.browser.connections, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
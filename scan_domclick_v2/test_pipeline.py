@@ -0,0 +1,191 @@
+import threading
+import unittest
+from unittest import mock
+
+from scan_domclick_v2.pipeline import Checkpointer, IngestWorker, SessionFinisher
+
+
+class TestIngestWorker(unittest.TestCase):
+    def make_worker(self, process_page, queue_size: int = 3) -> IngestWorker:
+        worker = IngestWorker('conn', process_page, queue_size=queue_size)
+        self.addCleanup(worker.stop)
+        return worker
+
+    def test_pages_written_in_order(self):
+        written = []
+
+        def process_page(conn, page):
+            written.append(page)
+            return page * 10, conn
+
+        worker = self.make_worker(process_page)
+        for page in range(1, 6):
+            worker.submit(page)
+
+        self.assertEqual(worker.wait(), (50, 'conn'))
+        self.assertEqual(written, [1, 2, 3, 4, 5])
+
+    def test_full_queue_blocks_fetching(self):
+        """Если запись отстает, submit() ждет, пока в очереди не появится место"""
+        release = threading.Event()
+        worker = self.make_worker(lambda conn, page: (release.wait(5), conn), queue_size=1)
+        worker.submit(1)
+        worker.submit(2)
+
+        third = threading.Thread(target=worker.submit, args=(3,))
+        third.start()
+        third.join(0.1)
+        self.assertTrue(third.is_alive())
+
+        release.set()
+        third.join(5)
+        self.assertFalse(third.is_alive())
+
+    def test_error_raised_in_caller(self):
+        """Ошибка записи пробрасывается в основной поток, следующие страницы не пишутся"""
+        written = []
+
+        def process_page(conn, page):
+            if page == 1:
+                raise RuntimeError("ошибка в запросе")
+            written.append(page)
+            return page, conn
+
+        worker = self.make_worker(process_page)
+        worker.submit(1)
+        worker.submit(2)
+
+        with self.assertRaises(RuntimeError):
+            worker.wait()
+        self.assertEqual(written, [])
+
+    def test_exit_in_worker_reaches_caller(self):
+        def process_page(conn, page):
+            raise SystemExit(1)
+
+        worker = self.make_worker(process_page)
+        worker.submit(1)
+
+        with self.assertRaises(SystemExit):
+            worker.wait()
+
+
+class FakePool:
+    def __init__(self, fail_acquires: int = 0):
+        self.fail_acquires = fail_acquires
+
+    def acquire(self):
+        if self.fail_acquires:
+            self.fail_acquires -= 1
+            raise ConnectionError("БД недоступна")
+        return 'conn'
+
+    def release(self, conn):
+        pass
+
+
+class CheckpointLog:
+    """write для Checkpointer: запоминает записанные точки, первые fail_writes записей падают"""
+
+    def __init__(self, fail_writes: int = 0):
+        self.fail_writes = fail_writes
+        self.written = []
+
+    def __call__(self, conn, db_config, session, page):
+        if self.fail_writes:
+            self.fail_writes -= 1
+            raise ConnectionError("соединение потеряно")
+        self.written.append((session, page))
+        return True, conn
+
+
+class TestCheckpointer(unittest.TestCase):
+    def make_checkpointer(self, pool: FakePool) -> Checkpointer:
+        with mock.patch('scan_domclick_v2.pipeline.get_db_pool', return_value=pool):
+            checkpointer = Checkpointer('host=db', interval=3600)
+        self.addCleanup(checkpointer.stop)
+        return checkpointer
+
+    def test_keeps_points_when_pool_is_unavailable(self):
+        checkpointer = self.make_checkpointer(FakePool(fail_acquires=1))
+        log = CheckpointLog()
+        checkpointer.record('facet', log, 1, 99)
+
+        checkpointer.flush()
+        self.assertEqual(log.written, [])
+        checkpointer.flush()
+
+        self.assertEqual(log.written, [(1, 99)])
+
+    def test_keeps_point_when_write_fails(self):
+        checkpointer = self.make_checkpointer(FakePool())
+        log = CheckpointLog(fail_writes=1)
+        checkpointer.record('facet', log, 1, 99)
+
+        checkpointer.flush()
+        checkpointer.flush()
+
+        self.assertEqual(log.written, [(1, 99)])
+
+    def test_newer_point_wins_over_failed_one(self):
+        """Пока запись падала, пришла более новая точка - старая не возвращается в очередь"""
+        checkpointer = self.make_checkpointer(FakePool())
+        log = CheckpointLog()
+
+        def record_newer_then_fail(conn, db_config, session, page):
+            checkpointer.record('facet', log, session, page + 1)
+            raise ConnectionError("соединение потеряно")
+
+        checkpointer.record('facet', record_newer_then_fail, 1, 98)
+        checkpointer.flush()
+        checkpointer.flush()
+
+        self.assertEqual(log.written, [(1, 99)])
+
+
+class TestSessionFinisher(unittest.TestCase):
+    def make_finisher(self, finish) -> SessionFinisher:
+        with mock.patch('scan_domclick_v2.pipeline.get_db_pool', return_value=FakePool()):
+            finisher = SessionFinisher('host=db', finish)
+        self.addCleanup(finisher.stop)
+        return finisher
+
+    def test_submit_does_not_wait_for_finish(self):
+        """Поток, поставивший сессию, не ждет закрытия сессии и прохода по MLS"""
+        release = threading.Event()
+        finished = []
+
+        def slow_finish(conn, db_config, scan_session):
+            release.wait(5)
+            finished.append((scan_session, threading.current_thread().name))
+            return True, conn
+
+        finisher = self.make_finisher(slow_finish)
+        finisher.submit(1)
+        self.assertEqual(finished, [])
+
+        release.set()
+        finisher.wait()
+
+        self.assertEqual(finished, [(1, 'session-finisher')])
+
+    def test_failed_session_does_not_stop_others(self):
+        finished = []
+
+        def finish(conn, db_config, scan_session):
+            if scan_session == 1:
+                raise RuntimeError("ошибка в запросе")
+            finished.append(scan_session)
+            return True, conn
+
+        finisher = self.make_finisher(finish)
+        finisher.submit(1)
+        finisher.submit(2)
+        finisher.stop()
+
+        self.assertEqual(finished, [2])
+        self.assertEqual(finisher.finished, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from unittest import mock
+
+import psycopg2
+
+from scan_domclick_v2 import main
+
+
+class FakeConnection:
+    def __init__(self, fail_commit: bool = False):
+        self.closed = 0
+        self.fail_commit = fail_commit
+        self.commits = 0
+
+    def commit(self):
+        if self.fail_commit:
+            self.closed = 2
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+def fake_add_card_shots(conn, scan_session, batch, db_config=None, **kwargs):
+    """add_card_shots, который выполняет запрос через execute_db_query, как настоящий"""
+    return main.execute_db_query(conn, db_config, lambda current_conn: {int(external_id): 10 for external_id, _, _ in batch})
+
+
+ITEMS = [
+    {'id': 1, 'path': '/card/1', 'price': 100},
+    {'id': 2, 'path': '/card/2', 'price': 300},
+]
+
+
+@mock.patch('scan_base.retry.time.sleep')
+@mock.patch.object(main, 'get_card_hash_store', return_value=None)
+@mock.patch.object(main, 'send_to_dip_batched')
+@mock.patch.object(main, 'add_card_shots')
+class TestProcessItems(unittest.TestCase):
+    def test_lost_commit_rewrites_page_before_dip(self, add_card_shots, send_to_dip_batched, get_card_hash_store, sleep):
+        """Оборванный commit: страница записывается заново, в DIP уходят карточки один раз и только после commit"""
+        lost_conn = FakeConnection(fail_commit=True)
+        new_conn = FakeConnection()
+        add_card_shots.side_effect = fake_add_card_shots
+
+        with mock.patch('scan_base.db.psycopg2.connect', return_value=new_conn):
+            min_price, conn = main.process_items(lost_conn, 5, ITEMS, 'facet', 'file', 'host=db')
+
+        self.assertEqual(add_card_shots.call_count, 2)
+        self.assertEqual([c.args[0]['id'] for c in send_to_dip_batched.call_args_list], [1, 2])
+        self.assertEqual(new_conn.commits, 1)
+        self.assertIs(conn, new_conn)
+        self.assertEqual(min_price, 300)
+
+    def test_failed_page_sends_nothing_to_dip(self, add_card_shots, send_to_dip_batched, get_card_hash_store, sleep):
+        add_card_shots.side_effect = RuntimeError("ошибка в запросе")
+
+        with self.assertRaises(RuntimeError):
+            main.process_items(FakeConnection(), 5, ITEMS, 'facet', 'file', 'host=db')
+
+        send_to_dip_batched.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
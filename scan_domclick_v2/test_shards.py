@@ -0,0 +1,120 @@
+import unittest
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from scan_domclick_v2 import multi
+from scan_domclick_v2.shards import plan_shards
+
+PARAMS_FOR_URL = {'o_region': 'region', 'o_deal_type': 'sale', 'o_category': 'living', 'o_offer_type': 'flat', 'o_aids': 1}
+
+
+class FakeDomclick:
+    """API Домклика над списком цен: фильтр по цене, сортировка, offset/limit и pagination.total"""
+
+    def __init__(self, prices):
+        self.prices = sorted(prices)
+        self.requests = 0
+
+    def __call__(self, url):
+        self.requests += 1
+        query = {key: values[0] for key, values in parse_qs(urlparse(url).query).items()}
+        low = int(query.get('sale_price__gte', 0))
+        high = int(query['sale_price__lte']) if 'sale_price__lte' in query else None
+        prices = [p for p in self.prices if p >= low and (high is None or p <= high)]
+        if query['sort_dir'] == 'desc':
+            prices.reverse()
+        offset, limit = int(query['offset']), int(query['limit'])
+        items = [{'id': i, 'price': price} for i, price in enumerate(prices[offset:offset + limit])]
+        return {'body': {'result': {'items': items, 'pagination': {'total': len(prices)}}}}
+
+
+def shard_bounds(shards):
+    return [(s['price_from'], s['price_to'], s['total']) for s in shards]
+
+
+class TestPlanShards(unittest.TestCase):
+    def test_shards_cover_all_listings(self):
+        fetch = FakeDomclick(range(1, 101))
+
+        shards = plan_shards(fetch, PARAMS_FOR_URL, max_items=30)
+
+        self.assertTrue(all(s['total'] <= 30 for s in shards))
+        self.assertEqual(sum(s['total'] for s in shards), 100)
+        self.assertEqual(shards[0]['price_from'], 0)
+        self.assertIsNone(shards[-1]['price_to'])
+        for left, right in zip(shards, shards[1:]):
+            self.assertEqual(left['price_to'] + 1, right['price_from'])
+
+    def test_small_facet_is_one_shard(self):
+        shards = plan_shards(FakeDomclick([10, 20, 30]), PARAMS_FOR_URL, max_items=30)
+
+        self.assertEqual(shard_bounds(shards), [(0, None, 3)])
+
+    def test_single_price_over_limit_becomes_one_shard(self):
+        """Объявлений с одной ценой больше max_items: шард на эту цену, без бесконечного деления"""
+        fetch = FakeDomclick([5] * 10 + [100] * 50 + [200] * 10)
+
+        shards = plan_shards(fetch, PARAMS_FOR_URL, max_items=30)
+
+        self.assertIn((100, 100, 50), shard_bounds(shards))
+        self.assertEqual(sum(s['total'] for s in shards), 70)
+        self.assertLess(fetch.requests, 50)
+
+    def test_unknown_total_is_one_shard(self):
+        shards = plan_shards(lambda url: {'body': {'result': {'items': []}}}, PARAMS_FOR_URL)
+
+        self.assertEqual(shard_bounds(shards), [(0, None, None)])
+
+
+class FakePool:
+    """BrowserPool, который отдает страницы FakeDomclick"""
+
+    def __init__(self, fetch):
+        self.fetch = fetch
+
+    def execute_cdp_request(self, url, page_num=None, preferred=None):
+        return self.fetch(url)
+
+
+@mock.patch.object(multi, 'MAX_PAGES', 2)
+@mock.patch.object(multi, 'finish_shard', return_value=(True, 'conn'))
+@mock.patch.object(multi, 'store_page', side_effect=lambda conn, db_config, session, items, *args: (max(i['price'] for i in items), conn))
+class TestSinglePriceShard(unittest.TestCase):
+    def make_shard(self, price_from, price_to):
+        return {
+            'scan_session': 1, 'section': 'flat-sale-msk', 'facet_name': 'facet', 'file_name': 'file',
+            'params_for_url': PARAMS_FOR_URL, 'min_price': price_from, 'max_price': price_to, 'page_num': 1,
+            'shard_id': 7, 'shard_group': {'shards_left': 1, 'lock': mock.MagicMock()},
+            'last_page_price': 0, 'finished': False,
+        }
+
+    def scan(self, shard, fetch, pages: int = 10):
+        pool = FakePool(fetch)
+        finisher = mock.Mock()
+        for _ in range(pages):
+            if shard['finished']:
+                break
+            multi.scan_facet_page(pool, None, 'conn', 'host=db', shard, mock.Mock(), finisher)
+        return finisher
+
+    def test_single_price_shard_finishes(self, store_page, finish_shard):
+        """Шард из одной цены больше MAX_PAGES страниц не начинает тот же цикл заново"""
+        shard = self.make_shard(100, 100)
+
+        finisher = self.scan(shard, FakeDomclick([100] * 100))
+
+        self.assertTrue(shard['finished'])
+        self.assertEqual(store_page.call_count, 2)
+        finisher.submit.assert_called_once_with(1)
+
+    def test_moves_past_overflowing_price(self, store_page, finish_shard):
+        shard = self.make_shard(100, None)
+
+        self.scan(shard, FakeDomclick([100] * 100 + [150] * 5))
+
+        self.assertTrue(shard['finished'])
+        self.assertEqual(store_page.call_args_list[-1].args[3], [{'id': i, 'price': 150} for i in range(5)])
+
+
+if __name__ == '__main__':
+    unittest.main()